@@ -0,0 +1,15 @@
+# __main__.py
+#
+# Lets the app run as `python -m image_editor_app [batch ...]` from the project
+# root. The modules import each other by plain name, as when running main.py
+# from inside this folder, so put this folder on the path first.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from main import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+# batch.py
+#
+# Headless batch processing: runs an ImageProcessor pipeline over many files on
+# a process pool, without importing tkinter. Example:
+#
+#   python main.py batch "photos/**/*.jpg" -o out -p "grayscale,blur:ksize=5,rotate:angle=90"
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from image_processor import OPERATIONS, ImageProcessor
+from pipeline_planner import run_fused
+
+
+def parse_pipeline(spec):
+    """
+    Turn a pipeline spec into a list of (name, params) operations.
+    Accepts "name:key=value:key=value,name2" text, a JSON list, or the path of a
+    JSON file holding [{"op": "blur", "ksize": 5}, ...].
+    """
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            spec = f.read()
+    text = spec.strip()
+    if text.startswith("["):
+        operations = []
+        for item in json.loads(text):
+            params = dict(item)
+            operations.append((params.pop("op"), params))
+    else:
+        operations = []
+        for part in filter(None, (p.strip() for p in text.split(","))):
+            name, *pairs = part.split(":")
+            params = {}
+            for pair in pairs:
+                key, _, value = pair.partition("=")
+                params[key.strip()] = _parse_value(value.strip())
+            operations.append((name.strip(), params))
+    for name, _ in operations:
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {name} (choose from {', '.join(OPERATIONS)})")
+    return operations
+
+
+def _parse_value(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+# ---------- Worker process ----------
+
+_worker_processor = None
+_worker_operations = None
+_worker_fuse = True
+
+
+def _init_worker(operations, fuse=True):
+    # The pipeline is sent once per worker instead of once per file
+    global _worker_processor, _worker_operations, _worker_fuse
+    _worker_processor = ImageProcessor()
+    _worker_operations = operations
+    _worker_fuse = fuse
+
+
+def _process_encoded(path, data, out_ext):
+    """Decode, process and encode one file. Runs in a pool worker."""
+    timings = {}
+    start = time.perf_counter()
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("Could not decode image.")
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if _worker_fuse:
+        result = run_fused(image, _worker_operations, _worker_processor)
+    else:
+        result = _worker_processor.apply_all(image, _worker_operations)
+    timings["process"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ok, encoded = cv2.imencode(out_ext, result)
+    if not ok:
+        raise ValueError(f"Could not encode image as {out_ext}.")
+    timings["encode"] = time.perf_counter() - start
+    return path, encoded.tobytes(), image.shape[:2], timings
+
+
+# ---------- Parent process ----------
+
+def _read_file(path):
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        data = f.read()
+    return path, data, time.perf_counter() - start
+
+
+def _write_file(path, data):
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return time.perf_counter() - start
+
+
+def expand_inputs(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        paths.extend(p for p in matches if os.path.isfile(p))
+    return paths
+
+
+def output_path(path, input_root, output_dir, out_ext):
+    relative = os.path.relpath(path, input_root) if input_root else os.path.basename(path)
+    base, ext = os.path.splitext(relative)
+    return os.path.join(output_dir, base + (out_ext or ext or ".png"))
+
+
+def output_paths(paths, input_root, output_dir, out_ext):
+    """
+    {input: output} for every path, relative to input_root (default: the
+    inputs' common folder, so files from different folders keep them). Raises
+    ValueError if an input lies outside the root or two inputs would be written
+    to the same file, e.g. photo.jpg and photo.png with --format png.
+    """
+    if input_root is None and paths:
+        input_root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+    targets = {}
+    sources = {}
+    for path in paths:
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(input_root))
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            raise ValueError(f"{path} is outside the root folder {input_root}.")
+        target = output_path(path, input_root, output_dir, out_ext)
+        key = os.path.normcase(os.path.abspath(target))
+        if key in sources:
+            raise ValueError(f"{sources[key]} and {path} would both be written to {target}.")
+        sources[key] = path
+        targets[path] = target
+    return targets
+
+
+def run_batch(paths, operations, output_dir, workers=None, max_in_flight=None,
+              out_ext=None, input_root=None, fuse=True):
+    """
+    Process paths through operations and write the results under output_dir.
+    Reading and writing happen on I/O threads while decode/process/encode runs
+    in worker processes, so the stages of different files overlap. At most
+    max_in_flight files are being processed at once, with up to `workers` more
+    read ahead. With fuse, neighbouring operations are merged into fewer passes
+    (see pipeline_planner). Output paths are checked up front (see
+    output_paths). Returns a report dict.
+    """
+    targets = output_paths(paths, input_root, output_dir, out_ext)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+    max_in_flight = max_in_flight or workers * 2
+    records = []
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=2) as io_pool, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(operations, fuse)) as pool:
+        remaining = iter(paths)
+        reads = deque()
+        in_flight = {}
+        writes = []
+
+        def top_up_reads():
+            while len(reads) < workers:
+                path = next(remaining, None)
+                if path is None:
+                    return
+                reads.append(io_pool.submit(_read_file, path))
+
+        top_up_reads()
+        while reads or in_flight:
+            # Hand finished reads to the pool while there is room
+            while reads and len(in_flight) < max_in_flight and reads[0].done():
+                read = reads.popleft()
+                try:
+                    path, data, read_s = read.result()
+                except OSError as e:
+                    records.append({"path": e.filename, "error": str(e)})
+                    continue
+                ext = out_ext or os.path.splitext(path)[1] or ".png"
+                future = pool.submit(_process_encoded, path, data, ext)
+                in_flight[future] = (path, read_s, ext, time.perf_counter())
+            top_up_reads()
+
+            waiting = list(in_flight)
+            if reads and len(in_flight) < max_in_flight:
+                waiting.append(reads[0])
+            done, _ = wait(waiting, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future not in in_flight:
+                    continue
+                path, read_s, ext, submitted = in_flight.pop(future)
+                record = {"path": path, "read": read_s}
+                try:
+                    _, encoded, shape, timings = future.result()
+                except Exception as e:
+                    record["error"] = str(e)
+                    records.append(record)
+                    continue
+                record.update(timings)
+                record["pixels"] = shape[0] * shape[1]
+                record["bytes"] = len(encoded)
+                record["latency"] = time.perf_counter() - submitted
+                writes.append((record, io_pool.submit(_write_file, targets[path], encoded)))
+                records.append(record)
+            top_up_reads()
+
+        for record, future in writes:
+            try:
+                record["write"] = future.result()
+            except OSError as e:
+                record["error"] = str(e)
+
+    return _summarise(records, time.perf_counter() - started, workers)
+
+
+def _summarise(records, wall, workers):
+    ok = [r for r in records if "error" not in r]
+    pixels = sum(r["pixels"] for r in ok)
+    stages = {}
+    for stage in ("read", "decode", "process", "encode", "write"):
+        stages[stage] = sum(r.get(stage, 0.0) for r in ok)
+    return {
+        "files": len(records),
+        "failed": len(records) - len(ok),
+        "workers": workers,
+        "wall_seconds": wall,
+        "files_per_second": len(ok) / wall if wall else 0.0,
+        "megapixels_per_second": pixels / 1e6 / wall if wall else 0.0,
+        "output_bytes": sum(r["bytes"] for r in ok),
+        "stage_seconds": stages,
+        "records": records,
+    }
+
+
+def print_report(report, per_file=True, out=sys.stdout):
+    if per_file:
+        print(f"{'file':40} {'size':>11} {'read':>7} {'decode':>7} {'process':>8} "
+              f"{'encode':>7} {'write':>7}  (ms)", file=out)
+        for r in report["records"]:
+            name = os.path.basename(r["path"])[:40]
+            if "error" in r:
+                print(f"{name:40} FAILED: {r['error']}", file=out)
+                continue
+            print(f"{name:40} {r['pixels'] / 1e6:9.1f}MP "
+                  f"{r['read'] * 1000:7.1f} {r['decode'] * 1000:7.1f} {r['process'] * 1000:8.1f} "
+                  f"{r['encode'] * 1000:7.1f} {r.get('write', 0.0) * 1000:7.1f}", file=out)
+    stages = ", ".join(f"{k} {v:.2f}s" for k, v in report["stage_seconds"].items())
+    print(f"\n{report['files'] - report['failed']}/{report['files']} files in "
+          f"{report['wall_seconds']:.2f}s with {report['workers']} workers: "
+          f"{report['files_per_second']:.2f} files/s, "
+          f"{report['megapixels_per_second']:.1f} MP/s, "
+          f"{report['output_bytes'] / (1024 * 1024):.1f} MB written", file=out)
+    print(f"Total stage time: {stages}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="batch", description="Process many images without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="input files or glob patterns (use ** to recurse)")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("-p", "--pipeline", required=True,
+                        help='operations, e.g. "grayscale,blur:ksize=5", a JSON list or a JSON file')
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="files held in memory at once (default: 2 x workers)")
+    parser.add_argument("--format", default=None, help="output extension such as png or jpg (default: keep)")
+    parser.add_argument("--root", default=None,
+                        help="keep paths relative to this folder in the output "
+                             "(default: the inputs' common folder)")
+    parser.add_argument("--no-fuse", action="store_true",
+                        help="run every operation as its own pass instead of fusing neighbours")
+    parser.add_argument("--json", default=None, help="also write the report as JSON to this path")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args(argv)
+
+    try:
+        operations = parse_pipeline(args.pipeline)
+    except ValueError as e:
+        parser.error(str(e))
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        parser.error("No input files matched.")
+    out_ext = "." + args.format.lstrip(".") if args.format else None
+
+    try:
+        output_paths(paths, args.root, args.output, out_ext)
+    except ValueError as e:
+        parser.error(str(e))
+
+    report = run_batch(paths, operations, args.output, workers=args.workers,
+                       max_in_flight=args.max_in_flight, out_ext=out_ext, input_root=args.root,
+                       fuse=not args.no_fuse)
+    print_report(report, per_file=not args.quiet)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
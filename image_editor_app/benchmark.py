@@ -0,0 +1,360 @@
+# benchmark.py
+#
+# Headless speed benchmark for every ImageProcessor operation and the GUI's
+# live preview path, on synthetic images. Nothing here imports tkinter.
+#
+#   python benchmark.py --sizes 1,4 --channels 1,3,4 --depths 8,16 --json results.json
+#   python benchmark.py --baseline results.json --threshold 0.15   # exit 1 on regression
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from background_removal import BackgroundRemover
+from buffer_pool import BufferPool
+from image_processor import OPERATIONS, ImageProcessor, rotated_size
+from intensity_pipeline import IntensityPipeline
+from pipeline_planner import run_fused
+from preview import DisplayCache, PreviewProxy
+
+# Parameters each operation is timed with
+OPERATION_PARAMS = {
+    "grayscale": {},
+    "blur": {"ksize": 9},
+    "edges": {},
+    "brightness_contrast": {"brightness": 20, "contrast": 1.2},
+    "point_ops": {"brightness": 10, "contrast": 1.1, "gamma": 1.2},
+    "intensity_filters": {"grayscale": 0.5, "blur": 5, "edge": 100.0},
+    "rotate": {"angle": 90},
+    "flip": {"mode": "horizontal"},
+    "resize": {"scale": 0.5},
+    "remove_background": {},
+}
+
+# Largest image (in megapixels) an operation is timed on; GrabCut takes minutes beyond this
+MAX_MEGAPIXELS = {"remove_background": 1}
+
+# Slider state the preview benchmark renders, as the GUI would send it
+PREVIEW_SLIDERS = {"grayscale": 0.5, "blur": 5.0, "edge": 100.0, "brightness": 20.0, "contrast": 1.2}
+PREVIEW_CANVAS = (1000, 700)
+
+DEPTHS = {8: np.uint8, 16: np.uint16}
+
+
+def synthetic_image(megapixels, channels=3, depth=8):
+    """A 4:3 test image with gradients, shapes and noise, so filters and
+    compression see realistic content. The same arguments give the same pixels."""
+    w = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    h = int(round(w * 3 / 4))
+    rng = np.random.default_rng(int(megapixels * 100) + channels)
+    # Draw at a low resolution and scale up so large sizes stay cheap to build
+    small_w, small_h = min(w, 800), min(h, 600)
+    base = np.zeros((small_h, small_w, 3), np.uint8)
+    base[..., 0] = np.linspace(30, 220, small_w, dtype=np.uint8)[None, :]
+    base[..., 1] = np.linspace(60, 180, small_h, dtype=np.uint8)[:, None]
+    base[..., 2] = 120
+    cv2.ellipse(base, (small_w // 2, small_h // 2), (small_w // 4, small_h // 3), 15, 0, 360, (40, 160, 230), -1)
+    cv2.rectangle(base, (small_w // 8, small_h // 8), (small_w // 3, small_h // 3), (200, 60, 60), -1)
+    image = cv2.resize(base, (w, h), interpolation=cv2.INTER_LINEAR)
+    image = cv2.add(image, rng.integers(0, 24, image.shape, dtype=np.uint8))
+    if channels == 1:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    elif channels == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    if depth == 16:
+        image = image.astype(np.uint16) * 257
+    return image
+
+
+def _display_convert(image):
+    # Mirrors ImageEditorApp._display_image up to the Tk PhotoImage
+    if image.ndim == 3:
+        if image.shape[2] == 4:
+            rgb = cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA)
+        else:
+            rgb = image[:, :, ::-1]
+    else:
+        rgb = image
+    pil_image = Image.fromarray(rgb)
+    pil_image.thumbnail(PREVIEW_CANVAS)
+    return pil_image
+
+
+def preview_job(processor, cold=False):
+    """The work behind one slider move: fetch the display proxy, render the
+    slider operations on it and convert the result for display. With cold the
+    proxy is rebuilt, as after opening a file or committing an edit."""
+    proxies = PreviewProxy()
+
+    def run(image):
+        if cold:
+            proxies.invalidate()
+        proxy, scale = proxies.get(image, PREVIEW_CANVAS)
+        s = PREVIEW_SLIDERS
+        operations = [
+            ("intensity_filters", {"grayscale": s["grayscale"], "blur": s["blur"],
+                                   "edge": s["edge"], "scale": scale}),
+            ("brightness_contrast", {"brightness": s["brightness"], "contrast": s["contrast"]}),
+        ]
+        return _display_convert(run_fused(proxy, operations, processor))
+
+    return run
+
+
+def edge_drag_job(processor):
+    """The preview work while only the edge slider is dragged: each call moves
+    it one step, so the incremental pipeline reruns just the edge stage and the
+    stages after it."""
+    proxies = PreviewProxy()
+    pipeline = IntensityPipeline(processor)
+    steps = [0]
+
+    def run(image):
+        proxy, scale = proxies.get(image, PREVIEW_CANVAS)
+        steps[0] += 1
+        state = dict(PREVIEW_SLIDERS, edge=100.0 + steps[0] % 50, scale=1.0)
+        return _display_convert(pipeline.render(proxy, state, scale))
+
+    return run
+
+
+def geometry_job(quality):
+    """The preview work for one move of the angle slider with the image
+    enlarged 1.5x, rendered at display size the way the GUI does: "draft" is
+    what is shown while the slider moves, "high" the render once it settles."""
+    proxies = PreviewProxy()
+    pipeline = IntensityPipeline()
+    steps = [0]
+
+    def run(image):
+        proxy, scale = proxies.get(image, PREVIEW_CANVAS)
+        steps[0] += 1
+        angle = 10.0 + steps[0] % 50
+        rot_w, rot_h = rotated_size(proxy.shape[1], proxy.shape[0], angle)
+        shown = min(1.5, PREVIEW_CANVAS[0] / rot_w, PREVIEW_CANVAS[1] / rot_h)
+        state = dict(PREVIEW_SLIDERS, scale=shown, angle=angle, quality=quality)
+        return _display_convert(pipeline.render(proxy, state, scale))
+
+    return run
+
+
+def pooled_drag_job():
+    """The GUI's preview loop with pooled buffers while the grayscale slider is
+    dragged: every stage reruns, the result is copied into a pooled frame and
+    converted for display. The pool is exposed as run.pool so measure() can
+    report how many arrays each frame still allocates, which should be none."""
+    pool = BufferPool()
+    proxies = PreviewProxy()
+    pipeline = IntensityPipeline(pool=pool)
+    display = DisplayCache()
+    steps = [0]
+
+    def run(image):
+        proxy, scale = proxies.get(image, PREVIEW_CANVAS)
+        steps[0] += 1
+        state = dict(PREVIEW_SLIDERS, grayscale=0.2 + steps[0] % 50 / 100.0, scale=1.0)
+        rendered = pipeline.render(proxy, state, scale)
+        frame = pool.acquire_like(rendered)
+        np.copyto(frame, rendered)
+        display.invalidate()
+        shown = display.get(frame, PREVIEW_CANVAS)
+        pool.release(frame)
+        return shown
+
+    run.pool = pool
+    return run
+
+
+def measure(job, image, repeat=5, warmup=1):
+    """Time job(image) `repeat` times after `warmup` untimed calls, then run it
+    once more under tracemalloc for the peak of newly allocated memory."""
+    for _ in range(warmup):
+        job(image)
+    pool = getattr(job, "pool", None)
+    allocations = pool.get_stats()["allocations"] if pool is not None else 0
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        job(image)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    if pool is not None:
+        allocations = pool.get_stats()["allocations"] - allocations
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        job(image)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    megapixels = image.shape[0] * image.shape[1] / 1e6
+    median = times[len(times) // 2]
+    stats = {
+        "median_ms": median * 1000,
+        "p95_ms": times[min(len(times) - 1, int(round(0.95 * (len(times) - 1))))] * 1000,
+        "min_ms": times[0] * 1000,
+        "megapixels_per_second": megapixels / median if median else 0.0,
+        "peak_mb": (peak - before) / (1024 * 1024),
+        "repeat": repeat,
+    }
+    if pool is not None:
+        stats["pool_allocations_per_frame"] = allocations / repeat
+    return stats
+
+
+def result_key(name, megapixels, channels, depth):
+    return f"{name}|{megapixels:g}MP|{channels}ch|{depth}bit"
+
+
+def run_benchmarks(names, sizes, channels_list, depths, repeat=5, log=None):
+    """Benchmark every combination; returns {result_key: stats}. Operations that
+    reject an image type are recorded with an "error" instead of timings."""
+    processor = ImageProcessor()
+    jobs = {}
+    for name in names:
+        if name == "preview":
+            jobs[name] = preview_job(processor)
+        elif name == "preview_cold":
+            jobs[name] = preview_job(processor, cold=True)
+        elif name == "preview_edge_drag":
+            jobs[name] = edge_drag_job(processor)
+        elif name == "preview_pooled_drag":
+            jobs[name] = pooled_drag_job()
+        elif name == "preview_geometry_draft":
+            jobs[name] = geometry_job("draft")
+        elif name == "preview_geometry_final":
+            jobs[name] = geometry_job("high")
+        elif name == "remove_background":
+            # A fresh remover each call so its mask cache does not hide the work
+            jobs[name] = lambda img: BackgroundRemover().remove(img)
+        else:
+            params = OPERATION_PARAMS.get(name, {})
+            jobs[name] = (lambda n, p: lambda img: processor.apply(n, img, **p))(name, params)
+
+    results = {}
+    for megapixels in sizes:
+        for channels in channels_list:
+            for depth in depths:
+                image = synthetic_image(megapixels, channels, depth)
+                for name, job in jobs.items():
+                    key = result_key(name, megapixels, channels, depth)
+                    if megapixels > MAX_MEGAPIXELS.get(name, float("inf")):
+                        continue
+                    try:
+                        results[key] = measure(job, image, repeat)
+                    except (cv2.error, ValueError, TypeError) as e:
+                        results[key] = {"error": _short_error(e)}
+                    if log is not None:
+                        log(key, results[key])
+                del image
+    return results
+
+
+def _short_error(error):
+    # OpenCV errors span several lines; keep the one that says what went wrong
+    lines = str(error).strip().splitlines()
+    for line in lines:
+        if "error:" in line:
+            return line.split("error:", 1)[1].split(" in function")[0].strip()
+    return lines[-1].strip() if lines else type(error).__name__
+
+
+def compare(results, baseline, threshold=0.1):
+    """Rows of (key, baseline_ms, current_ms, ratio) for every timing present in
+    both runs, and the keys whose median grew by more than `threshold`."""
+    rows, regressions = [], []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous or "median_ms" not in current or "median_ms" not in previous:
+            continue
+        ratio = current["median_ms"] / previous["median_ms"] if previous["median_ms"] else 1.0
+        rows.append((key, previous["median_ms"], current["median_ms"], ratio))
+        if ratio > 1.0 + threshold:
+            regressions.append(key)
+    return rows, regressions
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "opencv_threads": cv2.getNumThreads(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def _print_row(key, stats):
+    if "error" in stats:
+        print(f"{key:48} unsupported: {stats['error']}")
+        return
+    extra = ""
+    if "pool_allocations_per_frame" in stats:
+        extra = f"  {stats['pool_allocations_per_frame']:g} pool allocations/frame"
+    print(f"{key:48} {stats['median_ms']:9.1f} {stats['p95_ms']:9.1f} "
+          f"{stats['megapixels_per_second']:9.1f} {stats['peak_mb']:9.1f}{extra}")
+
+
+def _parse_list(text, cast):
+    return [cast(v) for v in text.split(",") if v.strip()]
+
+
+def main(argv=None):
+    names = list(OPERATIONS) + ["preview", "preview_cold", "preview_edge_drag", "preview_pooled_drag",
+                                "preview_geometry_draft", "preview_geometry_final"]
+    parser = argparse.ArgumentParser(description="Benchmark ImageProcessor operations and the preview path.")
+    parser.add_argument("--ops", default=",".join(names), help="comma-separated operations (default: all)")
+    parser.add_argument("--sizes", default="1,4", help="image sizes in megapixels, e.g. 1,10,100")
+    parser.add_argument("--channels", default="1,3,4", help="channel counts: 1 gray, 3 BGR, 4 BGRA")
+    parser.add_argument("--depths", default="8", help="bit depths: 8 and/or 16")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    parser.add_argument("--baseline", default=None, help="compare against results saved with --json")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fractional slowdown of the median counted as a regression")
+    args = parser.parse_args(argv)
+
+    selected = _parse_list(args.ops, str)
+    unknown = [n for n in selected if n not in names]
+    if unknown:
+        parser.error(f"Unknown operation: {', '.join(unknown)} (choose from {', '.join(names)})")
+    depths = _parse_list(args.depths, int)
+    if any(d not in DEPTHS for d in depths):
+        parser.error("Depths must be 8 or 16.")
+
+    print(f"{'case':48} {'median':>9} {'p95':>9} {'MP/s':>9} {'peak MB':>9}")
+    results = run_benchmarks(selected, _parse_list(args.sizes, float), _parse_list(args.channels, int),
+                             depths, args.repeat, log=_print_row)
+    report = {"environment": environment(), "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        rows, regressions = compare(results, baseline, args.threshold)
+        print(f"\n{'case':48} {'baseline':>9} {'now':>9} {'change':>8}")
+        for key, before, now, ratio in rows:
+            flag = "  REGRESSION" if key in regressions else ""
+            print(f"{key:48} {before:9.1f} {now:9.1f} {(ratio - 1) * 100:+7.1f}%{flag}")
+        print(f"\n{len(regressions)} of {len(rows)} cases slower than the baseline by more "
+              f"than {args.threshold:.0%}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# buffer_pool.py
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class BufferPool:
+    """
+    Reusable image-sized arrays, so steady-state work such as a slider drag
+    does not allocate (and page-fault in) a fresh multi-megabyte array for every
+    intermediate result. acquire() hands out a free array of the requested shape
+    and dtype, or allocates one; release() returns it. Free arrays beyond
+    max_free_bytes are dropped, least recently released first. Arrays come back
+    with whatever they last held. Thread-safe.
+    """
+
+    def __init__(self, max_free_bytes=128 * 1024 * 1024):
+        self._max_free = max_free_bytes
+        self._free = OrderedDict()      # id -> array, oldest release first
+        self._free_bytes = 0
+        self._lock = threading.Lock()
+        self._allocations = 0
+        self._allocated_bytes = 0
+        self._reuses = 0
+
+    # Encapsulated getters
+    def get_stats(self):
+        """Arrays allocated and reused so far, and what is free right now."""
+        with self._lock:
+            return {
+                "allocations": self._allocations,
+                "allocated_bytes": self._allocated_bytes,
+                "reuses": self._reuses,
+                "free": len(self._free),
+                "free_bytes": self._free_bytes,
+            }
+
+    # Core methods
+    def acquire(self, shape, dtype):
+        shape, dtype = tuple(shape), np.dtype(dtype)
+        with self._lock:
+            for key, array in self._free.items():
+                if array.shape == shape and array.dtype == dtype:
+                    del self._free[key]
+                    self._free_bytes -= array.nbytes
+                    self._reuses += 1
+                    return array
+            self._allocations += 1
+            self._allocated_bytes += int(np.prod(shape)) * dtype.itemsize
+        return np.empty(shape, dtype)
+
+    def acquire_like(self, image):
+        return self.acquire(image.shape, image.dtype)
+
+    def release(self, array):
+        if array is None or not array.flags.owndata or not array.flags.writeable:
+            return      # views and read-only (e.g. cached) arrays are not pooled
+        with self._lock:
+            if id(array) in self._free:
+                return
+            self._free[id(array)] = array
+            self._free_bytes += array.nbytes
+            while self._free_bytes > self._max_free and self._free:
+                _, dropped = self._free.popitem(last=False)
+                self._free_bytes -= dropped.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+            self._free_bytes = 0
+
@@ -0,0 +1,133 @@
+# client.py
+#
+# Client for server.py. One client holds one keep-alive connection; use one
+# client per thread.
+#
+#   client = ProcessingClient()
+#   result = client.apply(image, [("blur", {"ksize": 5}), ("rotate", {"angle": 90})])
+
+import http.client
+import json
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:     # Python 3.7
+    shared_memory = None
+
+# Only the standard library and numpy are imported here, so clients do not pay
+# for loading OpenCV; server.py takes its default port from here
+DEFAULT_PORT = 8765
+
+
+class ServerError(Exception):
+    """The server rejected or failed a request."""
+
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class ProcessingClient:
+    """
+    Sends images to a running processing server. With shared_memory=True the
+    pixels travel through a shared memory block instead of the socket, which
+    saves copying large images through the kernel twice.
+    """
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, timeout=120.0, shared_memory=False):
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._shared_memory = shared_memory
+        self._connection = None
+
+    # Core methods
+    def operations(self):
+        return self._request_json("GET", "/operations")["operations"]
+
+    def stats(self):
+        """Server queue depth, batch sizes and latency percentiles."""
+        return self._request_json("GET", "/stats")
+
+    def apply(self, image, operations, shared_memory=None):
+        """Run (name, params) operations on image on the server and return the result."""
+        pipeline = json.dumps([dict(params, op=name) for name, params in operations])
+        use_shm = self._shared_memory if shared_memory is None else shared_memory
+        if use_shm:
+            return self._apply_shared(image, pipeline)
+        image = np.ascontiguousarray(image)
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-Shape": ",".join(str(n) for n in image.shape),
+            "X-Dtype": image.dtype.str,
+            "X-Pipeline": pipeline,
+        }
+        status, response_headers, body = self._request("POST", "/process", memoryview(image).cast("B"), headers)
+        shape = tuple(int(n) for n in response_headers["X-Shape"].split(","))
+        # frombuffer wraps the response bytes without another copy (read-only)
+        return np.frombuffer(body, dtype=np.dtype(response_headers["X-Dtype"])).reshape(shape)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    # Internal helpers
+    def _apply_shared(self, image, pipeline):
+        if shared_memory is None:
+            raise RuntimeError("Shared memory needs Python 3.8 or newer.")
+        block = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+        try:
+            np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)[...] = image
+            request = {"name": block.name, "shape": list(image.shape), "dtype": image.dtype.str,
+                       "pipeline": pipeline}
+            reply = self._request_json("POST", "/process-shm", request)
+        finally:
+            block.close()
+            block.unlink()
+        out = shared_memory.SharedMemory(name=reply["name"])
+        try:
+            view = np.ndarray(tuple(reply["shape"]), dtype=np.dtype(reply["dtype"]), buffer=out.buf)
+            result = view.copy()
+            del view
+        finally:
+            out.close()
+            out.unlink()
+        return result
+
+    def _request_json(self, method, path, value=None):
+        body = json.dumps(value).encode("utf-8") if value is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        _, _, data = self._request(method, path, body, headers)
+        return json.loads(data.decode("utf-8"))
+
+    def _request(self, method, path, body=None, headers=None):
+        # Reconnect once if the server closed an idle keep-alive connection
+        for attempt in (0, 1):
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+            try:
+                self._connection.request(method, path, body=body, headers=headers or {})
+                response = self._connection.getresponse()
+                data = response.read()
+                break
+            except (ConnectionError, http.client.HTTPException):
+                self.close()
+                if attempt:
+                    raise
+        if response.status != 200:
+            try:
+                message = json.loads(data.decode("utf-8")).get("error", "")
+            except ValueError:
+                message = data[:200].decode("utf-8", "replace")
+            raise ServerError(response.status, message)
+        return response.status, response.headers, data
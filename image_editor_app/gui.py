@@ -3,13 +3,24 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter import ttk
-from PIL import Image, ImageTk
 import os
-import cv2
-import numpy as np
+import queue
+import time
+import types
+
+import instrumentation
+from instrumentation import record_allocation, record_frame, span
+from render_scheduler import RenderScheduler
+from startup import StartupProfile
+
+# Resize and angle previews are drafts while the slider moves; the high-quality
+# render follows on release or after the slider has rested this long
+SETTLE_MS = 250
+# Cutout brush radius in canvas pixels, whatever the zoom
+BRUSH_PX = 8
+# Memory for finished slider previews, each about the size of the canvas
+PREVIEW_CACHE_BYTES = 64 * 1024 * 1024
 
-from image_model import ImageModel
-from image_processor import ImageProcessor
 
 class ImageEditorApp(tk.Tk):
     """
@@ -18,27 +29,110 @@ class ImageEditorApp(tk.Tk):
     Handles all the user interaction and events
     """
 
-    def __init__(self):
+    def __init__(self, startup=None, open_path=None, exit_when_started=False):
         super().__init__()
         self.title("HIT137 Image Editor")
         self.geometry("1000x700")
 
-        self.model = ImageModel()
-        self.processor = ImageProcessor()
+        # Import and milestone timings of this start, see startup.py. With
+        # exit_when_started the app quits once open_path (or, without one, the
+        # controls) is on screen, for `main.py --profile-startup`.
+        self.startup = startup or StartupProfile()
+        self._open_path = open_path
+        self._exit_when_started = exit_when_started
+        self._ready = False
+        self._pan_anchor = None
+        self._settle_job = None
+        # Refine Cutout: the image being cut out, its GrabCutSession once the
+        # first cut is ready, strokes waiting for the worker and the last mask
+        self._cutout_source = None
+        self._cutout_session = None
+        self._cutout_strokes = queue.Queue()
+        self._cutout_mask = None
+        self._stroke = None
+        self.scheduler = RenderScheduler(self)
+        self._commit_queue = []
+        # Edits made on a reduced stand-in are replayed on the full decode on the
+        # render worker; commits wait for that replay like for one another
+        self._replaying_load = False
+        self._load_token = None
+        self._pending_full_image = None
+        self._open_times = None
 
-        self._original_for_sliders = None
-        self.tk_image = None               
-        self.blur_reference = None
+        self.tk_image = None
+        self._tk_mode = None
+        self._canvas_item = None
+        self._resize_job = None
         self.grayscale_intensity = tk.DoubleVar(value=0.0)
         self.blur_intensity = tk.DoubleVar(value=0.0)
         self.edge_intensity = tk.DoubleVar(value=0.0)
 
-        self._create_menu()
         self._create_widgets()
         self._create_status_bar()
+        self.status_var.set("Loading...")
         
-        # Show welcome message prompting to upload an image
-        self.after(100, self._show_welcome_message)
+        # Closing the window exits cleanly, which also discards the recovery journal
+        self.protocol("WM_DELETE_WINDOW", self.on_exit)
+
+        # The imaging stack loads once the window is mapped; menus and controls
+        # follow in _on_backends_loaded
+        self.bind("<Map>", self._on_map)
+
+    # ---------- Startup ----------
+
+    def _on_map(self, event):
+        if event.widget is not self or "window" in self.startup.get_marks():
+            return
+        self.startup.mark("window")
+        self.scheduler.submit(
+            "startup",
+            lambda: _import_backends(self.startup),
+            self._on_backends_loaded,
+            on_error=lambda e: messagebox.showerror("Error", f"Could not load the imaging libraries: {str(e)}"),
+        )
+
+    def _on_backends_loaded(self, backends):
+        # The imaging stack and the editor modules built on it, imported by
+        # _import_backends once the window was on screen
+        self.backends = backends
+        # One cache serves previews, commits and undo/redo replays. Full-resolution
+        # work on large images runs in strips on every core (IMAGE_EDITOR_THREADS
+        # caps the threads, OpenCV's included)
+        backends.set_thread_budget()
+        self.processor = backends.CachedProcessor(backends.ParallelExecutor(backends.ImageProcessor()))
+        # Every edit is journaled in the background so a crash loses nothing
+        self.journal = backends.Journal()
+        self.model = backends.ImageModel(processor=self.processor, journal=self.journal)
+        self.preview = backends.PreviewProxy()
+        # Preview stages and frames live in pooled buffers, so a slider drag
+        # stops allocating once the first frames have been rendered
+        self.buffer_pool = backends.BufferPool()
+        self.intensity_pipeline = backends.IntensityPipeline(pool=self.buffer_pool)
+        # Finished slider previews by proxy and stage parameters, so going back to
+        # an earlier slider position shows it again without rerunning any stage.
+        # Kept apart from the commit cache so a drag cannot evict full-size results
+        self.preview_results = backends.CachedProcessor(budget_bytes=PREVIEW_CACHE_BYTES)
+        self.viewport = backends.Viewport()
+        # Only used on the render worker, inside preview jobs
+        self.region_proxy = backends.RegionProxy()
+        self.display_cache = backends.DisplayCache()
+        self.loader = backends.ProgressiveLoader(self)
+        self.saver = backends.BackgroundSaver(self)
+        self.save_options = dict(backends.DEFAULT_OPTIONS)
+
+        self._create_menu()
+        self._create_controls()
+        self._ready = True
+        self.startup.mark("ready")
+        self.status_var.set("No image loaded.")
+
+        if self._open_path:
+            self.open_image(self._open_path)
+        elif self._exit_when_started:
+            self.after_idle(self.quit)
+        else:
+            # Offer to recover a crashed session, otherwise prompt to upload an image
+            self.after(100, self._show_welcome_message)
 
     # ---------- GUI setup ----------
 
@@ -50,6 +144,12 @@ class ImageEditorApp(tk.Tk):
         file_menu.add_command(label="Open", command=self.open_image)
         file_menu.add_command(label="Save", command=self.save_image)
         file_menu.add_command(label="Save As", command=self.save_image_as)
+        file_menu.add_command(label="Save Options...", command=self.show_save_options)
+        file_menu.add_separator()
+        file_menu.add_command(label="Open Session...", command=self.open_session)
+        file_menu.add_command(label="Save Session...", command=self.save_session)
+        file_menu.add_separator()
+        file_menu.add_command(label="Export Performance Trace...", command=self.export_trace)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.on_exit)
         menubar.add_cascade(label="File", menu=file_menu)
@@ -58,27 +158,67 @@ class ImageEditorApp(tk.Tk):
         edit_menu = tk.Menu(menubar, tearoff=0)
         edit_menu.add_command(label="Undo", command=self.undo)
         edit_menu.add_command(label="Redo", command=self.redo)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="History...", command=self.show_history)
         menubar.add_cascade(label="Edit", menu=edit_menu)
 
+        # View menu
+        view_menu = tk.Menu(menubar, tearoff=0)
+        view_menu.add_command(label="Zoom In", accelerator="Ctrl++", command=lambda: self.zoom_by(1.25))
+        view_menu.add_command(label="Zoom Out", accelerator="Ctrl+-", command=lambda: self.zoom_by(0.8))
+        view_menu.add_command(label="Actual Size", accelerator="Ctrl+1", command=lambda: self.set_zoom(1.0))
+        view_menu.add_command(label="Fit to Window", accelerator="Ctrl+0", command=self.zoom_to_fit)
+        menubar.add_cascade(label="View", menu=view_menu)
+        self.bind("<Control-plus>", lambda e: self.zoom_by(1.25))
+        self.bind("<Control-equal>", lambda e: self.zoom_by(1.25))
+        self.bind("<Control-minus>", lambda e: self.zoom_by(0.8))
+        self.bind("<Control-Key-1>", lambda e: self.set_zoom(1.0))
+        self.bind("<Control-Key-0>", lambda e: self.zoom_to_fit())
+
         self.config(menu=menubar)
 
     def _create_widgets(self):
+        """The canvas and the control panel, left empty until the imaging stack
+        has loaded (see _create_controls), so the window can show at once."""
         # Left: image display area (canvas)
         self.canvas = tk.Canvas(self, bg="gray")
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         # Right: control panel
-        control_frame = tk.Frame(self, width=280)
-        control_frame.pack(side=tk.RIGHT, fill=tk.Y)
+        self.control_frame = tk.Frame(self, width=280)
+        self.control_frame.pack(side=tk.RIGHT, fill=tk.Y)
+
+    def _create_controls(self):
+        self.canvas.bind("<Configure>", self.on_canvas_resize)
+        # Wheel zooms at the cursor (Button-4/5 on X11), dragging pans
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-4>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-5>", self.on_mouse_wheel)
+        self.canvas.bind("<ButtonPress-1>", self.on_pan_start)
+        self.canvas.bind("<B1-Motion>", self.on_pan_move)
+        self.canvas.bind("<ButtonRelease-1>", self.on_pan_end)
+        # While refining a cutout the left button paints foreground, the right background
+        self.canvas.bind("<ButtonPress-3>", lambda e: self.on_stroke_start(e, foreground=False))
+        self.canvas.bind("<B3-Motion>", self.on_stroke_move)
+        self.canvas.bind("<ButtonRelease-3>", self.on_stroke_end)
+        self.bind("<Escape>", lambda e: self.cancel_cutout())
+
+        control_frame = self.control_frame
 
         # Buttons for basic operations
         tk.Label(control_frame, text="Operations", font=("Arial", 12, "bold")).pack(pady=10)
 
         tk.Button(control_frame, text="Reset All", command=self.reset_all, bg="lightgreen").pack(fill=tk.X, padx=10, pady=5)
 
+        # Commit the slider preview at full resolution
+        tk.Button(control_frame, text="Apply Adjustments", command=self.apply_adjustments, bg="lightgreen").pack(fill=tk.X, padx=10, pady=2)
+
         
         # Background Remover Button
         tk.Button(control_frame, text="BG Remover", command=self.apply_bg_removal, bg="lightgreen").pack(fill=tk.X, padx=10, pady=2)
+        # Brush corrections on top of the automatic cut; press again to apply
+        self.cutout_button = tk.Button(control_frame, text="Refine Cutout", command=self.toggle_cutout, bg="lightgreen")
+        self.cutout_button.pack(fill=tk.X, padx=10, pady=2)
 
         # Grayscale Intensity Slider + buttons
         tk.Label(control_frame, text="Grayscale Intensity", font=("Arial", 10, "bold")).pack(pady=(15, 0))
@@ -135,6 +275,17 @@ class ImageEditorApp(tk.Tk):
         tk.Button(rot_frame, text="90°", command=lambda: self.apply_rotate(90)).pack(side=tk.LEFT, padx=2)
         tk.Button(rot_frame, text="180°", command=lambda: self.apply_rotate(180)).pack(side=tk.LEFT, padx=2)
         tk.Button(rot_frame, text="270°", command=lambda: self.apply_rotate(270)).pack(side=tk.LEFT, padx=2)
+        self.angle_var = tk.DoubleVar(value=0.0)
+        angle_slider = ttk.Scale(
+            control_frame,
+            from_=-180.0,
+            to=180.0,
+            orient=tk.HORIZONTAL,
+            variable=self.angle_var,
+            command=self.on_geometry_change
+        )
+        angle_slider.bind("<ButtonRelease-1>", self._settle_preview)
+        angle_slider.pack(fill=tk.X, padx=10, pady=2)
 
         # Flip
         tk.Label(control_frame, text="Flip", font=("Arial", 10, "bold")).pack(pady=(10, 0))
@@ -152,8 +303,9 @@ class ImageEditorApp(tk.Tk):
             to=2.0,
             orient=tk.HORIZONTAL,
             variable=self.scale_var,
-            command=self.on_scale_change
+            command=self.on_geometry_change
         )
+        scale_slider.bind("<ButtonRelease-1>", self._settle_preview)
         scale_slider.pack(fill=tk.X, padx=10, pady=2)
 
         # Brightness slider
@@ -189,6 +341,8 @@ class ImageEditorApp(tk.Tk):
 
     def _show_welcome_message(self):
         """Show welcome message prompting user to upload an image."""
+        if self._offer_recovery():
+            return
         messagebox.showinfo("Welcome", "Please upload an image to get started!\n\nGo to File > Open to select an image.")
 
     # ---------- New intensity control methods ----------
@@ -199,45 +353,147 @@ class ImageEditorApp(tk.Tk):
         self.blur_intensity.set(0.0)
         self.edge_intensity.set(0.0)
         self._reset_sliders()
+        # A preview still on the worker would overwrite the reset display
+        self.scheduler.cancel("preview")
         if self.model.get_image() is not None:
             self._update_display()
             self._update_status_bar()
 
     def on_intensity_change(self, event=None):
         """Live preview for grayscale, blur, edge sliders.
-        The effects are applied to reference copy of the image without changing the 
-        original image until specifed"""
-        if self.blur_reference is None and self.model.get_image() is not None:
-            self.blur_reference = self.model.get_image().copy()
-        
-        if self.blur_reference is not None:
-            img = self._apply_intensity_filters(self.blur_reference.copy())
-            self._display_image(img)
-            self._update_status_bar(temp_image=img)
-
-    def _apply_intensity_filters(self, base_img):
-        """Apply grayscale, blur, edge effects based on current sliders."""
-        img = base_img.copy()
-        
-        # Grayscale effect (0=no effect, 1=full grayscale)
-        if self.grayscale_intensity.get() > 0:
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            gray = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
-            img = cv2.addWeighted(img, 1.0 - self.grayscale_intensity.get(), gray, self.grayscale_intensity.get(), 0)
-        
-        # Blur effect (0=no blur, higher=more blur)
-        blur_ksize = max(1, int(self.blur_intensity.get()) * 2 + 1)
-        if self.blur_intensity.get() > 0:
-            img = cv2.GaussianBlur(img, (blur_ksize, blur_ksize), 0)
-        
-        # Edge effect (overlay edges on top)
-        if self.edge_intensity.get() > 0:
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            edges = cv2.Canny(gray, 50, 150)
-            edges_colored = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
-            img = cv2.addWeighted(img, 1.0, edges_colored, self.edge_intensity.get() / 300.0, 0)
-        
-        return img
+        The effects are applied to a canvas-sized proxy of the image without changing
+        the original image until Apply Adjustments is clicked"""
+        self._render_preview()
+
+    def _slider_state(self):
+        """Snapshot of every slider value. Tk variables may only be read on the
+        main thread, so jobs for the render worker take this snapshot instead.
+        Values are rounded to steps finer than the eye can see, so dragging back
+        to an earlier position produces the same parameters and its fitted
+        preview comes from the preview cache."""
+        return {
+            "grayscale": round(self.grayscale_intensity.get(), 2),
+            "blur": float(int(self.blur_intensity.get())),
+            "edge": float(round(self.edge_intensity.get())),
+            "brightness": float(round(self.brightness_slider.get())),
+            "contrast": round(float(self.contrast_slider.get()), 2),
+            "scale": round(self.scale_var.get(), 2),
+            "angle": round(self.angle_var.get(), 1),
+        }
+
+    def _slider_operations(self, state, scale=1.0):
+        """ImageProcessor operations for every slider adjustment that is not at its
+        default. scale is passed on to the intensity filters for proxy previews.
+        Resize and rotation use state["quality"], high unless given."""
+        operations = []
+        if state["grayscale"] > 0 or state["blur"] > 0 or state["edge"] > 0:
+            params = {"grayscale": state["grayscale"], "blur": state["blur"], "edge": state["edge"]}
+            if scale != 1.0:
+                params["scale"] = scale
+            operations.append(("intensity_filters", params))
+        if state["brightness"] != 0 or state["contrast"] != 1.0:
+            operations.append(("brightness_contrast",
+                               {"brightness": state["brightness"], "contrast": state["contrast"]}))
+        quality = state.get("quality", "high")
+        if state["scale"] != 1.0:
+            operations.append(("resize", {"scale": state["scale"], "quality": quality}))
+        if state["angle"] % 360 != 0:
+            operations.append(("rotate", {"angle": state["angle"], "quality": quality}))
+        return operations
+
+    def _render_preview(self, quality="high", kind="interactive"):
+        """Queue a render of the current slider state on the display proxy.
+        All sliders share the "preview" key, so only the newest state is rendered.
+        quality is used for resize and rotation; kind files the frame time as an
+        interactive frame or a settled final render, see record_frame."""
+        img = self.model.get_image()
+        if img is None:
+            return
+        if self._cutout_source is not None:
+            self._show_cutout()
+            return
+        if not self.viewport.is_fit():
+            self._render_zoomed_preview(img, kind)
+            return
+        started = time.perf_counter()
+        canvas_size = self._canvas_size()
+        proxy, scale = self.preview.get(img, canvas_size)
+        state = dict(self._slider_state(), quality=quality)
+        h, w = img.shape[:2]
+        size = self.backends.rotated_size(int(w * state["scale"]), int(h * state["scale"]), state["angle"])
+        # Enlarged or rotated results would only be shrunk back to the canvas, so
+        # the geometry is rendered at the size it is shown at
+        state["scale"] = self._shown_scale(proxy, state, canvas_size)
+
+        def job():
+            # A slider position seen before comes from the preview cache; otherwise
+            # only the stages after the first changed slider are recomputed
+            with span("preview.render"):
+                key = [("slider_preview", self.backends.stage_params(state, scale))]
+                rendered = self.preview_results.get_or_compute(
+                    proxy, key, lambda: self._render_to_cache(proxy, state, scale))
+                return self._copy_to_frame(rendered)
+
+        def on_done(frame):
+            self._display_frame(frame)
+            # Frame time runs from the slider event to the new pixels on screen
+            record_frame(started, kind)
+            self._update_status_bar(temp_size=size)
+
+        self.scheduler.submit(
+            "preview",
+            job,
+            on_done,
+            on_error=lambda e: messagebox.showerror("Error", f"Preview failed: {str(e)}"),
+        )
+
+    def _render_zoomed_preview(self, img, kind="interactive"):
+        """Render only the visible region, cut from the pyramid level that matches
+        the zoom, so the cost follows the canvas size rather than the image size.
+        The resize and angle sliders are left out here; the result size shows in
+        the status bar."""
+        started = time.perf_counter()
+        canvas_size = self._canvas_size()
+        h, w = img.shape[:2]
+        self.viewport.clamp((w, h), canvas_size)
+        zoom = self.viewport.get_zoom((w, h), canvas_size)
+        region, offset, display_size = self.viewport.visible_region((w, h), canvas_size)
+        sliders = self._slider_state()
+        state = dict(sliders, scale=1.0, angle=0.0)
+        temp_size = self.backends.rotated_size(int(w * sliders["scale"]), int(h * sliders["scale"]), sliders["angle"])
+
+        def halo(scale):
+            # Kernel reach at the level's resolution, see operation_halo; the
+            # edge overlay's margin is approximate, which is fine for display
+            return self.backends.operation_halo("intensity_filters", {"blur": state["blur"] * scale, "edge": state["edge"]},
+                                  exact=False)
+
+        def job():
+            with span("preview.region"):
+                crop, scale, inner = self.region_proxy.get(img, region, zoom, halo)
+                processed = self.intensity_pipeline.render(crop, state, scale)
+                frame = self.buffer_pool.acquire(display_size[::-1] + processed.shape[2:], processed.dtype)
+                return self.backends.fit_region(processed, inner, display_size, dst=frame)
+
+        def on_done(frame):
+            self._display_frame(frame, offset=offset)
+            record_frame(started, kind)
+            self._update_status_bar(temp_size=temp_size)
+
+        self.scheduler.submit(
+            "preview",
+            job,
+            on_done,
+            on_error=lambda e: messagebox.showerror("Error", f"Preview failed: {str(e)}"),
+        )
+
+    def apply_adjustments(self):
+        """Commit the slider preview, rendering it at full resolution."""
+        if not self._ensure_image_loaded():
+            return
+        operations = self._slider_operations(self._slider_state())
+        if operations:
+            self._queue_commit(operations)
 
     def adjust_grayscale(self, delta):
         """Adjust grayscale intensity with +/- buttons."""
@@ -262,31 +518,165 @@ class ImageEditorApp(tk.Tk):
 
     # ---------- File operations ----------
 
-    def open_image(self):
-        filetypes = [
-            ("Image files", "*.jpg *.jpeg *.png *.bmp"),
-            ("All files", "*.*"),
-        ]
-        path = filedialog.askopenfilename(title="Open Image", filetypes=filetypes)
+    def open_image(self, path=None):
+        """Open path, or ask for a file when none is given."""
+        if path is None:
+            filetypes = [
+                ("Image files", "*.jpg *.jpeg *.png *.bmp"),
+                ("All files", "*.*"),
+            ]
+            path = filedialog.askopenfilename(title="Open Image", filetypes=filetypes)
         if not path:
             return
+        # Large JPEGs appear first at reduced size; the full decode follows on a
+        # background thread and any edits made meanwhile are replayed onto it
+        self.scheduler.cancel("preview")
+        self._pending_full_image = None
+        self._open_times = None
+        self._load_token = object()
+        self.status_var.set(f"Opening {os.path.basename(path)}...")
+        self.loader.open(
+            path,
+            max(self._canvas_size()),
+            on_reduced=lambda image, factor: self._on_reduced_loaded(path, image),
+            on_full=lambda image: self._on_full_loaded(path, image),
+            on_error=lambda e: messagebox.showerror("Error", str(e)),
+        )
+
+    def _on_reduced_loaded(self, path, image):
+        self.model.begin_load(path, image)
+        self._after_open()
+
+    def _on_full_loaded(self, path, image):
+        if self.model.is_loading() and (self._commit_queue or self._replaying_load):
+            # Let queued edits finish on the stand-in; they are replayed afterwards
+            self._pending_full_image = image
+            return
+        if self.model.is_loading():
+            self._replay_full_load(path, image)
+            return
         try:
-            self.model.load_image(path)
-            self._original_for_sliders = self.model.get_image().copy()
-            self.blur_reference = self.model.get_image().copy()
-            self.reset_all()
-            self._update_display()
-            self._update_status_bar()
+            self.model.set_loaded_image(path, image)
         except Exception as e:
             messagebox.showerror("Error", str(e))
+            return
+        self._finish_open()
 
-    def save_image(self):
+    def _replay_full_load(self, path, image):
+        """Replay the edits made on the stand-in on the full decode on the render
+        worker, then swap it in on the Tk thread."""
+        self._replaying_load = True
+        token = self._load_token
+        self.status_var.set("Applying edits at full resolution...")
+
+        def on_done(replayed):
+            self._replaying_load = False
+            if token is self._load_token and self.model.is_loading():
+                if not self.model.finish_load(image, replayed):
+                    # Undo or redo while the worker ran; replay the history as it is now
+                    self._replay_full_load(path, image)
+                    return
+                self._finish_open()
+            self._start_next_commit()
+
+        def on_error(e):
+            self._replaying_load = False
+            messagebox.showerror("Error", str(e))
+            self._start_next_commit()
+
+        self.scheduler.submit("commit", lambda: self.model.replay_full_load(image), on_done, on_error=on_error)
+
+    def _finish_open(self):
+        stats = self.loader.get_stats()
+        self._open_times = (stats.get("first_pixel_ms", self.loader.elapsed_ms()), self.loader.elapsed_ms())
+        self._after_open()
+
+    def _finish_pending_load(self):
+        image, self._pending_full_image = self._pending_full_image, None
+        if image is not None:
+            self._on_full_loaded(self.model.get_filename(), image)
+
+    def _after_open(self):
+        # Zoom and pan are in image pixels, which change when the full decode arrives
+        self.cancel_cutout()
+        self.viewport.reset()
+        self.reset_all()
+        self._update_display()
+        self._update_status_bar()
+        self.startup.mark("first_image")
+        if self._exit_when_started:
+            self.after_idle(self.quit)
+
+    def open_session(self):
+        """Reopen a saved session: pixels are memory-mapped, not decoded, and the
+        full undo history comes back."""
+        path = filedialog.askopenfilename(
+            title="Open Session", filetypes=[("Editor session", "*" + self.backends.SESSION_EXTENSION), ("All files", "*.*")])
+        if not path:
+            return
+        self.loader.cancel()
+        self.scheduler.cancel("preview")
+        self._pending_full_image = None
+        started = time.perf_counter()
         try:
-            self.model.save_image()
-            messagebox.showinfo("Saved", "Image saved successfully.")
-            self._update_status_bar()
+            self.model.load_session(path)
         except Exception as e:
             messagebox.showerror("Error", str(e))
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        self._open_times = (elapsed, elapsed)
+        self._after_open()
+
+    def save_session(self):
+        """Save the original image, edit history and current image on the saver thread."""
+        try:
+            state = self.model.get_session_state()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        path = filedialog.asksaveasfilename(
+            defaultextension=self.backends.SESSION_EXTENSION,
+            filetypes=[("Editor session", "*" + self.backends.SESSION_EXTENSION)],
+            title="Save Session",
+        )
+        if not path:
+            return
+        name = os.path.basename(path)
+
+        def on_done(report):
+            self._update_status_bar()
+            self.status_var.set(self.status_var.get() + f" | session saved {report['bytes'] / (1024 * 1024):.1f} MB"
+                                f" in {report['write_ms']:.0f} ms")
+
+        self.saver.submit(
+            lambda progress: self.backends.write_session(path, progress=lambda f: progress("writing", f), **state),
+            on_done=on_done,
+            on_error=lambda e: messagebox.showerror("Save failed", str(e)),
+            on_progress=lambda stage, f: self.status_var.set(f"Saving {name}: {stage} {f:.0%}"),
+        )
+
+    def _offer_recovery(self):
+        """Ask to restore edits from an editor that did not exit cleanly.
+        Returns True if an image was recovered."""
+        for path in self.backends.find_journals():
+            if not messagebox.askyesno(
+                    "Recover edits",
+                    "The editor did not close properly last time.\n\n"
+                    "Recover the unsaved edits?"):
+                self.backends.discard_journal(path)
+                continue
+            try:
+                self.model.recover(path)
+            except Exception as e:
+                messagebox.showerror("Recovery failed", str(e))
+                continue
+            self.backends.discard_journal(path)
+            self._after_open()
+            return True
+        return False
+
+    def save_image(self):
+        self._save_in_background()
 
     def save_image_as(self):
         if self.model.get_image() is None:
@@ -295,6 +685,7 @@ class ImageEditorApp(tk.Tk):
         filetypes = [
             ("PNG", "*.png"),
             ("JPEG", "*.jpg"),
+            ("WebP", "*.webp"),
             ("Bitmap", "*.bmp"),
             ("All files", "*.*"),
         ]
@@ -305,35 +696,171 @@ class ImageEditorApp(tk.Tk):
         )
         if not path:
             return
+        self._save_in_background(path)
+
+    def _save_in_background(self, path=None):
+        """Encode on the saver thread and rename the finished file into place,
+        so the UI stays responsive and a crash cannot leave a truncated file."""
         try:
-            self.model.save_image(path)
-            messagebox.showinfo("Saved", "Image saved successfully.")
+            path, image = self.model.get_save_target(path)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        name = os.path.basename(path)
+
+        def on_progress(stage, fraction):
+            self.status_var.set(f"Saving {name}: {stage} {fraction:.0%}")
+
+        def on_done(report):
+            self.model.mark_saved(path)
             self._update_status_bar()
+            self.status_var.set(
+                self.status_var.get()
+                + f" | saved {report['bytes'] / (1024 * 1024):.1f} MB,"
+                  f" encode {report['encode_ms']:.0f} ms, write {report['write_ms']:.0f} ms"
+            )
+
+        self.saver.save(image, path, dict(self.save_options), on_done=on_done,
+                        on_error=lambda e: messagebox.showerror("Save failed", str(e)),
+                        on_progress=on_progress)
+
+    def show_save_options(self):
+        """Encoder settings used by Save and Save As."""
+        window = tk.Toplevel(self)
+        window.title("Save Options")
+        opts = self.save_options
+        png_level = tk.IntVar(value=opts["png_compression"])
+        png_strategy = tk.StringVar(value=opts["png_strategy"])
+        jpeg_quality = tk.IntVar(value=opts["jpeg_quality"])
+        jpeg_progressive = tk.BooleanVar(value=opts["jpeg_progressive"])
+        jpeg_optimize = tk.BooleanVar(value=opts["jpeg_optimize"])
+        webp_quality = tk.IntVar(value=opts["webp_quality"])
+
+        rows = [
+            ("PNG compression (0 fast - 9 small)", tk.Spinbox(window, from_=0, to=9, textvariable=png_level, width=5)),
+            ("PNG strategy", tk.OptionMenu(window, png_strategy, "default", "filtered", "huffman", "rle", "fixed")),
+            ("JPEG quality", tk.Spinbox(window, from_=0, to=100, textvariable=jpeg_quality, width=5)),
+            ("JPEG progressive", tk.Checkbutton(window, variable=jpeg_progressive)),
+            ("JPEG optimize", tk.Checkbutton(window, variable=jpeg_optimize)),
+            ("WebP quality (101 = lossless)", tk.Spinbox(window, from_=1, to=101, textvariable=webp_quality, width=5)),
+        ]
+        for row, (label, widget) in enumerate(rows):
+            tk.Label(window, text=label).grid(row=row, column=0, sticky=tk.W, padx=10, pady=3)
+            widget.grid(row=row, column=1, sticky=tk.W, padx=10, pady=3)
+
+        def apply():
+            try:
+                self.save_options = {
+                    "png_compression": max(0, min(9, png_level.get())),
+                    "png_strategy": png_strategy.get(),
+                    "jpeg_quality": max(0, min(100, jpeg_quality.get())),
+                    "jpeg_progressive": jpeg_progressive.get(),
+                    "jpeg_optimize": jpeg_optimize.get(),
+                    "webp_quality": max(1, min(101, webp_quality.get())),
+                }
+            except tk.TclError:
+                messagebox.showerror("Error", "Please enter whole numbers.", parent=window)
+                return
+            window.destroy()
+
+        tk.Button(window, text="OK", command=apply).grid(row=len(rows), column=0, columnspan=2, pady=10)
+
+    def export_trace(self):
+        """Save the recorded timing spans as a Chrome/Perfetto trace."""
+        if not instrumentation.ENABLED:
+            messagebox.showinfo("Trace", "Instrumentation is turned off (IMAGE_EDITOR_TRACE=0).")
+            return
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Trace", "*.json")],
+            title="Export Performance Trace"
+        )
+        if not path:
+            return
+        try:
+            count = instrumentation.export_chrome_trace(path)
         except Exception as e:
             messagebox.showerror("Error", str(e))
+            return
+        messagebox.showinfo(
+            "Trace",
+            f"Saved {count} events. Open the file in chrome://tracing or ui.perfetto.dev.\n\n"
+            + instrumentation.format_stats(limit=12),
+        )
 
     def on_exit(self):
         if messagebox.askokcancel("Exit", "Do you really want to exit?"):
-            self.destroy()
+            self.shutdown()
+
+    def shutdown(self):
+        """Stop the workers and close the window."""
+        self.scheduler.shutdown()
+        if self._ready:
+            # Let a save in progress finish rather than abandon it half-written
+            self.saver.shutdown(wait=True)
+            self.journal.close(discard=True)
+            self.processor.get_processor().shutdown()
+        self.destroy()
 
     # ---------- Edit operations (undo/redo) ----------
 
     def undo(self):
+        self.cancel_cutout()
         self.model.undo()
-        self._original_for_sliders = self.model.get_image().copy() if self.model.get_image() is not None else None
-        self.blur_reference = self.model.get_image().copy() if self.model.get_image() is not None else None
         self.reset_all()
         self._update_display()
         self._update_status_bar()
 
     def redo(self):
+        self.cancel_cutout()
         self.model.redo()
-        self._original_for_sliders = self.model.get_image().copy() if self.model.get_image() is not None else None
-        self.blur_reference = self.model.get_image().copy() if self.model.get_image() is not None else None
         self.reset_all()
         self._update_display()
         self._update_status_bar()
 
+    def show_history(self):
+        """List the edit steps; jump to one or remove it and replay the rest."""
+        if not self._ensure_image_loaded():
+            return
+        window = tk.Toplevel(self)
+        window.title("History")
+        listbox = tk.Listbox(window, width=60, height=15)
+        listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        def refresh():
+            steps, cursor = self.model.get_history()
+            listbox.delete(0, tk.END)
+            listbox.insert(tk.END, "0. Original image")
+            for i, description in enumerate(steps, start=1):
+                listbox.insert(tk.END, f"{i}. {description}")
+            listbox.selection_clear(0, tk.END)
+            listbox.selection_set(cursor)
+            for i in range(cursor + 1, len(steps) + 1):
+                listbox.itemconfig(i, fg="gray")
+
+        def run(action):
+            selection = listbox.curselection()
+            if not selection:
+                return
+            try:
+                action(selection[0])
+            except Exception as e:
+                messagebox.showerror("Error", str(e), parent=window)
+                return
+            self._refresh_after_change()
+            refresh()
+
+        def remove(index):
+            if index == 0:
+                raise ValueError("The original image cannot be removed.")
+            self.model.remove_step(index)
+
+        buttons = tk.Frame(window)
+        buttons.pack(pady=(0, 10))
+        tk.Button(buttons, text="Go To Step", command=lambda: run(self.model.goto_step)).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Remove Step", command=lambda: run(remove)).pack(side=tk.LEFT, padx=5)
+        refresh()
+
     # ---------- Image processing actions ----------
 
     def _ensure_image_loaded(self):
@@ -342,32 +869,58 @@ class ImageEditorApp(tk.Tk):
             return False
         return True
 
-    def apply_grayscale(self):
-        if not self._ensure_image_loaded():
-            return
-        img = self.model.get_image()
-        new_img = self._apply_intensity_filters(img)
-        self.model.apply_change(new_img)
-        self.blur_reference = self.model.get_image().copy()
-        self._update_display()
+    def _queue_commit(self, operations, on_success=None, error_title="Error", compute=None):
+        """Run (name, params) operations on the render worker and commit the result
+        to the model's operation log. Commits run one after another so every button
+        press is applied in order. compute(source), if given, runs instead and
+        returns (result, operations, cost), or None when it no longer applies."""
+        self._commit_queue.append((operations, on_success, error_title, compute))
+        if len(self._commit_queue) == 1 and not self._replaying_load:
+            self._start_next_commit()
 
-    def apply_blur(self):
-        if not self._ensure_image_loaded():
+    def _start_next_commit(self):
+        if not self._commit_queue:
+            self._finish_pending_load()
             return
-        img = self.model.get_image()
-        new_img = self._apply_intensity_filters(img)
-        self.model.apply_change(new_img)
-        self.blur_reference = self.model.get_image().copy()
-        self._update_display()
-        self._update_status_bar()
-
-    def apply_edges(self):
-        if not self._ensure_image_loaded():
+        operations, on_success, error_title, compute = self._commit_queue[0]
+        source = self.model.get_image()
+        if source is None:
+            self._commit_queue.clear()
             return
-        img = self.model.get_image()
-        new_img = self._apply_intensity_filters(img)
-        self.model.apply_change(new_img)
-        self.blur_reference = self.model.get_image().copy()
+        self.scheduler.cancel("preview")
+        self.status_var.set("Processing...")
+
+        def job():
+            if compute is not None:
+                return compute(source)
+            start = time.perf_counter()
+            return self.processor.apply_all(source, operations), operations, time.perf_counter() - start
+
+        def on_done(result):
+            self._commit_queue.pop(0)
+            # Undo/redo or a new file while the worker ran makes this result stale
+            if result is not None and self.model.get_image() is source:
+                new_img, done_operations, cost = result
+                self.model.apply_change(new_img, done_operations, cost)
+                self._refresh_after_change()
+                if on_success is not None:
+                    on_success()
+            elif compute is not None:
+                # A stale cutout: drop the preview the canvas still shows for it
+                self._update_display()
+            self._start_next_commit()
+
+        def on_error(e):
+            self._commit_queue.clear()
+            self._update_display()
+            self._update_status_bar()
+            messagebox.showerror(error_title, str(e))
+            self._finish_pending_load()
+
+        self.scheduler.submit("commit", job, on_done, on_error=on_error)
+
+    def _refresh_after_change(self):
+        self.reset_all()
         self._update_display()
         self._update_status_bar()
 
@@ -375,110 +928,421 @@ class ImageEditorApp(tk.Tk):
         """Apply background removal to the current image."""
         if not self._ensure_image_loaded():
             return
-        try:
-            img = self.model.get_image()
-            new_img = self.processor.remove_background(img)
-            self.model.apply_change(new_img)
-            self._original_for_sliders = self.model.get_image().copy()
-            self.blur_reference = self.model.get_image().copy()
-            self.reset_all()
-            self._update_display()
-            self._update_status_bar()
-            messagebox.showinfo("Success", "Background removed! Save as PNG to preserve transparency.")
-        except Exception as e:
-            messagebox.showerror("Error", f"Background removal failed: {str(e)}")
+        self._queue_commit(
+            [("remove_background", {})],
+            on_success=lambda: messagebox.showinfo(
+                "Success",
+                f"Background removed in {self.processor.get_background_stats().get('total', 0.0):.1f}s! "
+                "Save as PNG to preserve transparency.",
+            ),
+            error_title="Background removal failed",
+        )
 
-    def apply_rotate(self, angle):
+    # ---------- Refine Cutout ----------
+
+    def toggle_cutout(self):
+        """Start refining a cutout with brush strokes, or apply the one in progress."""
+        if self._cutout_source is None:
+            self._start_cutout()
+        else:
+            self._finish_cutout()
+
+    def _start_cutout(self):
         if not self._ensure_image_loaded():
             return
+        if self.model.is_loading() or self._commit_queue or self._replaying_load:
+            # Strokes are recorded in pixels of the image being cut out, so it
+            # must be the full decode with every queued edit applied
+            messagebox.showwarning("Warning", "Please wait until the image has finished loading "
+                                   "and the current edits are applied.")
+            return
         img = self.model.get_image()
-        new_img = self.processor.rotate(img, angle)
-        self.model.apply_change(new_img)
-        self._original_for_sliders = self.model.get_image().copy()
-        self.blur_reference = self.model.get_image().copy()
+        self.viewport.reset()
         self.reset_all()
+        self._cutout_source = img
+        self.cutout_button.config(text="Apply Cutout", relief=tk.SUNKEN)
+        self.status_var.set("Cutting out the background...")
+
+        def on_done(session):
+            if self._cutout_source is not img:
+                return
+            self._cutout_session = session
+            self._cutout_mask = session.get_mask()
+            self._show_cutout()
+            self.status_var.set(f"Cut out in {session.get_last_stats()['initial']:.1f}s. "
+                                "Paint with the left button to keep, the right button to remove; "
+                                "Apply Cutout when done, Esc to cancel.")
+
+        def on_error(e):
+            self.cancel_cutout()
+            messagebox.showerror("Background removal failed", str(e))
+
+        self.scheduler.submit("cutout", lambda: self.processor.grabcut_session(img), on_done, on_error=on_error)
+
+    def _finish_cutout(self):
+        """Refine any strokes still waiting and commit the cutout through the
+        commit queue. Its operation records the strokes, so undo/redo and
+        sessions can replay it."""
+        source, session, strokes = self._cutout_source, self._cutout_session, self._cutout_strokes
+        self._end_cutout()
+        if session is None:
+            self._update_display()
+            return
+
+        def compute(current):
+            if current is not source:
+                return None
+            _refine_strokes(session, strokes)
+            result = session.cutout()
+            operations = [("remove_background", {"strokes": session.get_strokes()})]
+            # The replay would recut the image from scratch; cache what was shown
+            result = self.processor.get_or_compute(source, operations, lambda: result)
+            return result, operations, session.get_last_stats()["total"]
+
+        self._queue_commit([], error_title="Background removal failed", compute=compute)
+
+    def cancel_cutout(self):
+        """Leave Refine Cutout without changing the image."""
+        if self._cutout_source is None:
+            return
+        self.scheduler.cancel("cutout")
+        self._end_cutout()
         self._update_display()
         self._update_status_bar()
 
+    def _end_cutout(self):
+        self._cutout_source = None
+        self._cutout_session = None
+        self._cutout_strokes = queue.Queue()
+        self._cutout_mask = None
+        self._stroke = None
+        self.canvas.delete("stroke")
+        self.cutout_button.config(text="Refine Cutout", relief=tk.RAISED)
+
+    def on_stroke_start(self, event, foreground=True):
+        if self._cutout_session is None:
+            return
+        self._stroke = {"points": [self._to_image(event)], "foreground": foreground, "last": (event.x, event.y)}
+
+    def on_stroke_move(self, event):
+        if self._stroke is None:
+            return
+        # Canvas lines show the stroke until the refined cut replaces them
+        self.canvas.create_line(*self._stroke["last"], event.x, event.y, tags="stroke",
+                                fill="green" if self._stroke["foreground"] else "red",
+                                width=2 * BRUSH_PX, capstyle=tk.ROUND)
+        self._stroke["last"] = (event.x, event.y)
+        self._stroke["points"].append(self._to_image(event))
+
+    def on_stroke_end(self, event):
+        stroke, self._stroke = self._stroke, None
+        session = self._cutout_session
+        if stroke is None or session is None:
+            return
+        img = session.get_image()
+        h, w = img.shape[:2]
+        radius = BRUSH_PX / self.viewport.get_zoom((w, h), self._canvas_size())
+        self._cutout_strokes.put((stroke["points"], radius, stroke["foreground"]))
+        strokes = self._cutout_strokes
+
+        def job():
+            # Jobs under one key replace each other, so each one takes every
+            # stroke still queued rather than only its own
+            _refine_strokes(session, strokes)
+            return session.get_mask(), session.get_last_stats()
+
+        def on_done(result):
+            if self._cutout_session is not session:
+                return
+            self._cutout_mask, stats = result
+            if strokes.empty():
+                self.canvas.delete("stroke")
+            self._show_cutout()
+            if "refine" in stats:
+                self.status_var.set(f"Refined in {stats['refine'] * 1000:.0f} ms "
+                                    f"({stats['window_fraction']:.0%} of the image recut)")
+
+        self.scheduler.submit("cutout", job, on_done,
+                              on_error=lambda e: messagebox.showerror("Error", f"Refine failed: {str(e)}"))
+
+    def _to_image(self, event):
+        h, w = self._cutout_source.shape[:2]
+        return self.viewport.to_image((event.x, event.y), (w, h), self._canvas_size())
+
+    def _show_cutout(self):
+        """Show the image being cut out on the fitted canvas, with the
+        background dimmed rather than hidden so it can be painted back."""
+        img = self._cutout_source
+        proxy, _ = self.preview.get(img, self._canvas_size())
+        mask = self._cutout_mask
+        if mask is None:
+            self._display_image(proxy)
+            return
+        cv2 = self.backends.cv2
+        mask = cv2.resize(mask, (proxy.shape[1], proxy.shape[0]), interpolation=cv2.INTER_NEAREST)
+        if proxy.ndim == 3:
+            mask = mask[:, :, None]
+        self._display_image(self.backends.np.where(mask, proxy, proxy // 3))
+
+    def apply_rotate(self, angle):
+        if not self._ensure_image_loaded():
+            return
+        self._queue_commit([("rotate", {"angle": angle})])
+
     def apply_flip(self, mode):
         if not self._ensure_image_loaded():
             return
-        img = self.model.get_image()
-        new_img = self.processor.flip(img, mode)
-        self.model.apply_change(new_img)
-        self._original_for_sliders = self.model.get_image().copy()
-        self.blur_reference = self.model.get_image().copy()
-        self.reset_all()
-        self._update_display()
-        self._update_status_bar()
+        self._queue_commit([("flip", {"mode": mode})])
 
-    # ---------- Sliders: resize, brightness, contrast ----------
+    # ---------- Sliders: resize, rotation, brightness, contrast ----------
 
-    def on_scale_change(self, event=None):
-        img = self.model.get_image()
-        if img is None:
+    def on_geometry_change(self, event=None):
+        """Resize and angle sliders: a nearest-neighbour draft while the slider
+        moves, then a high-quality render once it is released or rests."""
+        if self._settle_job is not None:
+            self.after_cancel(self._settle_job)
+        self._settle_job = self.after(SETTLE_MS, self._settle_preview)
+        self._render_preview(quality="draft")
+
+    def _settle_preview(self, event=None):
+        if self._settle_job is None:
             return
-        scale = self.scale_var.get()
-        new_img = self.processor.resize(img, scale=scale)
-        self._display_image(new_img)
-        self._update_status_bar(temp_image=new_img)
+        self.after_cancel(self._settle_job)
+        self._settle_job = None
+        self._render_preview(quality="high", kind="final")
 
-    def on_brightness_contrast_change(self, event=None):
-        if self._original_for_sliders is None:
-            if self.model.get_image() is None:
-                return
-            self._original_for_sliders = self.model.get_image().copy()
+    def _shown_scale(self, proxy, state, canvas_size):
+        """The resize slider's scale, capped so the resized and rotated proxy
+        still fits the canvas."""
+        h, w = proxy.shape[:2]
+        rot_w, rot_h = self.backends.rotated_size(w, h, state["angle"])
+        fit = min(canvas_size[0] / rot_w, canvas_size[1] / rot_h)
+        return round(min(state["scale"], fit), 4)
 
-        b = float(self.brightness_slider.get())
-        c = float(self.contrast_slider.get())
-        new_img = self.processor.adjust_brightness_contrast(
-            self._original_for_sliders, brightness=b, contrast=c
-        )
-        self._display_image(new_img)
-        self._update_status_bar(temp_image=new_img)
+    def on_brightness_contrast_change(self, event=None):
+        self._render_preview()
 
     def _reset_sliders(self):
         self.scale_var.set(1.0)
+        self.angle_var.set(0.0)
         self.brightness_slider.set(0)
         self.contrast_slider.set(1.0)
 
+    # ---------- Zoom and pan ----------
+
+    def set_zoom(self, zoom, anchor=None):
+        """Zoom to `zoom` display pixels per image pixel, keeping the point under
+        canvas position anchor (default: the centre) in place."""
+        img = self.model.get_image()
+        # Strokes are painted on the fitted view of the cutout
+        if img is None or self._cutout_source is not None:
+            return
+        h, w = img.shape[:2]
+        self.viewport.set_zoom(zoom, (w, h), self._canvas_size(), anchor)
+        self._render_preview()
+
+    def zoom_by(self, factor, anchor=None):
+        img = self.model.get_image()
+        if img is None:
+            return
+        h, w = img.shape[:2]
+        self.set_zoom(self.viewport.get_zoom((w, h), self._canvas_size()) * factor, anchor)
+
+    def zoom_to_fit(self):
+        self.viewport.reset()
+        if self.model.get_image() is not None:
+            self._render_preview()
+
+    def on_mouse_wheel(self, event):
+        up = event.num == 4 or getattr(event, "delta", 0) > 0
+        self.zoom_by(1.25 if up else 0.8, anchor=(event.x, event.y))
+
+    def on_pan_start(self, event):
+        if self._cutout_source is not None:
+            self.on_stroke_start(event, foreground=True)
+            return
+        self._pan_anchor = (event.x, event.y)
+
+    def on_pan_move(self, event):
+        if self._stroke is not None:
+            self.on_stroke_move(event)
+            return
+        img = self.model.get_image()
+        if img is None or self._pan_anchor is None or self.viewport.is_fit():
+            return
+        dx, dy = event.x - self._pan_anchor[0], event.y - self._pan_anchor[1]
+        self._pan_anchor = (event.x, event.y)
+        h, w = img.shape[:2]
+        self.viewport.pan(dx, dy, (w, h), self._canvas_size())
+        self._render_preview()
+
+    def on_pan_end(self, event):
+        if self._stroke is not None:
+            self.on_stroke_end(event)
+        self._pan_anchor = None
+
     # ---------- Display helpers ----------
 
-    def _display_image(self, image):
-        # Handle both 3-channel and 4-channel images (with alpha)
-        if len(image.shape) == 3:
-            if image.shape[2] == 4:
-                # BGRA to RGBA
-                rgb_image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA)
-            else:
-                # BGR to RGB
-                rgb_image = image[:, :, ::-1]
+    def _render_to_cache(self, proxy, state, scale):
+        """Pipeline render for the preview cache. The pipeline rewrites its
+        buffers on the next render, so the cache gets its own copy."""
+        rendered = self.intensity_pipeline.render(proxy, state, scale)
+        if rendered is proxy:
+            return proxy
+        record_allocation("preview.cache", rendered.nbytes)
+        return rendered.copy()
+
+    def _copy_to_frame(self, rendered):
+        """Copy a pipeline result into a pooled frame. The pipeline rewrites its
+        buffers on the next render, which may start before the Tk thread has shown
+        this one; frames go back to the pool once shown, so two of them take turns."""
+        frame = self.buffer_pool.acquire_like(rendered)
+        self.backends.np.copyto(frame, rendered)
+        return frame
+
+    def _display_frame(self, frame, offset=None):
+        """Show a pooled preview frame and return it to the pool."""
+        # The same frame array comes back with new pixels, which the identity
+        # check in DisplayCache cannot see
+        self.display_cache.invalidate()
+        self._display_image(frame, offset=offset)
+        self.buffer_pool.release(frame)
+
+    def _display_image(self, image, offset=None):
+        """Show image centred on the canvas, or with its top-left corner at
+        offset (x, y) for a zoomed view."""
+        # Fit to canvas first, then convert colour on the small array only
+        canvas_w, canvas_h = self._canvas_size()
+        with span("display.fit"):
+            buffer = self.display_cache.get_buffer()
+            display = self.display_cache.get(image, (canvas_w, canvas_h))
+        if display is not image and display is not buffer:
+            record_allocation("display.fit", display.nbytes)
+
+        # Image.fromarray wraps the contiguous array without copying; paste() then
+        # updates the existing PhotoImage in place while its size and mode match
+        with span("display.photoimage"):
+            pil_image = self.backends.Image.fromarray(display)
+            if (self.tk_image is None or self.tk_image.width() != pil_image.width
+                    or self.tk_image.height() != pil_image.height or self._tk_mode != pil_image.mode):
+                self.tk_image = self.backends.ImageTk.PhotoImage(pil_image.mode, pil_image.size)
+                self._tk_mode = pil_image.mode
+            self.tk_image.paste(pil_image)
+
+        if offset is None:
+            x, y, anchor = canvas_w // 2, canvas_h // 2, tk.CENTER
         else:
-            rgb_image = image
+            (x, y), anchor = offset, tk.NW
+        with span("display.canvas"):
+            if self._canvas_item is None:
+                self._canvas_item = self.canvas.create_image(x, y, image=self.tk_image, anchor=anchor)
+            else:
+                self.canvas.coords(self._canvas_item, x, y)
+                self.canvas.itemconfigure(self._canvas_item, image=self.tk_image, anchor=anchor)
 
-        pil_image = Image.fromarray(rgb_image)
+    def on_canvas_resize(self, event=None):
+        # Configure fires continuously while the window is dragged; redraw once it settles
+        if self._resize_job is not None:
+            self.after_cancel(self._resize_job)
+        self._resize_job = self.after(100, self._redraw_after_resize)
 
-        # Fit to canvas while keeping aspect ratio
-        canvas_w = self.canvas.winfo_width() or 800
-        canvas_h = self.canvas.winfo_height() or 600
-        pil_image.thumbnail((canvas_w, canvas_h))
+    def _redraw_after_resize(self):
+        self._resize_job = None
+        if self.model.get_image() is not None:
+            # Renders the committed image plus any slider preview at the new size
+            self._render_preview()
 
-        self.tk_image = ImageTk.PhotoImage(pil_image)
-        self.canvas.delete("all")
-        self.canvas.create_image(canvas_w // 2, canvas_h // 2, image=self.tk_image)
+    def _canvas_size(self):
+        # winfo_width reports 1 before the canvas is mapped
+        canvas_w = self.canvas.winfo_width()
+        canvas_h = self.canvas.winfo_height()
+        if canvas_w <= 1 or canvas_h <= 1:
+            return 800, 600
+        return canvas_w, canvas_h
 
     def _update_display(self):
         img = self.model.get_image()
-        if img is not None:
-            self._display_image(img)
+        if img is not None and self._cutout_source is not None:
+            self._show_cutout()
+        elif img is not None and not self.viewport.is_fit():
+            self._render_preview()
+        elif img is not None:
+            proxy, _ = self.preview.get(img, self._canvas_size())
+            self._display_image(proxy)
 
-    def _update_status_bar(self, temp_image=None):
+    def _update_status_bar(self, temp_image=None, temp_size=None):
         img = temp_image if temp_image is not None else self.model.get_image()
         if img is None:
             self.status_var.set("No image loaded.")
             return
 
-        h, w = img.shape[:2]
+        if temp_size is not None:
+            w, h = temp_size
+        else:
+            h, w = img.shape[:2]
         filename = self.model.get_filename()
         name_only = os.path.basename(filename) if filename else "Unsaved image"
-        self.status_var.set(f"{name_only} - {w}x{h}px")
\ No newline at end of file
+        status = f"{name_only} - {w}x{h}px"
+        if self.model.is_loading():
+            status += " (reduced preview, loading full resolution...)"
+        elif self._open_times is not None and temp_size is None:
+            status += f" | opened: first pixel {self._open_times[0]:.0f} ms, full {self._open_times[1]:.0f} ms"
+        if self.model.get_image() is not None:
+            ih, iw = self.model.get_image().shape[:2]
+            status += f" | zoom {self.viewport.get_zoom((iw, ih), self._canvas_size()):.0%}"
+            if self.viewport.is_fit():
+                status += " (fit)"
+        history = self.model.get_history_usage()
+        status += f" | history {history['bytes'] / (1024 * 1024):.1f} MB"
+        if temp_size is not None:
+            stats = self.scheduler.get_stats()
+            cache = self.preview_results.get_stats()
+            status += (f" | preview {stats['last_latency_ms']:.0f} ms,"
+                       f" {stats['finished']} rendered, {stats['dropped']} dropped,"
+                       f" {cache['hit_rate']:.0%} from cache")
+            frames = instrumentation.get_frame_stats()
+            if frames is not None:
+                status += f" | frame {frames['last_ms']:.0f} ms (avg {frames['mean_ms']:.0f})"
+            final = instrumentation.get_frame_stats("final")
+            if final is not None:
+                status += f" | final render {final['last_ms']:.0f} ms"
+        self.status_var.set(status)
+
+
+def _refine_strokes(session, strokes):
+    """Add the queued strokes to a GrabCutSession and refine around them."""
+    while True:
+        try:
+            stroke = strokes.get_nowait()
+        except queue.Empty:
+            break
+        session.add_stroke(*stroke)
+    session.refine()
+
+
+def _import_backends(profile):
+    """Import the imaging stack, timing each part as a phase of profile, and
+    return everything imported as one namespace. Runs on the render worker
+    while the window is already up; the Tk thread gets the namespace in
+    _on_backends_loaded."""
+    with profile.phase("numpy"):
+        import numpy as np
+    with profile.phase("opencv"):
+        import cv2
+    with profile.phase("pillow"):
+        from PIL import Image, ImageTk
+    with profile.phase("processing"):
+        from buffer_pool import BufferPool
+        from image_processor import ImageProcessor, operation_halo, rotated_size
+        from intensity_pipeline import IntensityPipeline, stage_params
+        from parallel import ParallelExecutor, set_thread_budget
+        from preview import DisplayCache, PreviewProxy
+        from result_cache import CachedProcessor
+        from viewport import RegionProxy, Viewport, fit_region
+    with profile.phase("model and files"):
+        from image_loader import ProgressiveLoader
+        from image_model import ImageModel
+        from image_writer import DEFAULT_OPTIONS, BackgroundSaver
+        from session import EXTENSION as SESSION_EXTENSION, Journal, discard_journal, find_journals, write_session
+    # Every name imported above, e.g. backends.np or backends.ImageModel
+    return types.SimpleNamespace(**{name: value for name, value in locals().items() if name != "profile"})
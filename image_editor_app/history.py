@@ -0,0 +1,91 @@
+# history.py
+
+import zlib
+
+import numpy as np
+
+
+class HistoryEntry:
+    """
+    One step of history, stored compressed.
+    A "delta" entry holds (after - before) modulo 2**bits over the bounding box of
+    the changed pixels, so it can rebuild either side from the other. A "full"
+    entry holds the pixels of one side and is used when the shape or dtype changes.
+    """
+
+    def __init__(self, kind, shape, dtype, payload, region=None):
+        self.kind = kind
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.payload = payload
+        self.region = region    # (y0, y1, x0, x1) for delta entries
+
+    @property
+    def nbytes(self):
+        return len(self.payload)
+
+
+def _compress(array, level):
+    return zlib.compress(np.ascontiguousarray(array).data, level)
+
+
+def _decompress(payload, dtype, shape):
+    return np.frombuffer(zlib.decompress(payload), dtype=dtype).reshape(shape)
+
+
+def _changed_region(before, after):
+    changed = before != after
+    if changed.ndim == 3:
+        changed = changed.any(axis=2)
+    rows = np.flatnonzero(changed.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(changed[rows[0]:rows[-1] + 1].any(axis=0))
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+def encode_delta(before, after, level=1):
+    """Encode the step before -> after, as a delta when the two are comparable."""
+    if (before.shape != after.shape or before.dtype != after.dtype
+            or before.dtype.kind not in "ui"):
+        return encode_full(before, level)
+    region = _changed_region(before, after)
+    if region is None:
+        return HistoryEntry("delta", before.shape, before.dtype, b"", None)
+    y0, y1, x0, x1 = region
+    # Unsigned wrap-around keeps the delta lossless; uniform shifts such as
+    # brightness changes become runs of one value and compress very well
+    diff = after[y0:y1, x0:x1] - before[y0:y1, x0:x1]
+    return HistoryEntry("delta", before.shape, before.dtype, _compress(diff, level), region)
+
+
+def encode_full(image, level=1):
+    return HistoryEntry("full", image.shape, image.dtype, _compress(image, level))
+
+
+def decode_full(entry):
+    return _decompress(entry.payload, entry.dtype, entry.shape).copy()
+
+
+def apply_backward(entry, after):
+    """Rebuild the image before the step from the image after it."""
+    if entry.kind == "full":
+        return decode_full(entry)
+    return _apply_delta(entry, after, np.subtract)
+
+
+def apply_forward(entry, before):
+    """Rebuild the image after the step from the image before it."""
+    return _apply_delta(entry, before, np.add)
+
+
+def _apply_delta(entry, image, op):
+    result = image.copy()
+    if entry.region is None:
+        return result
+    y0, y1, x0, x1 = entry.region
+    shape = (y1 - y0, x1 - x0) + tuple(entry.shape[2:])
+    diff = _decompress(entry.payload, entry.dtype, shape)
+    region = result[y0:y1, x0:x1]
+    op(region, diff, out=region)
+    return result
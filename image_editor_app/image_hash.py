@@ -0,0 +1,50 @@
+# image_hash.py
+
+import hashlib
+import threading
+import weakref
+
+import numpy as np
+
+# Digests of read-only arrays, by id; entries go when the array is collected
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def content_hash(image):
+    """
+    Digest of an image's pixels, shape and dtype. Two arrays with the same
+    content share a hash whatever their memory layout, so it can key caches of
+    expensive results.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((image.shape, image.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+def fingerprint(image):
+    """
+    content_hash, remembered for read-only arrays so an image that is looked up
+    again (such as a cached result fed to the next operation) is hashed once.
+    Writable arrays are hashed every time since they may have changed.
+    """
+    if image.flags.writeable:
+        return content_hash(image)
+    key = id(image)
+    with _memo_lock:
+        entry = _memo.get(key)
+    if entry is not None and entry[0]() is image:
+        return entry[1]
+    digest = content_hash(image)
+    ref = weakref.ref(image, lambda _, key=key: _forget(key))
+    with _memo_lock:
+        _memo[key] = (ref, digest)
+    return digest
+
+
+def _forget(key):
+    with _memo_lock:
+        entry = _memo.get(key)
+        if entry is not None and entry[0]() is None:
+            del _memo[key]
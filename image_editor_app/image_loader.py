@@ -0,0 +1,141 @@
+# image_loader.py
+
+import queue
+import threading
+import time
+
+import cv2
+from PIL import Image
+
+_REDUCED_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def reduced_factor(path, target_side):
+    """
+    Largest JPEG downscale (8, 4 or 2) whose result still has a longest side of
+    at least target_side, or 1 if a reduced decode would not help. libjpeg can
+    skip most of the work at these factors; other formats decode fully anyway.
+    Only the file header is read.
+    """
+    try:
+        with Image.open(path) as im:
+            fmt, (w, h) = im.format, im.size
+    except OSError:
+        return 1
+    if fmt != "JPEG":
+        return 1
+    for factor in (8, 4, 2):
+        if max(w, h) / factor >= target_side:
+            return factor
+    return 1
+
+
+def read_reduced(path, factor):
+    # IMREAD_UNCHANGED ignores EXIF orientation, so the stand-in must as well
+    image = cv2.imread(path, _REDUCED_FLAGS[factor] | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise ValueError("Could not load image.")
+    return image
+
+
+def read_full(path):
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("Could not load image.")
+    return image
+
+
+class ProgressiveLoader:
+    """
+    Opens image files without blocking the Tk main loop. Large JPEGs are first
+    decoded at reduced size so something can be shown quickly, then the full
+    image is decoded on the same background thread. Callbacks run on the Tk
+    thread. Opening another file makes the results of an earlier one stale,
+    and they are dropped.
+    """
+
+    def __init__(self, root, poll_ms=20):
+        self._root = root
+        self._poll_ms = poll_ms
+        self._results = queue.Queue()
+        self._generation = 0
+        self._callbacks = None
+        self._polling = False
+        self._stats = {}
+
+    # Encapsulated getters
+    def is_loading(self):
+        return self._callbacks is not None
+
+    def get_stats(self):
+        """Reduction factor, time to first pixel and time until the full decode
+        was handed over (ms) for the last file opened, measured from open() until
+        each callback returned."""
+        return dict(self._stats)
+
+    def elapsed_ms(self):
+        """Milliseconds since the last open() call."""
+        return (time.perf_counter() - self._stats["started"]) * 1000 if self._stats else 0.0
+
+    # Core methods
+    def open(self, path, target_side, on_reduced, on_full, on_error):
+        """
+        Start loading path. on_reduced(image, factor) is called with the reduced
+        decode if one is worthwhile, then on_full(image) with the full decode.
+        target_side is the smallest longest side the reduced image may have.
+        """
+        self._generation += 1
+        generation = self._generation
+        self._callbacks = (on_reduced, on_full, on_error)
+        self._stats = {"path": path, "factor": 1, "started": time.perf_counter()}
+        worker = threading.Thread(target=self._load, args=(generation, path, target_side),
+                                  name="image-loader", daemon=True)
+        worker.start()
+        if not self._polling:
+            self._polling = True
+            self._root.after(self._poll_ms, self._poll)
+
+    def cancel(self):
+        self._generation += 1
+        self._callbacks = None
+
+    # Internal helpers
+    def _load(self, generation, path, target_side):
+        try:
+            factor = reduced_factor(path, target_side)
+            if factor > 1:
+                self._results.put((generation, "reduced", (read_reduced(path, factor), factor)))
+            self._results.put((generation, "full", read_full(path)))
+        except Exception as e:
+            self._results.put((generation, "error", e))
+
+    def _poll(self):
+        while True:
+            try:
+                generation, kind, payload = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self._generation or self._callbacks is None:
+                continue
+            on_reduced, on_full, on_error = self._callbacks
+            if kind == "error":
+                self._callbacks = None
+                on_error(payload)
+                continue
+            if kind == "reduced":
+                image, factor = payload
+                self._stats["factor"] = factor
+                on_reduced(image, factor)
+            else:
+                self._callbacks = None
+                on_full(payload)
+                self._stats["full_decode_ms"] = self.elapsed_ms()
+            self._stats.setdefault("first_pixel_ms", self.elapsed_ms())
+        if self._callbacks is not None:
+            self._root.after(self._poll_ms, self._poll)
+        else:
+            self._polling = False
@@ -3,18 +3,28 @@
 import cv2
 import numpy as np
 
+from image_processor import ImageProcessor
+from image_writer import save_image as write_image
+from instrumentation import traced
+from operation_log import EditStep, OperationLog
+from session import open_session, read_journal, write_session
+
 class ImageModel:
     """
-    Holds the current image, original image, file name, and undo/redo stacks.
+    Holds the current image, original image, file name, and undo/redo history.
     Demonstrates encapsulation and class interaction with ImageProcessor.
+    History is an OperationLog: edits are recorded as ImageProcessor operations
+    and replayed from sparse checkpoints, within a byte budget.
+    With a session.Journal every history change is also logged for crash recovery.
     """
 
-    def __init__(self):
-        self._original_image = None
+    def __init__(self, processor=None, history_budget=512 * 1024 * 1024, journal=None):
         self._current_image = None
         self._file_path = None
-        self._undo_stack = []
-        self._redo_stack = []
+        self._loading = False
+        self._processor = processor or ImageProcessor()
+        self._history = OperationLog(self._processor, budget_bytes=history_budget)
+        self._journal = journal
 
     # Encapsulated getters
     def get_image(self):
@@ -29,47 +39,193 @@ class ImageModel:
         h, w = self._current_image.shape[:2]
         return w, h
 
+    def is_loading(self):
+        """True while the current image is a reduced stand-in for the real file."""
+        return self._loading
+
+    def can_undo(self):
+        return self._history.can_undo()
+
+    def can_redo(self):
+        return self._history.can_redo()
+
+    def get_history(self):
+        """Descriptions of every edit step and the index of the current one."""
+        return [step.describe() for step in self._history.get_steps()], self._history.get_cursor()
+
+    def get_history_usage(self):
+        """Bytes held by the undo/redo history, its budget and the step counts."""
+        return self._history.get_usage()
+
+    def set_history_budget(self, budget_bytes):
+        self._history.set_budget(budget_bytes)
+
     # Core methods
+    @traced("model.load_image")
     def load_image(self, file_path):
         image = cv2.imread(file_path, cv2.IMREAD_UNCHANGED)
         if image is None:
             raise ValueError("Could not load image.")
+        self.set_loaded_image(file_path, image)
+
+    def set_loaded_image(self, file_path, image):
+        """Start editing an image decoded elsewhere (e.g. on a loader thread)."""
         self._file_path = file_path
-        self._original_image = image.copy()
         self._current_image = image
-        self._undo_stack.clear()
-        self._redo_stack.clear()
+        self._history.reset(image)
+        self._loading = False
+        if self._journal is not None:
+            self._journal.start(image, file_path, decoded=True)
 
-    def save_image(self, file_path=None):
+    def begin_load(self, file_path, stand_in):
+        """Show a reduced decode of file_path while the full image is decoded.
+        Edits can be made on the stand-in; finish_load replays them."""
+        self._file_path = file_path
+        self._current_image = stand_in
+        self._history.reset(stand_in)
+        self._loading = True
+        if self._journal is not None:
+            self._journal.start(stand_in, file_path, decoded=True)
+
+    @traced("model.replay_full_load")
+    def replay_full_load(self, image):
+        """Replay the edits made on the stand-in on the full-resolution decode
+        without changing the model, so the slow part of finish_load can run on
+        a worker thread. Pass the result to finish_load."""
+        return self._history.replay_on(image)
+
+    @traced("model.finish_load")
+    def finish_load(self, image, replayed=None):
+        """
+        Swap the full-resolution decode in for the stand-in. replayed is the
+        result of replay_full_load; if the history changed since it was made,
+        nothing is swapped and False is returned so the caller can replay again.
+        Without it the edits are replayed here.
+        """
+        if replayed is not None and not self._history.is_current(replayed):
+            return False
+        self._current_image = self._history.rebase(image, replayed)
+        self._loading = False
+        if self._journal is not None:
+            # Steps recorded on the stand-in replay the same way on the full image
+            self._journal.start(image, self._file_path, keep_steps=True, decoded=True)
+        return True
+
+    @traced("model.load_session")
+    def load_session(self, session_path):
+        """Open a session file. Its pixels are memory-mapped rather than decoded
+        and the image at the saved cursor is shown from its cached checkpoint."""
+        session = open_session(session_path)
+        self._restore(session.get_source_path(), session.get_base(), session.get_steps(),
+                      session.get_cursor(), session.get_checkpoints())
+
+    def save_session(self, session_path, progress=None):
+        """Write the base image, history and current image to a session file."""
+        return write_session(session_path, progress=progress, **self.get_session_state())
+
+    def get_session_state(self):
+        """Keyword arguments for session.write_session, safe to write on another
+        thread: steps are copied and images are never modified in place."""
         if self._current_image is None:
             raise ValueError("No image to save.")
-        
+        if self._loading:
+            raise ValueError("The image is still loading at full resolution.")
+        steps = [EditStep(step.operations, step.pixels, step.cost) for step in self._history.get_steps()]
+        cursor = self._history.get_cursor()
+        return {"base": self._history.get_base(), "steps": steps, "cursor": cursor,
+                "checkpoints": {cursor: self._current_image}, "source_path": self._file_path}
+
+    def recover(self, journal_path):
+        """Restore the history logged in a journal left by a crashed session."""
+        source_path, base, steps, cursor = read_journal(journal_path, self._processor)
+        self._restore(source_path, base, steps, cursor)
+
+    def _restore(self, file_path, base, steps, cursor, checkpoints=None):
+        self._current_image = self._history.load(base, steps, cursor, checkpoints)
+        self._file_path = file_path
+        self._loading = False
+        if self._journal is not None:
+            self._journal.start(base, file_path, steps=steps, cursor=cursor)
+
+    @traced("model.save_image")
+    def save_image(self, file_path=None, options=None):
+        """Encode and atomically write the current image. options are encoder
+        settings, see image_writer.DEFAULT_OPTIONS. Returns the save report."""
+        path, image = self.get_save_target(file_path)
+        report = write_image(image, path, options)
+        self.mark_saved(path)
+        return report
+
+    def get_save_target(self, file_path=None):
+        """(path, image) to save, for saving on another thread. Images are never
+        modified in place, so the returned array stays valid while it is written."""
+        if self._current_image is None:
+            raise ValueError("No image to save.")
+        if self._loading:
+            raise ValueError("The image is still loading at full resolution.")
         path = file_path if file_path else self._file_path
         if not path:
             raise ValueError("No file path specified.")
-        
-        # Save with appropriate format
-        cv2.imwrite(path, self._current_image)
-        
-        if file_path:
-            self._file_path = file_path
-
-    def apply_change(self, new_image):
-        """Push current image to undo stack and set new image.
-        Clears the redo stack to maintain correct history behaviour"""
-        if self._current_image is not None:
-            self._undo_stack.append(self._current_image.copy())
-            self._redo_stack.clear()
+        if self._journal is not None:
+            # The journal may only reference the file about to be overwritten
+            self._journal.source_replaced(path)
+        return path, self._current_image
+
+    def mark_saved(self, file_path):
+        self._file_path = file_path
+
+    @traced("model.apply_change")
+    def apply_change(self, new_image, operations=None, cost=0.0):
+        """Record the step from the current image to new image and set new image.
+        operations is the list of (name, params) ImageProcessor operations that
+        produced new_image; without it the change is stored as pixels.
+        Clears the redo history to maintain correct history behaviour"""
+        if self._current_image is None:
+            self._history.reset(new_image)
+            if self._journal is not None:
+                self._journal.start(new_image, self._file_path)
+        else:
+            self._history.record(self._current_image, new_image, operations, cost)
+            if self._journal is not None:
+                cursor = self._history.get_cursor()
+                self._journal.record(cursor + self._history.get_folded(), self._history.get_steps()[cursor - 1])
         self._current_image = new_image
 
+    @traced("model.undo")
     def undo(self):
-        if not self._undo_stack:
-            return
-        self._redo_stack.append(self._current_image.copy())
-        self._current_image = self._undo_stack.pop()
+        previous = self._history.undo()
+        if previous is not None:
+            self._current_image = previous
+            self._log_cursor()
 
+    @traced("model.redo")
     def redo(self):
-        if not self._redo_stack:
-            return
-        self._undo_stack.append(self._current_image.copy())
-        self._current_image = self._redo_stack.pop()
+        following = self._history.redo()
+        if following is not None:
+            self._current_image = following
+            self._log_cursor()
+
+    @traced("model.goto_step")
+    def goto_step(self, index):
+        """Show the image after `index` edit steps; later steps stay redoable."""
+        self._current_image = self._history.goto(index)
+        self._log_cursor()
+
+    def edit_step(self, index, operations):
+        """Change the operations of an earlier step and replay the steps after it."""
+        folded = self._history.get_folded()
+        self._current_image = self._history.edit_step(index, operations)
+        if self._journal is not None:
+            self._journal.edit(index + folded, operations)
+            self._log_cursor()
+
+    def remove_step(self, index):
+        folded = self._history.get_folded()
+        self._current_image = self._history.remove_step(index)
+        if self._journal is not None:
+            self._journal.remove(index + folded)
+            self._log_cursor()
+
+    def _log_cursor(self):
+        if self._journal is not None:
+            self._journal.cursor(self._history.get_cursor() + self._history.get_folded())
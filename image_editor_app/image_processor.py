@@ -1,97 +1,353 @@
 # image_processor.py
 
+import math
+
 import cv2
 import numpy as np
 
+from background_removal import BackgroundRemover, GrabCutSession
+from instrumentation import record_allocation, span
+from point_ops import PointOps
+
+# Operation names used in edit histories and pipelines, mapped to the method
+# that implements them. Parameters are passed to the method as keywords.
+OPERATIONS = {
+    "grayscale": "to_grayscale",
+    "blur": "blur",
+    "edges": "edges",
+    "brightness_contrast": "adjust_brightness_contrast",
+    "point_ops": "apply_point_ops",
+    "intensity_filters": "apply_intensity_filters",
+    "rotate": "rotate",
+    "flip": "flip",
+    "resize": "resize",
+    "remove_background": "remove_background",
+}
+
+
+# Interpolation for resize and arbitrary-angle rotate at each quality: "draft"
+# for previews while a slider moves, "linear" (the default, and what older
+# edit histories were recorded with) and "high" for final renders.
+QUALITIES = ("draft", "linear", "high")
+
+
+def operation_halo(name, params, exact=True):
+    """
+    Pixels of surrounding context an operation needs to give the same result on
+    a tile as on the whole image, or None if it needs the whole image.
+    Canny hysteresis can follow an edge chain across the whole image, so edges
+    (and intensity filters with an edge overlay) need the whole image; with
+    exact=False a practical margin is returned instead, for previews where a
+    rare difference at a tile border does not matter.
+    """
+    if name in ("grayscale", "brightness_contrast", "point_ops"):
+        return 0
+    if name == "blur":
+        return params.get("ksize", 5) // 2 + 1
+    if name == "edges":
+        return None if exact else 8
+    if name == "intensity_filters":
+        halo = int(params.get("blur", 0)) + 1 if params.get("blur", 0) > 0 else 0
+        if params.get("edge", 0) <= 0:
+            return halo
+        return None if exact else halo + 8
+    return None
+
+
 class ImageProcessor:
     """
     Performs OpenCV image processing operations on numpy arrays.
+
+    Every operation takes an optional dst array to write its result into, which
+    must have the result's shape and dtype and must not overlap image; the
+    result is then dst itself. With a BufferPool, intermediate arrays (the gray
+    plane of to_grayscale and edges, for example) are taken from the pool and
+    returned to it, so a loop that reuses its dst arrays allocates nothing.
     """
 
-    def to_grayscale(self, image):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    def __init__(self, pool=None):
+        self._background_remover = BackgroundRemover()
+        self._pool = pool
+
+    def apply(self, name, image, dst=None, **params):
+        """Run the operation registered under name in OPERATIONS."""
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {name}")
+        with span("processor." + name):
+            result = getattr(self, OPERATIONS[name])(image, dst=dst, **params)
+        if result is not image and result is not dst:
+            record_allocation("processor." + name, result.nbytes)
+        return result
 
-    def blur(self, image, ksize=5):
+    def apply_all(self, image, operations):
+        """Run a list of (name, params) operations in order."""
+        for name, params in operations:
+            image = self.apply(name, image, **params)
+        return image
+
+    def to_grayscale(self, image, dst=None):
+        _check_dst(dst, image.shape[:2] + (3,), image.dtype)
+        gray = self._scratch(image.shape[:2], image.dtype)
+        try:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+            return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=dst)
+        finally:
+            self._release(gray)
+
+    def blur(self, image, ksize=5, dst=None):
+        _check_dst(dst, image.shape, image.dtype)
         if ksize % 2 == 0:
             ksize += 1
-        return cv2.GaussianBlur(image, (ksize, ksize), 0)
+        return cv2.GaussianBlur(image, (ksize, ksize), 0, dst=dst)
 
-    def edges(self, image, low_threshold=100, high_threshold=200):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, low_threshold, high_threshold)
-        return cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
+    def edges(self, image, low_threshold=100, high_threshold=200, dst=None):
+        _check_dst(dst, image.shape[:2] + (3,), np.uint8)
+        gray = self._scratch(image.shape[:2], image.dtype)
+        edges = self._scratch(image.shape[:2], np.uint8)
+        try:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+            edges = cv2.Canny(gray, low_threshold, high_threshold, edges=edges)
+            return cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR, dst=dst)
+        finally:
+            self._release(gray)
+            self._release(edges)
 
-    def adjust_brightness_contrast(self, image, brightness=0, contrast=1.0):
+    def adjust_brightness_contrast(self, image, brightness=0, contrast=1.0, dst=None):
         """
         brightness: -100 to 100
         contrast: 0.5 to 2.0
+        Compiled into a lookup table, see PointOps. Alpha is preserved.
+        """
+        return PointOps().brightness_contrast(brightness, contrast).apply(image, dst=dst)
+
+    def apply_point_ops(self, image, brightness=0, contrast=1.0, gamma=1.0, levels=None, curve=None,
+                        dst=None):
+        """
+        Levels, gamma, a tone curve and brightness/contrast in a single lookup pass.
+        levels: (in_black, in_white, out_black, out_white) on the 8-bit scale
+        curve: list of (input, output) points on the 8-bit scale
+        """
+        ops = PointOps()
+        if levels is not None:
+            ops.levels(*levels)
+        ops.gamma(gamma)
+        if curve is not None:
+            ops.curve(curve)
+        ops.brightness_contrast(brightness, contrast)
+        return ops.apply(image, dst=dst)
+
+    def apply_intensity_filters(self, image, grayscale=0.0, blur=0, edge=0.0, scale=1.0, dst=None):
+        """
+        Grayscale mix, Gaussian blur and edge overlay used by the live sliders.
+        grayscale: 0.0 to 1.0, blur: 0 to 15, edge: 0 to 300
+        scale: size of `image` relative to the full-resolution image. Previews run
+        on a downscaled proxy, so the blur kernel and edge thresholds are scaled to
+        give the same look as the full-resolution render.
         """
-        img = image.astype("float32")
-        img = img * contrast + brightness
-        img = np.clip(img, 0, 255)
-        return img.astype("uint8")
+        if dst is None:
+            img = self.mix_grayscale(image, grayscale)
+            img = self.intensity_blur(img, blur, scale)
+            return self.overlay_edges(img, edge, blur, scale)
+        # The stages run in place on dst after the first one has filled it
+        img = self.mix_grayscale(image, grayscale, dst=dst)
+        img = self.intensity_blur(img, blur, scale, dst=dst)
+        return self.overlay_edges(img, edge, blur, scale, dst=dst)
+
+    # The three stages of apply_intensity_filters. Without dst each returns its
+    # input unchanged when its amount is zero, see IntensityPipeline; with dst
+    # the input is copied into dst. Unlike other operations these may be run
+    # in place, with dst being image.
+
+    def mix_grayscale(self, image, amount, dst=None):
+        """Blend towards grayscale (0=no effect, 1=full grayscale)."""
+        _check_dst(dst, image.shape, image.dtype)
+        if amount <= 0:
+            return _pass_through(image, dst)
+        gray = self._scratch(image.shape[:2], image.dtype)
+        gray_bgr = self._scratch(image.shape, image.dtype)
+        try:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+            gray_bgr = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR, dst=gray_bgr)
+            return cv2.addWeighted(image, 1.0 - amount, gray_bgr, amount, 0, dst=dst)
+        finally:
+            self._release(gray)
+            self._release(gray_bgr)
+
+    def intensity_blur(self, image, blur, scale=1.0, dst=None):
+        """Gaussian blur of slider strength `blur` (0=no blur, higher=more blur)."""
+        _check_dst(dst, image.shape, image.dtype)
+        if blur <= 0:
+            return _pass_through(image, dst)
+        ksize, sigma = _scaled_gaussian(max(1, int(blur) * 2 + 1), scale)
+        if ksize <= 1:
+            return _pass_through(image, dst)
+        return cv2.GaussianBlur(image, (ksize, ksize), sigma, dst=dst)
+
+    def overlay_edges(self, image, edge, blur=0, scale=1.0, dst=None):
+        """Overlay Canny edges with strength edge/300. blur is the strength of the
+        blur applied before, which the edge thresholds are scaled for."""
+        _check_dst(dst, image.shape, image.dtype)
+        if edge <= 0:
+            return _pass_through(image, dst)
+        blur_ksize = max(1, int(blur) * 2 + 1)
+        low, high = _scaled_thresholds(50, 150, _gaussian_sigma(blur_ksize) if blur > 0 else 0.0, scale)
+        gray = self._scratch(image.shape[:2], image.dtype)
+        edges = self._scratch(image.shape[:2], np.uint8)
+        edges_colored = self._scratch(image.shape, np.uint8)
+        try:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+            edges = cv2.Canny(gray, low, high, edges=edges)
+            edges_colored = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR, dst=edges_colored)
+            return cv2.addWeighted(image, 1.0, edges_colored, edge / 300.0, 0, dst=dst)
+        finally:
+            self._release(gray)
+            self._release(edges)
+            self._release(edges_colored)
 
-    def rotate(self, image, angle):
+    def rotate(self, image, angle, quality="linear", dst=None):
+        """
+        Rotate clockwise by angle degrees. Right angles move pixels exactly; other
+        angles are resampled at `quality` (see QUALITIES) onto a canvas that fits
+        the whole rotated image, with black (or transparent) corners.
+        """
+        angle = angle % 360
+        if angle == 0:
+            return _pass_through(image, dst)
+        h, w = image.shape[:2]
+        new_w, new_h = rotated_size(w, h, angle)
+        _check_dst(dst, (new_h, new_w) + image.shape[2:], image.dtype)
         if angle == 90:
-            return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+            return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE, dst=dst)
         elif angle == 180:
-            return cv2.rotate(image, cv2.ROTATE_180)
+            return cv2.rotate(image, cv2.ROTATE_180, dst=dst)
         elif angle == 270:
-            return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-        else:
-            return image
+            return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE, dst=dst)
+        # OpenCV angles are counter-clockwise; shift the centre to the new canvas
+        matrix = cv2.getRotationMatrix2D(((w - 1) / 2.0, (h - 1) / 2.0), -angle, 1.0)
+        matrix[0, 2] += (new_w - w) / 2.0
+        matrix[1, 2] += (new_h - h) / 2.0
+        return cv2.warpAffine(image, matrix, (new_w, new_h), dst=dst,
+                              flags=_interpolation(quality, shrinking=False),
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=0)
 
-    def flip(self, image, mode="horizontal"):
+    def flip(self, image, mode="horizontal", dst=None):
+        _check_dst(dst, image.shape, image.dtype)
         if mode == "horizontal":
-            return cv2.flip(image, 1)
+            return cv2.flip(image, 1, dst=dst)
         elif mode == "vertical":
-            return cv2.flip(image, 0)
+            return cv2.flip(image, 0, dst=dst)
         else:
-            return image
+            return _pass_through(image, dst)
 
-    def resize(self, image, scale=1.0):
+    def resize(self, image, scale=1.0, quality="linear", dst=None):
+        """Scale both sides by `scale`, resampling at `quality` (see QUALITIES)."""
         if scale <= 0:
-            return image
+            return _pass_through(image, dst)
         h, w = image.shape[:2]
         new_w = int(w * scale)
         new_h = int(h * scale)
-        return cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        _check_dst(dst, (new_h, new_w) + image.shape[2:], image.dtype)
+        return cv2.resize(image, (new_w, new_h), dst=dst, interpolation=_interpolation(quality, scale < 1.0))
 
-    def remove_background(self, image):
+    def remove_background(self, image, mode="multiscale", strokes=None, dst=None):
         """
         Remove background using GrabCut algorithm.
-        Assumes the foreground s located near the center of the image and returns a 
+        Assumes the foreground is located near the center of the image and returns a
         BGRA image with an alpha channel for transparency.
+        mode: "multiscale" segments a downscaled copy and refines the boundary at
+        full resolution; "single" runs GrabCut on the full image. Masks are cached
+        by image content, see BackgroundRemover.
+        strokes: brush corrections as recorded by GrabCutSession.get_strokes, which
+        are replayed on top of the automatic cut.
         """
-        # Create a copy to work with
-        img = image.copy()
-        
-        # Create mask for GrabCut
-        mask = np.zeros(img.shape[:2], np.uint8)
-        
-        # Create background and foreground models (required by GrabCut)
-        bgd_model = np.zeros((1, 65), np.float64)
-        fgd_model = np.zeros((1, 65), np.float64)
-        
-        # Define rectangle around the foreground (assume center region)
-        h, w = img.shape[:2]
-        rect = (10, 10, w - 20, h - 20)
-        
-        # Apply GrabCut algorithm
-        cv2.grabCut(img, mask, rect, bgd_model, fgd_model, 5, cv2.GC_INIT_WITH_RECT)
-        
-        # Modify mask: set definite background and probable background to 0
-        # definite foreground and probable foreground to 1
-        mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype('uint8')
-        
-        # Create alpha channel from mask
-        alpha = mask2 * 255
-        
-        # Convert BGR to BGRA
-        bgra = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
-        
-        # Apply alpha channel
-        bgra[:, :, 3] = alpha
-        
-        return bgra
\ No newline at end of file
+        _check_dst(dst, image.shape[:2] + (4,), image.dtype)
+        if not strokes:
+            return self._background_remover.remove(image, mode, dst=dst)
+        session = self.grabcut_session(image, mode)
+        for batch in strokes:
+            for points, radius, foreground in batch:
+                session.add_stroke(points, radius, foreground)
+            session.refine()
+        return session.cutout(dst)
+
+    def grabcut_session(self, image, mode="multiscale"):
+        """Start an interactive cut of image that brush strokes can correct, see GrabCutSession."""
+        return GrabCutSession(image, self._background_remover, mode)
+
+    def get_background_stats(self):
+        """Timings of the last background removal, see BackgroundRemover.get_last_stats."""
+        return self._background_remover.get_last_stats()
+
+    # Internal helpers
+    def _scratch(self, shape, dtype):
+        # None lets OpenCV allocate the intermediate itself
+        if self._pool is None:
+            return None
+        return self._pool.acquire(shape, dtype)
+
+    def _release(self, array):
+        if self._pool is not None:
+            self._pool.release(array)
+
+
+def rotated_size(w, h, angle):
+    """(width, height) of the canvas that holds a w x h image rotated by angle degrees."""
+    angle = angle % 360
+    if angle in (0, 180):
+        return w, h
+    if angle in (90, 270):
+        return h, w
+    cos, sin = abs(math.cos(math.radians(angle))), abs(math.sin(math.radians(angle)))
+    return int(round(w * cos + h * sin)), int(round(w * sin + h * cos))
+
+
+def _interpolation(quality, shrinking):
+    """Draft previews take the nearest pixel; high quality averages areas when
+    shrinking and uses Lanczos when enlarging or rotating."""
+    if quality == "draft":
+        return cv2.INTER_NEAREST
+    if quality == "linear":
+        return cv2.INTER_LINEAR
+    if quality == "high":
+        return cv2.INTER_AREA if shrinking else cv2.INTER_LANCZOS4
+    raise ValueError(f"Unknown quality: {quality} (choose from {', '.join(QUALITIES)})")
+
+
+def _check_dst(dst, shape, dtype):
+    """OpenCV silently allocates a new array when dst does not fit, which would
+    hide the result from the caller, so a mismatch is an error."""
+    if dst is not None and (dst.shape != tuple(shape) or dst.dtype != dtype):
+        raise ValueError(f"dst is {dst.shape} {dst.dtype}, the result is {tuple(shape)} {np.dtype(dtype)}.")
+
+
+def _pass_through(image, dst):
+    if dst is None or dst is image:
+        return image
+    _check_dst(dst, image.shape, image.dtype)
+    np.copyto(dst, image)
+    return dst
+
+
+def _gaussian_sigma(ksize):
+    # Sigma OpenCV derives for GaussianBlur when sigma is passed as 0
+    return 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+
+
+def _scaled_gaussian(ksize, scale):
+    """Kernel size and sigma giving the same blur on an image resized by `scale`."""
+    if scale >= 1.0:
+        return ksize, 0
+    radius = int(round((ksize - 1) / 2 * scale))
+    return 2 * radius + 1, _gaussian_sigma(ksize) * scale
+
+
+def _scaled_thresholds(low, high, sigma, scale):
+    """
+    Canny thresholds compare gradient magnitudes per pixel. Downscaling makes
+    edges narrower in pixels and therefore steeper, so thresholds grow with the
+    ratio of edge widths (a 1px base edge plus any blur, added in quadrature).
+    """
+    if scale >= 1.0:
+        return low, high
+    ratio = ((1.0 + sigma ** 2) / (1.0 + (sigma * scale) ** 2)) ** 0.5
+    return low * ratio, high * ratio
@@ -0,0 +1,244 @@
+# image_writer.py
+#
+# Encoding and atomic saving. To see the speed/size tradeoff of the encoder
+# settings on one image:
+#
+#   python image_writer.py photo.png --format png
+
+import argparse
+import os
+import queue
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+
+# The defaults OpenCV documents for cv2.imwrite, which saving used before
+# these options existed
+DEFAULT_OPTIONS = {
+    "png_compression": 1,       # 0 (fastest, largest) to 9 (slowest, smallest)
+    "png_strategy": "rle",      # default, filtered, huffman, rle or fixed
+    "jpeg_quality": 95,         # 0 to 100
+    "jpeg_progressive": False,
+    "jpeg_optimize": False,     # optimised Huffman tables: smaller, a little slower
+    "webp_quality": 101,        # 1 to 100; above 100 is lossless
+}
+
+_PNG_STRATEGIES = {
+    "default": cv2.IMWRITE_PNG_STRATEGY_DEFAULT,
+    "filtered": cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+    "huffman": cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY,
+    "rle": cv2.IMWRITE_PNG_STRATEGY_RLE,
+    "fixed": cv2.IMWRITE_PNG_STRATEGY_FIXED,
+}
+
+_WRITE_CHUNK = 4 * 1024 * 1024
+
+
+def _read_umask():
+    # os.umask can only be read by setting it, which races with other threads
+    # creating files, so it is read once here while the module loads
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+
+_UMASK = _read_umask()
+
+
+def encoder_params(ext, options=None):
+    """cv2.imencode parameter list for a file extension such as ".png"."""
+    opts = dict(DEFAULT_OPTIONS, **(options or {}))
+    ext = ext.lower()
+    if ext == ".png":
+        if opts["png_strategy"] not in _PNG_STRATEGIES:
+            raise ValueError(f"Unknown PNG strategy: {opts['png_strategy']}")
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(opts["png_compression"]),
+                cv2.IMWRITE_PNG_STRATEGY, _PNG_STRATEGIES[opts["png_strategy"]]]
+    if ext in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(opts["jpeg_quality"]),
+                cv2.IMWRITE_JPEG_PROGRESSIVE, int(bool(opts["jpeg_progressive"])),
+                cv2.IMWRITE_JPEG_OPTIMIZE, int(bool(opts["jpeg_optimize"]))]
+    if ext == ".webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, int(opts["webp_quality"])]
+    return []
+
+
+def encode_image(image, ext, options=None):
+    """Encode image in the format of ext and return the bytes."""
+    ok, encoded = cv2.imencode(ext, image, encoder_params(ext, options))
+    if not ok:
+        raise ValueError(f"Could not encode image as {ext}.")
+    return encoded
+
+
+def write_atomic(path, data, progress=None):
+    """
+    Write data to a temporary file next to path and rename it into place, so
+    path holds either the old file or the complete new one, never a partial
+    write. data is a bytes-like object or a list of them, written one after
+    another. progress(fraction) is called as chunks are written. The new file
+    keeps the permissions of the one it replaces, or gets the usual ones for a
+    new file (0666 less the umask).
+    """
+    parts = [memoryview(part).cast("B") for part in (data if isinstance(data, (list, tuple)) else [data])]
+    total = sum(len(part) for part in parts) or 1
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            written = 0
+            for view in parts:
+                for start in range(0, len(view), _WRITE_CHUNK):
+                    chunk = view[start:start + _WRITE_CHUNK]
+                    f.write(chunk)
+                    written += len(chunk)
+                    if progress is not None:
+                        progress(written / total)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file readable by its owner only
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def save_image(image, path, options=None, progress=None):
+    """
+    Encode and atomically write image to path. progress(stage, fraction) is
+    called with "encoding" and then "writing". Returns the encode and write
+    times in ms and the output size in bytes.
+    """
+    ext = os.path.splitext(path)[1] or ".png"
+    if progress is not None:
+        progress("encoding", 0.0)
+    start = time.perf_counter()
+    encoded = encode_image(image, ext, options)
+    encode_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    write_atomic(path, encoded, None if progress is None else lambda f: progress("writing", f))
+    write_ms = (time.perf_counter() - start) * 1000
+    return {"path": path, "bytes": int(encoded.nbytes), "encode_ms": encode_ms, "write_ms": write_ms}
+
+
+class BackgroundSaver:
+    """
+    Runs save_image on a background thread so large encodes do not freeze the
+    Tk main loop. Progress and completion callbacks run on the Tk thread.
+    Saves are done one at a time in the order they were started.
+    """
+
+    def __init__(self, root, poll_ms=30):
+        self._root = root
+        self._poll_ms = poll_ms
+        self._jobs = queue.Queue()
+        self._events = queue.Queue()
+        self._callbacks = {}
+        self._next_id = 0
+        self._worker = threading.Thread(target=self._run, name="image-saver", daemon=True)
+        self._worker.start()
+
+    # Encapsulated getters
+    def is_busy(self):
+        return bool(self._callbacks)
+
+    # Core methods
+    def save(self, image, path, options=None, on_done=None, on_error=None, on_progress=None):
+        """Queue a save. on_done(report), on_error(exception) and
+        on_progress(stage, fraction) are called on the Tk thread."""
+        self.submit(lambda progress: save_image(image, path, options, progress),
+                    on_done, on_error, on_progress)
+
+    def submit(self, write, on_done=None, on_error=None, on_progress=None):
+        """Queue any write, such as a session file. write(progress) runs on the
+        saver thread and returns the report passed to on_done."""
+        self._next_id += 1
+        first = not self._callbacks
+        self._callbacks[self._next_id] = (on_done, on_error, on_progress)
+        self._jobs.put((self._next_id, write))
+        if first:
+            self._root.after(self._poll_ms, self._poll)
+
+    def shutdown(self, wait=True):
+        """Stop the worker, by default after the queued saves are written."""
+        self._jobs.put(None)
+        if wait:
+            self._worker.join()
+
+    # Internal helpers
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            job_id, write = job
+            try:
+                report = write(lambda stage, f: self._events.put((job_id, "progress", (stage, f))))
+                self._events.put((job_id, "done", report))
+            except Exception as e:
+                self._events.put((job_id, "error", e))
+
+    def _poll(self):
+        while True:
+            try:
+                job_id, kind, payload = self._events.get_nowait()
+            except queue.Empty:
+                break
+            on_done, on_error, on_progress = self._callbacks.get(job_id, (None, None, None))
+            if kind == "progress":
+                if on_progress is not None:
+                    on_progress(*payload)
+                continue
+            self._callbacks.pop(job_id, None)
+            callback = on_done if kind == "done" else on_error
+            if callback is not None:
+                callback(payload)
+        if self._callbacks:
+            self._root.after(self._poll_ms, self._poll)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare encoder settings by time and size.")
+    parser.add_argument("image", help="image to encode")
+    parser.add_argument("--format", default="png", help="png, jpg or webp")
+    args = parser.parse_args(argv)
+
+    image = cv2.imread(args.image, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        parser.error("Could not load image.")
+    ext = "." + args.format.lower().lstrip(".")
+    if ext == ".png":
+        settings = [{"png_compression": level} for level in (0, 1, 3, 6, 9)]
+        settings += [{"png_compression": 6, "png_strategy": s} for s in ("filtered", "rle")]
+    elif ext in (".jpg", ".jpeg"):
+        settings = [{"jpeg_quality": q} for q in (75, 85, 95)]
+        settings += [{"jpeg_quality": 90, "jpeg_optimize": True},
+                     {"jpeg_quality": 90, "jpeg_progressive": True, "jpeg_optimize": True}]
+    elif ext == ".webp":
+        settings = [{"webp_quality": q} for q in (75, 90, 100, 101)]
+    else:
+        parser.error("Format must be png, jpg or webp.")
+
+    print(f"{'settings':48} {'encode ms':>10} {'size MB':>9}")
+    for options in settings:
+        start = time.perf_counter()
+        encoded = encode_image(image, ext, options)
+        elapsed = (time.perf_counter() - start) * 1000
+        label = ", ".join(f"{k}={v}" for k, v in options.items())
+        print(f"{label:48} {elapsed:10.1f} {encoded.nbytes / (1024 * 1024):9.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
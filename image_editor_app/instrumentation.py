@@ -0,0 +1,183 @@
+# instrumentation.py
+#
+# Lightweight timing for the editor's hot paths. Stages are timed with span()
+# or @traced, allocations are counted with record_allocation(), and a finished
+# preview is marked with record_frame(), which keeps interactive frames apart
+# from the final renders that follow when an input settles. Spans can be saved as a Chrome trace
+# (open it in chrome://tracing or https://ui.perfetto.dev).
+#
+# Set IMAGE_EDITOR_TRACE=0 to turn everything off: span() then returns a shared
+# no-op context manager and @traced returns the function unchanged.
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+ENABLED = os.environ.get("IMAGE_EDITOR_TRACE", "1").lower() not in ("0", "false", "off", "no")
+
+_MAX_EVENTS = 100000
+
+_events = deque(maxlen=_MAX_EVENTS)   # (name, category, start, duration, thread id, args)
+_stages = {}                          # name -> [count, total s, max s, alloc count, alloc bytes]
+FRAME_KINDS = ("interactive", "final")
+_frames = {kind: deque(maxlen=120) for kind in FRAME_KINDS}   # recent frame times in seconds
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+
+class _Span:
+    __slots__ = ("name", "category", "args", "start")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, self.category, self.start, time.perf_counter() - self.start, self.args)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, category="editor", **args):
+    """Context manager timing the enclosed block as stage `name`."""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name, category, args)
+
+
+def traced(name, category="editor"):
+    """Decorator timing every call of a function as stage `name`. Returned
+    numpy arrays are counted as allocations of that stage."""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            _record(name, category, start, time.perf_counter() - start, None)
+            nbytes = getattr(result, "nbytes", None)
+            if nbytes is not None:
+                record_allocation(name, nbytes)
+            return result
+
+        return wrapper
+    return decorate
+
+
+def record_allocation(name, nbytes):
+    """Count one buffer of nbytes allocated by stage `name`."""
+    if not ENABLED:
+        return
+    with _lock:
+        stage = _stages.setdefault(name, [0, 0.0, 0.0, 0, 0])
+        stage[3] += 1
+        stage[4] += int(nbytes)
+
+
+def record_frame(started, kind="interactive"):
+    """Mark a preview frame as shown; started is the perf_counter() value when
+    the input that caused it arrived. kind is "interactive" for frames shown
+    while an input moves and "final" for the high-quality render once it settles."""
+    if not ENABLED:
+        return
+    duration = time.perf_counter() - started
+    _record("frame" if kind == "interactive" else "frame." + kind, "frame", started, duration, None)
+    _frames[kind].append(duration)
+
+
+def get_frame_stats(kind="interactive"):
+    """Last and mean frame time in milliseconds over recent frames of a kind, or None."""
+    frames = list(_frames[kind])
+    if not frames:
+        return None
+    return {"last_ms": frames[-1] * 1000, "mean_ms": sum(frames) / len(frames) * 1000,
+            "max_ms": max(frames) * 1000, "frames": len(frames)}
+
+
+def get_stats():
+    """Per-stage call count, total/mean/max milliseconds and allocations."""
+    with _lock:
+        items = [(name, list(stage)) for name, stage in _stages.items()]
+    stats = {}
+    for name, (count, total, longest, allocs, alloc_bytes) in items:
+        stats[name] = {
+            "count": count,
+            "total_ms": total * 1000,
+            "mean_ms": total / count * 1000 if count else 0.0,
+            "max_ms": longest * 1000,
+            "allocations": allocs,
+            "allocated_bytes": alloc_bytes,
+        }
+    return stats
+
+
+def format_stats(limit=None):
+    """Stage table sorted by total time, for printing or a dialog."""
+    stats = sorted(get_stats().items(), key=lambda item: item[1]["total_ms"], reverse=True)
+    lines = [f"{'stage':32} {'calls':>6} {'total ms':>10} {'mean ms':>9} {'max ms':>9} {'alloc MB':>9}"]
+    for name, s in stats[:limit]:
+        lines.append(f"{name:32} {s['count']:6d} {s['total_ms']:10.1f} {s['mean_ms']:9.2f} "
+                     f"{s['max_ms']:9.2f} {s['allocated_bytes'] / (1024 * 1024):9.1f}")
+    return "\n".join(lines)
+
+
+def export_chrome_trace(path):
+    """Write recorded spans in Chrome's trace event format. Returns the event count."""
+    pid = os.getpid()
+    events = []
+    for name, category, start, duration, tid, args in list(_events):
+        event = {"name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+                 "ts": (start - _origin) * 1e6, "dur": duration * 1e6}
+        if args:
+            event["args"] = args
+        events.append(event)
+    for tid, thread_name in _thread_names().items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                       "args": {"name": thread_name}})
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
+
+
+def reset():
+    with _lock:
+        _events.clear()
+        _stages.clear()
+        for frames in _frames.values():
+            frames.clear()
+
+
+def _record(name, category, start, duration, args):
+    _events.append((name, category, start, duration, threading.get_ident(), args))
+    with _lock:
+        stage = _stages.setdefault(name, [0, 0.0, 0.0, 0, 0])
+        stage[0] += 1
+        stage[1] += duration
+        if duration > stage[2]:
+            stage[2] = duration
+
+
+def _thread_names():
+    return {thread.ident: thread.name for thread in threading.enumerate() if thread.ident is not None}
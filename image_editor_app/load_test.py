@@ -0,0 +1,97 @@
+# load_test.py
+#
+# Load test for server.py: several client threads send requests as fast as the
+# server answers them, then client-side and server-side latency are reported.
+#
+#   python load_test.py --clients 8 --requests 50 --size 1 --pipeline "blur:ksize=9"
+#   python load_test.py --spawn --workers 2 --shm     # start a server in-process first
+
+import argparse
+import sys
+import threading
+import time
+
+from batch import parse_pipeline
+from benchmark import synthetic_image
+from client import ProcessingClient, ServerError
+from server import DEFAULT_PORT, ProcessingServer, percentiles
+
+
+def run_load(host, port, clients, requests, image, operations, shared_memory=False):
+    """Send clients x requests requests; returns per-request latencies (seconds,
+    sorted), the error count and the wall time."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker():
+        with ProcessingClient(host, port, shared_memory=shared_memory) as client:
+            for _ in range(requests):
+                start = time.perf_counter()
+                try:
+                    client.apply(image, operations)
+                except (ServerError, OSError):
+                    with lock:
+                        errors[0] += 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors[0], time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the processing server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client threads")
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    parser.add_argument("--size", type=float, default=1.0, help="image size in megapixels")
+    parser.add_argument("--pipeline", default="blur:ksize=9", help="pipeline spec, as for batch.py")
+    parser.add_argument("--shm", action="store_true", help="pass pixels through shared memory")
+    parser.add_argument("--spawn", action="store_true", help="start a server in this process first")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes for --spawn")
+    parser.add_argument("--batch", type=int, default=8, help="batch size for --spawn")
+    args = parser.parse_args(argv)
+
+    operations = parse_pipeline(args.pipeline)
+    image = synthetic_image(args.size)
+    server = None
+    port = args.port
+    if args.spawn:
+        server = ProcessingServer(args.host, 0, args.workers, args.batch).start()
+        port = server.get_address()[1]
+    try:
+        # One request first so connection set-up is not part of the numbers
+        with ProcessingClient(args.host, port) as client:
+            client.apply(image, operations)
+        latencies, errors, wall = run_load(args.host, port, args.clients, args.requests,
+                                           image, operations, args.shm)
+        with ProcessingClient(args.host, port) as client:
+            stats = client.stats()
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    client_ms = percentiles(latencies)
+    print(f"{len(latencies)} requests ({errors} failed) in {wall:.2f}s: "
+          f"{len(latencies) / wall:.1f} req/s, {len(latencies) * args.size / wall:.1f} MP/s")
+    print(f"client latency ms  p50 {client_ms['p50']:.1f}  p95 {client_ms['p95']:.1f}  "
+          f"p99 {client_ms['p99']:.1f}  max {client_ms['max']:.1f}")
+    server_ms, process_ms = stats["latency_ms"], stats["process_ms"]
+    print(f"server latency ms  p50 {server_ms['p50']:.1f}  p95 {server_ms['p95']:.1f}  "
+          f"p99 {server_ms['p99']:.1f}  (processing p50 {process_ms['p50']:.1f})")
+    print(f"server: {stats['workers']} workers, {stats['batches']} batches, "
+          f"mean batch {stats['mean_batch_size']:.1f}, queue depth now {stats['queue_depth']}, "
+          f"rejected {stats['rejected']}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,49 @@
 # main.py
 
-from gui import ImageEditorApp
+import argparse
+import json
+import sys
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # Headless commands never import the GUI (and so never load tkinter)
+    if argv and argv[0] == "batch":
+        from batch import main as batch_main
+        return batch_main(argv[1:])
+    if argv and argv[0] == "server":
+        from server import main as server_main
+        return server_main(argv[1:])
+    if argv and argv[0] == "stream":
+        from stream import main as stream_main
+        return stream_main(argv[1:])
+
+    # Only the standard library is loaded so far; the clock starts here
+    from startup import StartupProfile
+    profile = StartupProfile()
+    parser = argparse.ArgumentParser(description="HIT137 Image Editor")
+    parser.add_argument("image", nargs="?", help="image to open at startup")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print import times, time to window and time to first image, then exit")
+    parser.add_argument("--json", default=None, help="with --profile-startup, also write the timings here (- for stdout)")
+    args = parser.parse_args(argv)
+
+    with profile.phase("tkinter and gui"):
+        from gui import ImageEditorApp
+    App = ImageEditorApp(startup=profile, open_path=args.image, exit_when_started=args.profile_startup)
+    App.mainloop()
+    if args.profile_startup:
+        App.shutdown()
+        report = {"python": sys.version.split()[0], "results": profile.to_results()}
+        # With --json - the report goes to stderr so stdout is only the JSON
+        print(profile.format(), file=sys.stderr if args.json == "-" else sys.stdout)
+        if args.json == "-":
+            print(json.dumps(report, indent=2))
+        elif args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    return 0
+
 
 if __name__ == "__main__":
-    App = ImageEditorApp()
-    App.mainloop()
\ No newline at end of file
+    sys.exit(main())
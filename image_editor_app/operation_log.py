@@ -0,0 +1,265 @@
+# operation_log.py
+
+from history import apply_forward, decode_full, encode_delta, encode_full
+
+
+class EditStep:
+    """
+    One undoable edit. Either a list of (name, params) ImageProcessor operations,
+    which are replayed on demand, or a compressed pixel change for edits that
+    cannot be described as operations.
+    """
+
+    def __init__(self, operations=None, pixels=None, cost=0.0):
+        self.operations = [(name, dict(params)) for name, params in (operations or [])]
+        self.pixels = pixels
+        self.cost = cost    # seconds the edit took to compute
+
+    @property
+    def nbytes(self):
+        return self.pixels.nbytes if self.pixels is not None else 0
+
+    def describe(self):
+        if self.pixels is not None:
+            return "pixel edit"
+        parts = []
+        for name, params in self.operations:
+            args = ", ".join(f"{k}={v:g}" if isinstance(v, float) else f"{k}={v}"
+                             for k, v in params.items())
+            parts.append(f"{name}({args})" if args else name)
+        return " + ".join(parts)
+
+
+class OperationLog:
+    """
+    Non-destructive edit history: the base image, an ordered list of EditSteps and
+    a cursor. Images for other steps are rebuilt from the nearest cached
+    checkpoint, so memory grows with the number of edits rather than with the
+    number of pixels. Checkpoints are kept every `checkpoint_interval` steps and
+    after expensive steps, and are evicted first when the byte budget is exceeded.
+    """
+
+    def __init__(self, processor, budget_bytes=512 * 1024 * 1024,
+                 checkpoint_interval=4, expensive_step=0.25, level=1):
+        self._processor = processor
+        self._budget = budget_bytes
+        self._interval = checkpoint_interval
+        self._expensive = expensive_step
+        self._level = level
+        self._steps = []
+        self._cursor = 0
+        self._checkpoints = {}  # step index -> image after that many steps
+        self._folded = 0        # steps merged into the base image by _evict
+
+    # Encapsulated getters
+    def get_cursor(self):
+        return self._cursor
+
+    def get_steps(self):
+        return list(self._steps)
+
+    def get_base(self):
+        return self._checkpoints.get(0)
+
+    def get_checkpoints(self):
+        """Cached images by step index, including the base (0) and the cursor."""
+        return dict(self._checkpoints)
+
+    def get_folded(self):
+        """Number of oldest steps merged into the base image to stay within the
+        budget since the last reset. Step i here is step i + folded of the
+        history as it was recorded."""
+        return self._folded
+
+    def can_undo(self):
+        return self._cursor > 0
+
+    def can_redo(self):
+        return self._cursor < len(self._steps)
+
+    def get_usage(self):
+        pixel_bytes = sum(step.nbytes for step in self._steps)
+        checkpoint_bytes = self._checkpoint_bytes()
+        return {
+            "bytes": pixel_bytes + checkpoint_bytes,
+            "budget": self._budget,
+            "pixel_bytes": pixel_bytes,
+            "checkpoint_bytes": checkpoint_bytes,
+            "checkpoints": len([k for k in self._checkpoints if k not in (0, self._cursor)]),
+            "undo_steps": self._cursor,
+            "redo_steps": len(self._steps) - self._cursor,
+        }
+
+    # Core methods
+    def reset(self, base_image):
+        self._steps = []
+        self._cursor = 0
+        self._checkpoints = {0: base_image}
+        self._folded = 0
+
+    def load(self, base_image, steps, cursor, checkpoints=None):
+        """Restore a saved history and return the image at the cursor. Cached
+        checkpoints (step index -> image) avoid replaying up to them."""
+        if not 0 <= cursor <= len(steps):
+            raise IndexError("No such history step.")
+        self.reset(base_image)
+        self._steps = list(steps)
+        for index, image in (checkpoints or {}).items():
+            if 0 < index <= len(steps):
+                self._checkpoints[index] = image
+        return self.goto(cursor)
+
+    def set_budget(self, budget_bytes):
+        self._budget = budget_bytes
+        self._evict()
+
+    def record(self, before, after, operations=None, cost=0.0):
+        """Append the edit before -> after at the cursor, dropping any redo steps.
+        With operations the step is replayable; without them the pixel change is
+        stored as a compressed delta."""
+        self._truncate(self._cursor)
+        if operations:
+            step = EditStep(operations=operations, cost=cost)
+        else:
+            step = EditStep(pixels=encode_delta(before, after, self._level), cost=cost)
+        self._steps.append(step)
+        self._cursor += 1
+        self._checkpoints[self._cursor] = after
+        self._prune()
+
+    def render(self, index):
+        """Return the image after `index` steps, replaying from the nearest checkpoint."""
+        start = max(k for k in self._checkpoints if k <= index)
+        image = self._checkpoints[start]
+        for i in range(start, index):
+            image = self._run_step(self._steps[i], image)
+            if self._is_checkpoint(i + 1):
+                self._checkpoints[i + 1] = image
+        return image
+
+    def goto(self, index):
+        if not 0 <= index <= len(self._steps):
+            raise IndexError("No such history step.")
+        image = self.render(index)
+        self._cursor = index
+        self._checkpoints[index] = image
+        self._prune()
+        return image
+
+    def undo(self):
+        return self.goto(self._cursor - 1) if self.can_undo() else None
+
+    def redo(self):
+        return self.goto(self._cursor + 1) if self.can_redo() else None
+
+    def replay_on(self, base_image):
+        """
+        (steps, cursor, image): the image at the cursor rebuilt on a different
+        base image, without changing the log, so it can run on a worker thread
+        while the log is used elsewhere. Pass the result to rebase.
+        """
+        steps, cursor = list(self._steps), self._cursor
+        if any(step.pixels is not None for step in steps):
+            raise ValueError("Pixel edits cannot be replayed on a new base image.")
+        image = base_image
+        for step in steps[:cursor]:
+            image = self._run_step(step, image)
+        return steps, cursor, image
+
+    def is_current(self, replayed):
+        """Whether a replay_on result still matches the steps and cursor."""
+        return replayed[0] == self._steps and replayed[1] == self._cursor
+
+    def rebase(self, base_image, replayed=None):
+        """Replace the base image and return the image at the cursor rebuilt on
+        top of it, taken from replayed (see replay_on) when that is current.
+        Only operation steps can be replayed on a different base."""
+        if replayed is None or not self.is_current(replayed):
+            replayed = self.replay_on(base_image)
+        self._checkpoints = {0: base_image, self._cursor: replayed[2]}
+        self._prune()
+        return replayed[2]
+
+    def edit_step(self, index, operations):
+        """Replace the operations of step `index` (1-based) and rebuild the current
+        image. Later steps are replayed on top of the new result."""
+        self._check_step(index)
+        if self._steps[index - 1].pixels is not None:
+            raise ValueError("Pixel edits have no parameters to change.")
+        self._freeze_pixels_after(index)
+        self._steps[index - 1] = EditStep(operations=operations, cost=self._steps[index - 1].cost)
+        self._drop_checkpoints_from(index)
+        return self.goto(self._cursor)
+
+    def remove_step(self, index):
+        """Delete step `index` (1-based) and rebuild the current image."""
+        self._check_step(index)
+        self._freeze_pixels_after(index)
+        del self._steps[index - 1]
+        self._drop_checkpoints_from(index)
+        if self._cursor >= index:
+            self._cursor -= 1
+        return self.goto(self._cursor)
+
+    # Internal helpers
+    def _run_step(self, step, image):
+        if step.pixels is None:
+            return self._processor.apply_all(image, step.operations)
+        if step.pixels.kind == "full":
+            return decode_full(step.pixels)
+        return apply_forward(step.pixels, image)
+
+    def _check_step(self, index):
+        if not 1 <= index <= len(self._steps):
+            raise IndexError("No such history step.")
+
+    def _freeze_pixels_after(self, index):
+        # Pixel deltas are relative to the image before them, which is about to
+        # change. Store their old result instead so they still apply afterwards.
+        for i in range(index, len(self._steps)):
+            step = self._steps[i]
+            if step.pixels is not None and step.pixels.kind == "delta":
+                step.pixels = encode_full(self.render(i + 1), self._level)
+
+    def _truncate(self, index):
+        del self._steps[index:]
+        self._drop_checkpoints_from(index + 1)
+
+    def _drop_checkpoints_from(self, index):
+        for k in [k for k in self._checkpoints if k >= index]:
+            del self._checkpoints[k]
+
+    def _is_checkpoint(self, index):
+        # Sparse checkpoints: every few steps, and after edits too slow to replay
+        return index % self._interval == 0 or self._steps[index - 1].cost >= self._expensive
+
+    def _checkpoint_bytes(self):
+        # The base and the current image are held by the model anyway
+        return sum(image.nbytes for k, image in self._checkpoints.items()
+                   if k not in (0, self._cursor))
+
+    def _over_budget(self):
+        return self.get_usage()["bytes"] > self._budget
+
+    def _prune(self):
+        for k in list(self._checkpoints):
+            if k not in (0, self._cursor) and not self._is_checkpoint(k):
+                del self._checkpoints[k]
+        self._evict()
+
+    def _evict(self):
+        # Cached images are cheapest to lose, furthest from the cursor first
+        candidates = sorted((k for k in self._checkpoints if k not in (0, self._cursor)),
+                            key=lambda k: abs(k - self._cursor), reverse=True)
+        for k in candidates:
+            if not self._over_budget():
+                return
+            del self._checkpoints[k]
+        # Still over budget: fold the oldest steps into the base image
+        while self._over_budget() and self._cursor > 0:
+            base = self.render(1)
+            del self._steps[0]
+            self._checkpoints = {k - 1: image for k, image in self._checkpoints.items() if k > 1}
+            self._checkpoints[0] = base
+            self._cursor -= 1
+            self._folded += 1
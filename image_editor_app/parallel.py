@@ -0,0 +1,292 @@
+# parallel.py
+#
+# Strip-parallel execution of ImageProcessor operations on large images. The
+# image is cut into horizontal strips, each read with the operation's halo (see
+# operation_halo), and the strips run on a thread pool; OpenCV and numpy release
+# the GIL inside their kernels, so the strips really run at the same time.
+# Edges are deliberately never split (Canny's hysteresis is not local) and use
+# OpenCV's own threads instead. Measure how blur, edges and brightness/contrast
+# scale with the thread count:
+#
+#   python parallel.py --size 50 --threads 1,2,4,8 --json scaling.json
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from image_processor import ImageProcessor, operation_halo
+
+# Caps the threads used for image work, ours and OpenCV's together
+THREADS_ENV = "IMAGE_EDITOR_THREADS"
+# Smaller images run whole; splitting them costs more than it saves
+MIN_PIXELS = 2 * 1024 * 1024
+MIN_STRIP_ROWS = 64
+# Operations the scaling benchmark times, with the parameters it uses
+SCALING_OPERATIONS = {
+    "blur": {"ksize": 15},
+    "edges": {},
+    "brightness_contrast": {"brightness": 20, "contrast": 1.3},
+}
+
+_budget = None
+_threads_lock = threading.Lock()
+_serial_runs = 0
+_saved_threads = None
+
+
+class ParallelExecutor:
+    """
+    Runs ImageProcessor operations on strips of large images in parallel. Strips
+    are clipped at the image border like a whole-image call, so results are
+    identical to it whatever the number of threads. Operations that need the
+    whole image (operation_halo returns None, e.g. Canny edges) and images below
+    min_pixels run as one call; intensity filters with an edge overlay run their
+    grayscale and blur stages in strips and the overlay once on the whole image.
+    While strips run, OpenCV's own threading is
+    switched off, so the work never uses more than `threads` threads.
+    Anything else is forwarded to the wrapped processor, so this can stand in
+    for an ImageProcessor, e.g. inside a CachedProcessor.
+    """
+
+    def __init__(self, processor=None, threads=None, min_pixels=MIN_PIXELS, strips_per_thread=2):
+        self._processor = processor or ImageProcessor()
+        self._threads = max(1, threads or get_thread_budget())
+        self._min_pixels = min_pixels
+        self._strips_per_thread = strips_per_thread
+        self._pool = None
+        self._lock = threading.Lock()
+        self._parallel_runs = 0
+        self._whole_runs = 0
+        self._last_strips = 0
+
+    def __getattr__(self, name):
+        # Only called for attributes not found here: grabcut_session, get_background_stats, ...
+        return getattr(self._processor, name)
+
+    # Encapsulated getters
+    def get_processor(self):
+        return self._processor
+
+    def get_threads(self):
+        return self._threads
+
+    def get_stats(self):
+        return {
+            "threads": self._threads,
+            "parallel_runs": self._parallel_runs,
+            "whole_runs": self._whole_runs,
+            "last_strips": self._last_strips,
+        }
+
+    # Core methods
+    def apply(self, name, image, dst=None, **params):
+        """ImageProcessor.apply, split into strips when the image is large enough.
+        dst must not overlap image."""
+        if name == "intensity_filters" and params.get("edge", 0) > 0:
+            return self._intensity_filters(image, dst, **params)
+        halo = operation_halo(name, params)
+        h, w = image.shape[:2]
+        strips = self._strips(h) if halo is not None and h * w >= self._min_pixels else None
+        if strips is None or len(strips) < 2:
+            self._whole_runs += 1
+            return self._processor.apply(name, image, dst=dst, **params)
+        # The result's channels and dtype, from a corner too small to cost anything
+        probe = self._processor.apply(name, image[:16, :16], **params)
+        shape = image.shape[:2] + probe.shape[2:]
+        if dst is not None and (dst.shape != shape or dst.dtype != probe.dtype):
+            raise ValueError(f"dst is {dst.shape} {dst.dtype}, the result is {shape} {probe.dtype}.")
+        out = np.empty(shape, probe.dtype) if dst is None else dst
+        pool = self._get_pool()
+        with _serial_opencv():
+            futures = [pool.submit(self._run_strip, name, image, out, y0, y1, halo, params)
+                       for y0, y1 in strips]
+            for future in futures:
+                future.result()
+        self._parallel_runs += 1
+        self._last_strips = len(strips)
+        return out
+
+    def apply_all(self, image, operations):
+        result = image
+        for name, params in operations:
+            result = self.apply(name, result, **params)
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    # Internal helpers
+    def _intensity_filters(self, image, dst, grayscale=0.0, blur=0, edge=0.0, scale=1.0):
+        # The stages of ImageProcessor.apply_intensity_filters, with Canny run
+        # once on the whole image since its result is not local
+        staged = self.apply("intensity_filters", image, dst=dst, grayscale=grayscale, blur=blur, scale=scale)
+        if dst is None and staged is not image:
+            dst = staged    # a fresh intermediate, so the overlay can go in place
+        return self._processor.overlay_edges(staged, edge, blur, scale, dst=dst)
+
+    def _strips(self, h):
+        """(y0, y1) row ranges, about strips_per_thread per thread so a slow strip
+        does not leave the other threads idle at the end."""
+        count = min(self._threads * self._strips_per_thread, h // MIN_STRIP_ROWS)
+        if self._threads < 2 or count < 2:
+            return None
+        bounds = [h * i // count for i in range(count + 1)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._threads, thread_name_prefix="strip")
+            return self._pool
+
+    def _run_strip(self, name, image, out, y0, y1, halo, params):
+        if halo == 0:
+            # No context needed: write straight into the strip of the result
+            self._processor.apply(name, image[y0:y1], dst=out[y0:y1], **params)
+            return
+        h = image.shape[0]
+        ry0, ry1 = max(0, y0 - halo), min(h, y1 + halo)
+        result = self._processor.apply(name, image[ry0:ry1], **params)
+        out[y0:y1] = result[y0 - ry0:y1 - ry0]
+
+
+def get_thread_budget():
+    """Threads image work may use: set_thread_budget, else IMAGE_EDITOR_THREADS,
+    else every CPU."""
+    if _budget is not None:
+        return _budget
+    return max(1, int(os.environ.get(THREADS_ENV) or 0) or os.cpu_count() or 1)
+
+
+def set_thread_budget(threads=None):
+    """Cap the threads used for image work (None: back to the default) and
+    OpenCV's own thread count with it. Returns the budget."""
+    global _budget, _saved_threads
+    _budget = max(1, int(threads)) if threads else None
+    budget = get_thread_budget()
+    with _threads_lock:
+        # While strips run the new count is applied when they finish
+        if _serial_runs:
+            _saved_threads = budget
+        else:
+            cv2.setNumThreads(budget)
+    return budget
+
+
+@contextmanager
+def _serial_opencv():
+    """OpenCV single-threaded while strips run on our pool, so its workers and
+    ours do not multiply; the previous setting returns with the last run."""
+    global _serial_runs, _saved_threads
+    with _threads_lock:
+        if _serial_runs == 0:
+            _saved_threads = cv2.getNumThreads()
+            cv2.setNumThreads(1)
+        _serial_runs += 1
+    try:
+        yield
+    finally:
+        with _threads_lock:
+            _serial_runs -= 1
+            if _serial_runs == 0:
+                cv2.setNumThreads(_saved_threads)
+
+
+def scaling_benchmark(image, thread_counts, operations=SCALING_OPERATIONS, repeat=3, log=None):
+    """
+    Median seconds of each operation on image with strips on 1..N threads, and
+    of one whole-image call with OpenCV's own threading at N for comparison.
+    Returns {"op|strips|Nt": stats, "op|opencv|Nt": stats}, each with the speedup
+    over the single-threaded run and the largest difference from it. Operations
+    that are never split (operation_halo returns None, e.g. edges) only get
+    opencv rows, so the table does not present them as running in strips.
+    """
+    processor = ImageProcessor()
+    saved = cv2.getNumThreads()
+    results = {}
+    try:
+        for name, params in operations.items():
+            cv2.setNumThreads(1)
+            reference, base = _time(lambda img: processor.apply(name, img, **params), image, repeat)
+            split = operation_halo(name, params) is not None
+            for threads in thread_counts:
+                executor = ParallelExecutor(processor, threads)
+                runs = {"strips": lambda img: executor.apply(name, img, **params)} if split else {}
+                if threads > 1:
+                    runs["opencv"] = lambda img: processor.apply(name, img, **params)
+                for engine, run in runs.items():
+                    cv2.setNumThreads(threads if engine == "opencv" else 1)
+                    result, seconds = _time(run, image, repeat)
+                    key = f"{name}|{engine}|{threads}t"
+                    results[key] = {
+                        "median_ms": seconds * 1000,
+                        "speedup": base / seconds if seconds else 0.0,
+                        "max_abs_difference": int(np.abs(result.astype(np.int32) - reference).max()),
+                        "differing_pixels": float(np.mean((result != reference).reshape(image.shape[:2] + (-1,)).any(axis=2))),
+                    }
+                    if log is not None:
+                        log(key, results[key])
+                executor.shutdown()
+    finally:
+        cv2.setNumThreads(saved)
+    return results
+
+
+def _time(run, image, repeat):
+    result = run(image)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(image)
+        times.append(time.perf_counter() - start)
+    return result, sorted(times)[len(times) // 2]
+
+
+def main(argv=None):
+    from benchmark import environment, synthetic_image
+
+    parser = argparse.ArgumentParser(description="Measure how strip-parallel operations scale with threads.")
+    parser.add_argument("--size", type=float, default=50, help="synthetic image size in megapixels")
+    parser.add_argument("--threads", default=None, help="thread counts, e.g. 1,2,4,8 (default: 1 to all CPUs)")
+    parser.add_argument("--ops", default=",".join(SCALING_OPERATIONS), help="comma-separated operations")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", default=None, help="write results to this file")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        thread_counts = [int(t) for t in args.threads.split(",")]
+    else:
+        cpus = os.cpu_count() or 1
+        thread_counts = sorted({1, cpus} | {t for t in (2, 4, 8, 16, 32) if t < cpus})
+    operations = {name: SCALING_OPERATIONS.get(name, {}) for name in args.ops.split(",")}
+    image = synthetic_image(args.size)
+    print(f"{image.shape[1]}x{image.shape[0]} ({args.size:g} MP), {os.cpu_count()} CPUs")
+    print(f"{'case':36} {'median':>9} {'speedup':>8} {'max diff':>9} {'pixels':>8}")
+
+    def log(key, stats):
+        print(f"{key:36} {stats['median_ms']:7.0f}ms {stats['speedup']:7.2f}x "
+              f"{stats['max_abs_difference']:9d} {stats['differing_pixels']:8.4%}")
+
+    results = scaling_benchmark(image, thread_counts, operations, args.repeat, log)
+    whole = [name for name, params in operations.items() if operation_halo(name, params) is None]
+    if whole:
+        print(f"Not split into strips (whole image, OpenCV threads only): {', '.join(whole)}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"environment": environment(), "megapixels": args.size, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+# pipeline_planner.py
+#
+# Fuses neighbouring ImageProcessor operations so a pipeline makes fewer full
+# image passes and allocations:
+#   - runs of flips and 90 degree rotations become one rotate/flip; resizes and
+#     other angles resample, so each stays its own pass where it was
+#   - grayscale mixes (plus one trailing brightness/contrast) become one cv2.transform,
+#     rounded once at the end, so values can differ from the unfused run by one
+#   - brightness/contrast and point_ops runs become one lookup table, built by
+#     chaining each step's table so the result matches running them one by one
+#   - steps that do nothing are dropped
+#
+# Benchmark: python pipeline_planner.py -p "grayscale,rotate:angle=90,flip,resize:scale=0.5"
+
+import argparse
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from image_processor import ImageProcessor, rotated_size
+from instrumentation import record_allocation, span
+from point_ops import PointOps, apply_lut
+
+# BT.601 luma weights in OpenCV's BGR channel order, as used by COLOR_BGR2GRAY
+_LUMA_BGR = np.array([0.114, 0.587, 0.299])
+
+_POINT = ("brightness_contrast", "point_ops")
+
+
+class FusedPass:
+    """One pass of a plan: a label for reports and the function that runs it."""
+
+    def __init__(self, label, run, fused=1):
+        self.label = label
+        self.run = run
+        self.fused = fused  # number of source operations merged into this pass
+
+
+class PipelinePlan:
+    """
+    Passes planned for a list of (name, params) operations and an input image
+    of a given shape and dtype.
+    """
+
+    def __init__(self, passes, source_count):
+        self._passes = passes
+        self._source_count = source_count
+
+    def get_passes(self):
+        return list(self._passes)
+
+    def describe(self):
+        lines = [f"{self._source_count} operations -> {len(self._passes)} passes"]
+        for p in self._passes:
+            suffix = f" (fuses {p.fused})" if p.fused > 1 else ""
+            lines.append(f"  {p.label}{suffix}")
+        return "\n".join(lines)
+
+    def execute(self, image):
+        for p in self._passes:
+            # Stage names drop the parameters so repeated passes add up
+            stage = "plan." + p.label.split("(")[0].split("[")[0]
+            with span(stage, label=p.label):
+                result = p.run(image)
+            if result is not image:
+                record_allocation(stage, result.nbytes)
+            image = result
+        return image
+
+
+def plan_pipeline(operations, shape, dtype=np.uint8, processor=None):
+    """Build a PipelinePlan for operations applied to an image of shape/dtype."""
+    processor = processor or ImageProcessor()
+    source_count = len(operations)
+    operations = _expand(_drop_noops(operations))
+    passes = []
+    i = 0
+    while i < len(operations):
+        name = operations[i][0]
+        j = i
+        if _is_exact_geometric(*operations[i]):
+            while j < len(operations) and _is_exact_geometric(*operations[j]):
+                j += 1
+            new_pass = _plan_dihedral(operations[i:j])
+        elif name == "grayscale_mix" and _matrix_ok(shape, dtype):
+            while j < len(operations) and operations[j][0] == "grayscale_mix":
+                j += 1
+            # Mixes stay within range, so one trailing linear step can share the
+            # single clip at the end of the matrix transform
+            if j < len(operations) and operations[j][0] == "brightness_contrast":
+                j += 1
+            new_pass = _plan_color_matrix(operations[i:j])
+        elif name in _POINT and np.dtype(dtype) in (np.uint8, np.uint16):
+            while j < len(operations) and operations[j][0] in _POINT:
+                j += 1
+            new_pass = _plan_lut(operations[i:j], dtype)
+        else:
+            j = i + 1
+            new_pass = _plan_single(operations[i], processor)
+        passes.append(new_pass)
+        shape = _next_shape(operations[i:j], shape)
+        i = j
+    return PipelinePlan(passes, source_count)
+
+
+def run_fused(image, operations, processor=None):
+    """Run operations on image through a fused plan."""
+    return plan_pipeline(operations, image.shape, image.dtype, processor).execute(image)
+
+
+# ---------- Planning helpers ----------
+
+def _is_noop(name, params):
+    if name == "rotate":
+        return params.get("angle", 0) % 360 == 0
+    if name == "flip":
+        return params.get("mode", "horizontal") not in ("horizontal", "vertical")
+    if name == "resize":
+        scale = params.get("scale", 1.0)
+        return scale == 1.0 or scale <= 0
+    if name == "blur":
+        return params.get("ksize", 5) <= 1
+    if name == "brightness_contrast":
+        return params.get("brightness", 0) == 0 and params.get("contrast", 1.0) == 1.0
+    if name == "point_ops":
+        return _point_ops(name, params).is_identity()
+    if name == "intensity_filters":
+        return all(params.get(k, 0) <= 0 for k in ("grayscale", "blur", "edge"))
+    return False
+
+
+def _drop_noops(operations):
+    return [(name, dict(params)) for name, params in operations if not _is_noop(name, params)]
+
+
+def _expand(operations):
+    """Split compound operations so their colour steps can be fused."""
+    expanded = []
+    for name, params in operations:
+        if name == "grayscale":
+            expanded.append(("grayscale_mix", {"amount": 1.0}))
+        elif name == "intensity_filters" and params.get("grayscale", 0) > 0:
+            expanded.append(("grayscale_mix", {"amount": params["grayscale"]}))
+            rest = dict(params, grayscale=0.0)
+            if not _is_noop(name, rest):
+                expanded.append((name, rest))
+        else:
+            expanded.append((name, params))
+    return expanded
+
+
+def _next_shape(operations, shape):
+    if shape is None:
+        return shape
+    for name, params in operations:
+        h, w = shape[:2]
+        if name == "rotate":
+            w, h = rotated_size(w, h, params.get("angle", 0))
+            shape = (h, w) + shape[2:]
+        elif name == "resize":
+            scale = params.get("scale", 1.0)
+            shape = (int(h * scale), int(w * scale)) + shape[2:]
+        elif len(shape) != 3:
+            continue
+        elif name == "remove_background":
+            shape = shape[:2] + (4,)
+        elif name in ("grayscale_mix", "edges"):
+            shape = shape[:2] + (3,)
+    return shape
+
+
+def _is_exact_geometric(name, params):
+    """Flips and right-angle rotations only move pixels, so any run of them
+    folds into one rotate/flip with exactly the same result."""
+    if name == "flip":
+        return True
+    return name == "rotate" and params.get("angle", 0) % 360 in (90, 180, 270)
+
+
+def _matrix_ok(shape, dtype):
+    return shape is not None and len(shape) == 3 and shape[2] == 3 and np.dtype(dtype) == np.uint8
+
+
+def _plan_single(operation, processor):
+    name, params = operation
+    if name == "grayscale_mix":
+        # Not fusable for this input (gray, BGRA or 16-bit); use the plain ops
+        amount = params["amount"]
+        if amount >= 1.0:
+            return FusedPass("grayscale", processor.to_grayscale)
+        return FusedPass(f"intensity_filters(grayscale={amount:g})",
+                         lambda img: processor.apply_intensity_filters(img, grayscale=amount))
+    label = name + (f"({_format_params(params)})" if params else "")
+    return FusedPass(label, lambda img: processor.apply(name, img, **params))
+
+
+def _plan_lut(operations, dtype):
+    # Each step's table is chained through the previous one rather than the
+    # steps being evaluated together, so the rounding after every step, and
+    # with it the result, is the same as running them one by one
+    lut = None
+    for name, params in operations:
+        table = _point_ops(name, params).compile(dtype)
+        lut = table if lut is None else table[lut]
+    label = "lut[" + ", ".join(name for name, _ in operations) + "]"
+    return FusedPass(label, lambda img: apply_lut(img, lut), fused=len(operations))
+
+
+def _point_ops(name, params):
+    ops = PointOps()
+    if name == "brightness_contrast":
+        return ops.brightness_contrast(params.get("brightness", 0), params.get("contrast", 1.0))
+    if params.get("levels") is not None:
+        ops.levels(*params["levels"])
+    ops.gamma(params.get("gamma", 1.0))
+    if params.get("curve") is not None:
+        ops.curve(params["curve"])
+    return ops.brightness_contrast(params.get("brightness", 0), params.get("contrast", 1.0))
+
+
+def _plan_color_matrix(operations):
+    matrix = np.eye(3)
+    offset = np.zeros(3)
+    for name, params in operations:
+        if name == "grayscale_mix":
+            amount = params["amount"]
+            mix = (1.0 - amount) * np.eye(3) + amount * np.tile(_LUMA_BGR, (3, 1))
+            matrix = mix @ matrix
+        else:
+            contrast = params.get("contrast", 1.0)
+            matrix = contrast * matrix
+            offset = contrast * offset + params.get("brightness", 0)
+    transform = np.hstack([matrix, offset[:, None]]).astype(np.float32)
+    label = "color_matrix[" + ", ".join(name for name, _ in operations) + "]"
+    return FusedPass(label, lambda img: cv2.transform(img, transform), fused=len(operations))
+
+
+def _plan_dihedral(operations):
+    """Fold a run of flips and right-angle rotations into one rotate/flip. Resizes
+    are never folded in: resampling before or after a rotation, or combining
+    two scales, does not give the same pixels as the operations in order."""
+    linear = np.eye(2, dtype=int)
+    for name, params in operations:
+        if name == "rotate":
+            step = {90: [[0, -1], [1, 0]], 180: [[-1, 0], [0, -1]],
+                    270: [[0, 1], [-1, 0]]}[params.get("angle", 0) % 360]
+        else:
+            step = [[-1, 0], [0, 1]] if params.get("mode", "horizontal") == "horizontal" else [[1, 0], [0, -1]]
+        linear = np.array(step) @ linear
+    name, rotate_flip = _DIHEDRAL[tuple(linear.flatten())]
+    labels = ", ".join(op_name for op_name, _ in operations)
+    return FusedPass(f"{name}[{labels}]", rotate_flip, fused=len(operations))
+
+
+# Every combination of 90 degree rotations and flips, keyed by its 2x2 matrix
+_DIHEDRAL = {
+    (1, 0, 0, 1): ("identity", lambda img: img),
+    (0, -1, 1, 0): ("rotate90", lambda img: cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)),
+    (-1, 0, 0, -1): ("rotate180", lambda img: cv2.rotate(img, cv2.ROTATE_180)),
+    (0, 1, -1, 0): ("rotate270", lambda img: cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)),
+    (-1, 0, 0, 1): ("flip_horizontal", lambda img: cv2.flip(img, 1)),
+    (1, 0, 0, -1): ("flip_vertical", lambda img: cv2.flip(img, 0)),
+    (0, 1, 1, 0): ("transpose", lambda img: cv2.transpose(img)),
+    (0, -1, -1, 0): ("transverse", lambda img: cv2.rotate(cv2.transpose(img), cv2.ROTATE_180)),
+}
+
+
+def _format_params(params):
+    return ", ".join(f"{k}={v:g}" if isinstance(v, float) else f"{k}={v}" for k, v in params.items())
+
+
+# ---------- Benchmark ----------
+
+def _measure(plan, image, repeat):
+    """
+    Run plan on image and return (result, passes, output bytes, peak bytes,
+    median seconds). Output bytes add up the new arrays the passes return. Peak
+    bytes is the most memory tracemalloc saw in use during the run, which
+    covers numpy temporaries and OpenCV's output arrays but not OpenCV's
+    internal scratch buffers.
+    """
+    passes = plan.get_passes()
+    tracemalloc.start()
+    try:
+        result, output_bytes = image, 0
+        for p in passes:
+            out = p.run(result)
+            if out is not result:
+                output_bytes += out.nbytes
+            result = out
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        plan.execute(image)
+        times.append(time.perf_counter() - start)
+    return result, len(passes), output_bytes, peak, sorted(times)[len(times) // 2]
+
+
+def benchmark(operations, shape=(3000, 4000, 3), repeat=5):
+    """Compare the plain and fused pipelines on a synthetic image."""
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 256, shape, dtype=np.uint8), (7, 7), 0)
+    processor = ImageProcessor()
+    plan = plan_pipeline(operations, image.shape, image.dtype, processor)
+    # The operations as written, one processor call each
+    unfused_plan = PipelinePlan([_plan_single(op, processor) for op in operations], len(operations))
+    report = {"plan": plan.describe()}
+    results = {}
+    for key, candidate in (("unfused", unfused_plan), ("fused", plan)):
+        result, passes, output_bytes, peak_bytes, seconds = _measure(candidate, image, repeat)
+        results[key] = result
+        report[key] = {"passes": passes, "output_bytes": output_bytes, "peak_bytes": peak_bytes,
+                       "seconds": seconds}
+    plain, fused = results["unfused"], results["fused"]
+    same_shape = plain.shape == fused.shape
+    report["max_abs_difference"] = (int(np.abs(plain.astype(np.int32) - fused.astype(np.int32)).max())
+                                    if same_shape else None)
+    return report
+
+
+def main(argv=None):
+    from batch import parse_pipeline
+
+    parser = argparse.ArgumentParser(description="Compare fused and unfused pipelines.")
+    parser.add_argument("-p", "--pipeline", required=True, help='operations, e.g. "grayscale,rotate:angle=90"')
+    parser.add_argument("--size", default="4000x3000", help="synthetic image WIDTHxHEIGHT")
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    w, h = (int(v) for v in args.size.lower().split("x"))
+    shape = (h, w) if args.channels == 1 else (h, w, args.channels)
+    report = benchmark(parse_pipeline(args.pipeline), shape, args.repeat)
+    print(report["plan"])
+    print(f"{'':10} {'passes':>7} {'outputs':>12} {'peak':>12} {'median':>10}")
+    for key in ("unfused", "fused"):
+        r = report[key]
+        print(f"{key:10} {r['passes']:7d} {r['output_bytes'] / (1024 * 1024):10.1f}MB "
+              f"{r['peak_bytes'] / (1024 * 1024):10.1f}MB {r['seconds'] * 1000:8.1f}ms")
+    print(f"max abs difference: {report['max_abs_difference']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
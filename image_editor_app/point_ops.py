@@ -0,0 +1,143 @@
+# point_ops.py
+
+import cv2
+import numpy as np
+
+
+class PointOps:
+    """
+    A chain of per-pixel tone operations (brightness/contrast, gamma, levels,
+    curves) compiled into one lookup table, so the whole chain costs a single
+    pass over the image with no float temporaries. Values are given on the 8-bit
+    scale and are stretched to the full range of 16-bit images.
+    The alpha channel of BGRA images is left untouched.
+    """
+
+    def __init__(self):
+        self._stages = []
+        self._luts = {}
+
+    # Builders (each returns self so calls can be chained)
+    def brightness_contrast(self, brightness=0.0, contrast=1.0):
+        if brightness != 0 or contrast != 1.0:
+            self._add(("brightness_contrast", float(brightness), float(contrast)))
+        return self
+
+    def gamma(self, gamma=1.0):
+        """gamma > 1 brightens the midtones, gamma < 1 darkens them."""
+        if gamma <= 0:
+            raise ValueError("Gamma must be positive.")
+        if gamma != 1.0:
+            self._add(("gamma", float(gamma)))
+        return self
+
+    def levels(self, in_black=0, in_white=255, out_black=0, out_white=255):
+        if in_white <= in_black:
+            raise ValueError("in_white must be greater than in_black.")
+        if (in_black, in_white, out_black, out_white) != (0, 255, 0, 255):
+            self._add(("levels", float(in_black), float(in_white), float(out_black), float(out_white)))
+        return self
+
+    def curve(self, points):
+        """Piecewise-linear tone curve through (input, output) points."""
+        points = sorted((float(x), float(y)) for x, y in points)
+        if len(points) < 2:
+            raise ValueError("A curve needs at least two points.")
+        self._add(("curve", tuple(points)))
+        return self
+
+    def is_identity(self):
+        return not self._stages
+
+    # Compilation and application
+    def compile(self, dtype=np.uint8):
+        """Return the lookup table for images of the given integer dtype."""
+        dtype = np.dtype(dtype)
+        if dtype not in self._luts:
+            if dtype == np.uint8:
+                size = 256
+            elif dtype == np.uint16:
+                size = 65536
+            else:
+                raise ValueError(f"No lookup table for {dtype} images.")
+            values = self._evaluate(np.arange(size, dtype=np.float32), size - 1)
+            self._luts[dtype] = values.astype(dtype)
+        return self._luts[dtype]
+
+    def apply(self, image, dst=None):
+        """Return a mapped copy of image, or write it into dst (same shape and dtype)."""
+        if dst is not None and (dst.shape != image.shape or dst.dtype != image.dtype):
+            raise ValueError(f"dst is {dst.shape} {dst.dtype}, the image is {image.shape} {image.dtype}.")
+        if self.is_identity():
+            if dst is None:
+                return image.copy()
+            np.copyto(dst, image)
+            return dst
+        if image.dtype == np.uint8 or image.dtype == np.uint16:
+            return apply_lut(image, self.compile(image.dtype), dst)
+        if image.dtype.kind == "f":
+            # Float images are taken to be in the 0..1 range
+            return self._apply_float(image, dst)
+        raise ValueError(f"Unsupported image type: {image.dtype}")
+
+    # Internal helpers
+    def _add(self, stage):
+        self._stages.append(stage)
+        self._luts.clear()
+
+    def _evaluate(self, x, max_value):
+        """Run every stage on float32 values in 0..max_value."""
+        unit = max_value / 255.0
+        for stage in self._stages:
+            kind = stage[0]
+            if kind == "brightness_contrast":
+                x = x * stage[2] + stage[1] * unit
+            elif kind == "gamma":
+                x = max_value * np.power(np.clip(x, 0, max_value) / max_value, 1.0 / stage[1])
+            elif kind == "levels":
+                in_black, in_white, out_black, out_white = (v * unit for v in stage[1:])
+                t = np.clip((x - in_black) / (in_white - in_black), 0.0, 1.0)
+                x = out_black + t * (out_white - out_black)
+            elif kind == "curve":
+                xs = [p[0] * unit for p in stage[1]]
+                ys = [p[1] * unit for p in stage[1]]
+                x = np.interp(x, xs, ys).astype(np.float32)
+            x = np.clip(x, 0, max_value)
+        return x
+
+    def _apply_float(self, image, dst=None):
+        if dst is None:
+            result = image.copy()
+        else:
+            result = dst
+            np.copyto(result, image)
+        color = result[..., :3] if _has_alpha(image) else result
+        color[...] = self._evaluate(color.astype(np.float32) * 255.0, 255.0) / 255.0
+        return result
+
+
+def _has_alpha(image):
+    return image.ndim == 3 and image.shape[2] == 4
+
+
+def apply_lut(image, lut, dst=None):
+    """Map every colour value of image through lut, leaving alpha unchanged.
+    The result is written into dst if given, which may be image itself."""
+    if image.dtype == np.uint8:
+        if _has_alpha(image):
+            # cv2.LUT takes one table per channel; give alpha the identity table
+            identity = np.arange(256, dtype=np.uint8)
+            lut = np.stack([lut, lut, lut, identity], axis=-1).reshape(256, 1, 4)
+        return cv2.LUT(image, lut, dst=dst)
+    # cv2.LUT only handles 8-bit input; index the table directly for 16-bit
+    if _has_alpha(image):
+        if dst is None:
+            dst = np.empty_like(image)
+        np.take(lut, image[..., :3], out=dst[..., :3])
+        if dst is not image:
+            dst[..., 3] = image[..., 3]
+        return dst
+    if dst is None:
+        return lut[image]
+    np.take(lut, image, out=dst)
+    return dst
@@ -0,0 +1,113 @@
+# preview.py
+
+import cv2
+import numpy as np
+
+
+class PreviewProxy:
+    """
+    Keeps a canvas-sized copy of the committed image so live slider previews
+    process only the pixels that can actually be shown. The full-resolution
+    image is only rendered when an edit is committed.
+    """
+
+    def __init__(self):
+        self._source = None
+        self._proxy = None
+        self._scale = 1.0
+        self._canvas_size = None
+
+    def get(self, image, canvas_size):
+        """Return (proxy, scale) for `image` fitted inside canvas_size (w, h)."""
+        if image is not self._source or canvas_size != self._canvas_size:
+            self._build(image, canvas_size)
+        return self._proxy, self._scale
+
+    def invalidate(self):
+        self._source = None
+        self._proxy = None
+        self._scale = 1.0
+        self._canvas_size = None
+
+    def _build(self, image, canvas_size):
+        h, w = image.shape[:2]
+        canvas_w, canvas_h = canvas_size
+        scale = min(1.0, canvas_w / w, canvas_h / h)
+        if scale < 1.0:
+            new_w = max(1, int(round(w * scale)))
+            new_h = max(1, int(round(h * scale)))
+            # Area averaging avoids aliasing when shrinking large photos
+            proxy = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
+            # Read-only lets result caches fingerprint the proxy once
+            proxy.setflags(write=False)
+            scale = new_w / w
+        else:
+            proxy = image
+        # Hold a reference to the source so identity checks stay valid
+        self._source = image
+        self._proxy = proxy
+        self._scale = scale
+        self._canvas_size = canvas_size
+
+
+class DisplayCache:
+    """
+    Turns an image into the 8-bit RGB/RGBA/L array shown on the canvas: shrink
+    to fit with area filtering first, then convert colour, so the per-frame
+    cost depends on the canvas size rather than the image size. The last result
+    is kept until a different image or canvas size is asked for. Conversions
+    reuse the array of the previous one when the size matches, so callers must
+    be done with a result (e.g. have pasted it into a PhotoImage) before the
+    next get().
+    """
+
+    def __init__(self):
+        self._source = None
+        self._canvas_size = None
+        self._display = None
+        self._buffer = None     # last converted array, rewritten by the next conversion
+
+    def get_buffer(self):
+        return self._buffer
+
+    def get(self, image, canvas_size):
+        if image is not self._source or canvas_size != self._canvas_size:
+            self._display = fit_for_display(image, canvas_size, self._buffer)
+            if self._display is not image:
+                self._buffer = self._display
+            self._source = image
+            self._canvas_size = canvas_size
+        return self._display
+
+    def invalidate(self):
+        self._source = None
+        self._canvas_size = None
+        self._display = None
+
+
+def fit_for_display(image, canvas_size, reuse=None):
+    """Shrink image to fit canvas_size (w, h), keeping the aspect ratio like
+    PIL's thumbnail, and convert it to RGB/RGBA/L uint8 at that size. The
+    colour conversion writes into reuse when it has the result's shape."""
+    h, w = image.shape[:2]
+    canvas_w, canvas_h = canvas_size
+    scale = min(1.0, canvas_w / w, canvas_h / h)
+    if scale < 1.0:
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    if image.dtype == np.uint16:
+        image = (image >> 8).astype(np.uint8)
+    elif image.dtype != np.uint8:
+        image = cv2.convertScaleAbs(image, alpha=255.0)
+    if image.ndim == 3 and image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA, dst=_fitting(reuse, image))
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=_fitting(reuse, image))
+    return image
+
+
+def _fitting(reuse, image):
+    # OpenCV would replace a dst of the wrong shape anyway; checking keeps that explicit
+    if reuse is not None and reuse.shape == image.shape and reuse.dtype == np.uint8 and reuse is not image:
+        return reuse
+    return None
@@ -0,0 +1,142 @@
+# render_scheduler.py
+
+import queue
+import threading
+import time
+
+
+class RenderScheduler:
+    """
+    Runs image work on a background thread so the Tk main loop stays responsive.
+    Jobs are submitted under a key (for example "preview"). Only the latest job
+    per key is kept: a newer submission replaces a pending one. A result is still
+    shown if it is newer than what is on screen, so a continuous drag keeps
+    updating, but cancel() discards anything already in flight. Results are
+    handed back on the Tk thread through after().
+    """
+
+    def __init__(self, root, poll_ms=15):
+        self._root = root
+        self._poll_ms = poll_ms
+        self._cond = threading.Condition()
+        self._pending = {}      # key -> (seq, job, on_done, on_error, submitted_at)
+        self._shown = {}        # key -> seq of the newest delivered or cancelled job
+        self._running = None    # key of the job currently on the worker
+        self._results = queue.Queue()
+        self._seq = 0
+        self._polling = False
+        self._closed = False
+
+        self._submitted = 0
+        self._finished = 0
+        self._dropped = 0
+        self._failed = 0
+        self._last_latency = 0.0
+        self._total_latency = 0.0
+
+        self._worker = threading.Thread(target=self._run, name="render-worker", daemon=True)
+        self._worker.start()
+
+    # Public API
+    def submit(self, key, job, on_done, on_error=None):
+        """Queue job() for the worker. on_done(result) runs on the Tk thread."""
+        with self._cond:
+            self._seq += 1
+            if key in self._pending:
+                self._dropped += 1
+            self._pending[key] = (self._seq, job, on_done, on_error, time.perf_counter())
+            self._submitted += 1
+            self._cond.notify()
+        self._ensure_polling()
+
+    def cancel(self, key):
+        """Drop the pending job for key and ignore any result already in flight."""
+        with self._cond:
+            self._seq += 1
+            if self._pending.pop(key, None) is not None:
+                self._dropped += 1
+            self._shown[key] = self._seq
+
+    def is_busy(self, key=None):
+        with self._cond:
+            if key is None:
+                return bool(self._pending) or self._running is not None
+            return key in self._pending or self._running == key
+
+    def get_stats(self):
+        with self._cond:
+            finished = self._finished
+            return {
+                "submitted": self._submitted,
+                "finished": finished,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "pending": len(self._pending),
+                "last_latency_ms": self._last_latency * 1000.0,
+                "mean_latency_ms": (self._total_latency / finished * 1000.0) if finished else 0.0,
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify()
+
+    # Worker thread
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # Serve the oldest submission first so no key starves
+                key = min(self._pending, key=lambda k: self._pending[k][0])
+                seq, job, on_done, on_error, submitted_at = self._pending.pop(key)
+                self._running = key
+            try:
+                result = job()
+                error = None
+            except Exception as e:
+                result = None
+                error = e
+            # Publish before clearing _running so the poller never sees an idle gap
+            self._results.put((key, seq, result, error, on_done, on_error, submitted_at))
+            with self._cond:
+                self._running = None
+
+    # Tk thread
+    def _ensure_polling(self):
+        if not self._polling and not self._closed:
+            self._polling = True
+            self._root.after(self._poll_ms, self._poll)
+
+    def _poll(self):
+        while True:
+            try:
+                key, seq, result, error, on_done, on_error, submitted_at = self._results.get_nowait()
+            except queue.Empty:
+                break
+            with self._cond:
+                stale = seq <= self._shown.get(key, 0)
+                if stale:
+                    self._dropped += 1
+                elif error is not None:
+                    self._failed += 1
+                else:
+                    self._shown[key] = seq
+                    self._finished += 1
+                    self._last_latency = time.perf_counter() - submitted_at
+                    self._total_latency += self._last_latency
+            if stale:
+                continue
+            if error is not None:
+                if on_error is not None:
+                    on_error(error)
+                continue
+            on_done(result)
+
+        if self._closed or not (self.is_busy() or not self._results.empty()):
+            self._polling = False
+            return
+        self._root.after(self._poll_ms, self._poll)
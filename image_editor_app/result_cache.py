@@ -0,0 +1,126 @@
+# result_cache.py
+
+import threading
+from collections import OrderedDict
+
+from image_hash import fingerprint
+from image_processor import ImageProcessor
+
+
+class CachedProcessor:
+    """
+    Wraps an ImageProcessor and remembers results by (input image fingerprint,
+    operations), so slider values the user returns to, and redoing a step that
+    was just undone, come back without recomputing or allocating.
+
+    Cached results are returned as-is and marked read-only, because the same
+    array may be handed out again. Entries are evicted least recently used first
+    once their total size exceeds budget_bytes. Safe to share between the GUI
+    thread and the render worker. Methods other than apply/apply_all go
+    straight to the wrapped processor.
+    """
+
+    def __init__(self, processor=None, budget_bytes=256 * 1024 * 1024):
+        self._processor = processor or ImageProcessor()
+        self._budget = budget_bytes
+        self._entries = OrderedDict()   # key -> result
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __getattr__(self, name):
+        return getattr(self._processor, name)
+
+    # Encapsulated getters
+    def get_processor(self):
+        return self._processor
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "budget": self._budget,
+            }
+
+    # Core methods
+    def apply(self, name, image, **params):
+        return self.get_or_compute(image, [(name, params)],
+                                   lambda: self._processor.apply(name, image, **params))
+
+    def apply_all(self, image, operations):
+        """Run operations in order. Each intermediate result is cached as well,
+        so changing only the last operation reuses the work before it."""
+        def compute():
+            result = image
+            for name, params in operations:
+                result = self.apply(name, result, **params)
+            return result
+        return self.get_or_compute(image, operations, compute)
+
+    def get_or_compute(self, image, operations, compute):
+        """Return the cached result of operations on image, or compute() it."""
+        if not operations:
+            return image
+        key = (fingerprint(image), _operations_key(operations))
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return result
+            self._misses += 1
+        result = compute()
+        if result is not image:
+            self._store(key, result)
+        return result
+
+    def set_budget(self, budget_bytes):
+        with self._lock:
+            self._budget = budget_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    # Internal helpers
+    def _store(self, key, result):
+        result.setflags(write=False)
+        if result.nbytes > self._budget:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = result
+            self._bytes += result.nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self._budget and self._entries:
+            _, result = self._entries.popitem(last=False)
+            self._bytes -= result.nbytes
+            self._evictions += 1
+
+
+def _operations_key(operations):
+    return tuple((name, _freeze(params)) for name, params in operations)
+
+
+def _freeze(value):
+    # Hashable copy of a parameter value: lists (e.g. brush strokes) become
+    # tuples and dicts sorted item tuples, at any depth
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
@@ -0,0 +1,422 @@
+# server.py
+#
+# Long-running local processing server, so tools that need ImageProcessor
+# operations pay for interpreter start-up and OpenCV warm-up once:
+#
+#   python main.py server --port 8765 --workers 4
+#
+# Protocol: HTTP/1.1 on localhost with keep-alive.
+#   GET  /operations    names of the supported operations
+#   GET  /stats         queue depth, batch sizes and latency percentiles
+#   POST /process       body: raw pixels. Headers X-Pipeline (a pipeline spec as
+#                       accepted by batch.py), X-Shape ("h,w" or "h,w,c") and
+#                       X-Dtype (e.g. "uint8"). Response: raw pixels, X-Shape, X-Dtype.
+#   POST /process-shm   body: JSON {"name", "shape", "dtype", "pipeline"} naming a
+#                       shared memory block that holds the pixels. The result is
+#                       returned in a new block whose name is in the JSON reply;
+#                       the client unlinks it. No pixels pass through the socket.
+#
+# Queued requests are grouped into batches, one pool task per batch, so a
+# stream of small requests does not pay process hand-off costs per request.
+# See client.py and load_test.py.
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from batch import parse_pipeline
+from client import DEFAULT_PORT
+from image_processor import OPERATIONS, ImageProcessor
+from pipeline_planner import run_fused
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:     # Python 3.7: only raw buffers are supported
+    resource_tracker = shared_memory = None
+
+_LATENCY_WINDOW = 2048
+
+
+class ServerBusy(Exception):
+    """The request queue is full."""
+
+
+# ---------- Worker process ----------
+
+_worker_processor = None
+
+# Run once in every worker so the first real request does not pay for lazy
+# OpenCV initialisation
+_WARM_UP = [("grayscale", {}), ("blur", {"ksize": 5}), ("edges", {}),
+            ("brightness_contrast", {"brightness": 10}), ("rotate", {"angle": 90}),
+            ("resize", {"scale": 0.5})]
+
+
+def _init_worker():
+    global _worker_processor
+    _worker_processor = ImageProcessor()
+    image = np.zeros((64, 64, 3), np.uint8)
+    for name, params in _WARM_UP:
+        _worker_processor.apply(name, image, **params)
+
+
+def _run_batch(jobs):
+    """Run a batch of requests in a pool worker. Each result is ("ok", payload,
+    seconds) or ("error", message, seconds)."""
+    results = []
+    for job in jobs:
+        start = time.perf_counter()
+        try:
+            payload = _run_job(job)
+            results.append(("ok", payload, time.perf_counter() - start))
+        except Exception as e:
+            results.append(("error", f"{type(e).__name__}: {e}", time.perf_counter() - start))
+    return results
+
+
+def _run_job(job):
+    kind, source, shape, dtype, operations = job
+    if kind == "raw":
+        image = np.frombuffer(source, dtype=dtype).reshape(shape)
+        result = run_fused(image, operations, _worker_processor)
+        return result.tobytes(), result.shape, result.dtype.str
+
+    block = shared_memory.SharedMemory(name=source)
+    _untrack(block)
+    try:
+        image = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        result = run_fused(image, operations, _worker_processor)
+        del image
+    finally:
+        block.close()
+    out = shared_memory.SharedMemory(create=True, size=max(1, result.nbytes))
+    # The client owns the result block from here and unlinks it
+    _untrack(out)
+    view = np.ndarray(result.shape, dtype=result.dtype, buffer=out.buf)
+    view[...] = result
+    del view
+    name = out.name
+    out.close()
+    return name, result.shape, result.dtype.str
+
+
+def _untrack(block):
+    # Python registers every attached block with the resource tracker, which
+    # would unlink blocks the client still owns when this worker exits
+    try:
+        resource_tracker.unregister(block._name, "shared_memory")
+    except Exception:
+        pass
+
+
+# ---------- Server process ----------
+
+class ProcessingServer:
+    """
+    Queues processing requests from HTTP handler threads and feeds them to a
+    process pool in batches. A batch is dispatched as soon as batch_size
+    requests are waiting, or after batch_wait_ms when fewer are. At most two
+    batches per worker are handed to the pool at a time, so requests queue
+    here, where the queue depth is visible, and new arrivals can still join a
+    batch. Requests beyond max_queue are refused.
+    """
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, workers=None,
+                 batch_size=8, batch_wait_ms=2.0, max_queue=256):
+        self._address = (host, port)
+        self._workers = max(1, workers or os.cpu_count() or 1)
+        self._batch_size = max(1, batch_size)
+        self._batch_wait = batch_wait_ms / 1000.0
+        self._max_queue = max_queue
+        self._cond = threading.Condition()
+        self._queue = deque()           # (job, future, enqueued_at)
+        self._slots = threading.Semaphore(self._workers * 2)
+        self._pool = None
+        self._http = None
+        self._threads = []
+        self._closed = False
+
+        self._started = time.time()
+        self._completed = 0
+        self._errors = 0
+        self._rejected = 0
+        self._batches = 0
+        self._batched_requests = 0
+        self._in_flight = 0
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)     # seconds, enqueue to reply
+        self._process_times = deque(maxlen=_LATENCY_WINDOW)
+
+    # Encapsulated getters
+    def get_address(self):
+        """(host, port) actually bound, e.g. after asking for port 0."""
+        return self._http.server_address if self._http is not None else self._address
+
+    def get_stats(self):
+        with self._cond:
+            latencies = sorted(self._latencies)
+            processing = sorted(self._process_times)
+            stats = {
+                "uptime_s": time.time() - self._started,
+                "workers": self._workers,
+                "queue_depth": len(self._queue),
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "errors": self._errors,
+                "rejected": self._rejected,
+                "batches": self._batches,
+                "mean_batch_size": self._batched_requests / self._batches if self._batches else 0.0,
+            }
+        stats["latency_ms"] = percentiles(latencies)
+        stats["process_ms"] = percentiles(processing)
+        return stats
+
+    # Core methods
+    def start(self):
+        """Start the pool (warming every worker), the dispatcher and the HTTP listener."""
+        self._pool = self._new_pool()
+        self._http = ThreadingHTTPServer(self._address, _Handler)
+        self._http.daemon_threads = True
+        self._http.processing = self
+        for target, name in ((self._dispatch, "server-dispatch"), (self._http.serve_forever, "server-http")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, job):
+        """Queue a job; returns a Future resolving to the worker's payload."""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Server is shutting down.")
+            if len(self._queue) >= self._max_queue:
+                self._rejected += 1
+                raise ServerBusy("Request queue is full.")
+            self._queue.append((job, future, time.perf_counter()))
+            self._cond.notify()
+        return future
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    # Internal helpers
+    def _dispatch(self):
+        while True:
+            # Wait for a free pool slot, checking now and then for shutdown
+            while not self._slots.acquire(timeout=0.1):
+                if self._closed:
+                    break
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    for _, future, _ in self._queue:
+                        future.set_exception(RuntimeError("Server is shutting down."))
+                    self._queue.clear()
+                    return
+                # Give a burst a moment to fill the batch
+                deadline = time.perf_counter() + self._batch_wait
+                while len(self._queue) < self._batch_size and not self._closed:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._queue.popleft() for _ in range(min(self._batch_size, len(self._queue)))]
+                self._batches += 1
+                self._batched_requests += len(batch)
+                self._in_flight += len(batch)
+            task = self._submit_batch(batch)
+            task.add_done_callback(lambda done, batch=batch: self._finish_batch(batch, done))
+
+    def _new_pool(self):
+        pool = ProcessPoolExecutor(max_workers=self._workers, initializer=_init_worker)
+        # Submitting one task per worker forces them all to start and warm up now
+        for future in [pool.submit(_run_batch, []) for _ in range(self._workers)]:
+            future.result()
+        return pool
+
+    def _submit_batch(self, batch):
+        # A worker that died (killed, out of memory) breaks the whole pool, and
+        # every later submit raises; replace the pool once and retry. Whatever
+        # still fails is returned as a failed task, so _finish_batch answers the
+        # requests and frees the slot.
+        jobs = [job for job, _, _ in batch]
+        try:
+            try:
+                return self._pool.submit(_run_batch, jobs)
+            except BrokenProcessPool:
+                self._pool.shutdown(wait=False)
+                self._pool = self._new_pool()
+                return self._pool.submit(_run_batch, jobs)
+        except Exception as e:
+            task = Future()
+            task.set_exception(e)
+            return task
+
+    def _finish_batch(self, batch, task):
+        self._slots.release()
+        now = time.perf_counter()
+        try:
+            results = task.result()
+        except Exception as e:      # the worker process died, or the pool could not be replaced
+            results = [("failed", f"{type(e).__name__}: {e}", 0.0)] * len(batch)
+        with self._cond:
+            self._in_flight -= len(batch)
+            for (_, _, enqueued), (status, _, seconds) in zip(batch, results):
+                self._latencies.append(now - enqueued)
+                self._process_times.append(seconds)
+                if status == "ok":
+                    self._completed += 1
+                else:
+                    self._errors += 1
+        for (_, future, _), (status, payload, _) in zip(batch, results):
+            if status == "ok":
+                future.set_result(payload)
+            elif status == "error":
+                future.set_exception(ValueError(payload))
+            else:
+                future.set_exception(RuntimeError(payload))
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0, "count": 0}
+    pick = lambda q: values[min(len(values) - 1, int(round(q * (len(values) - 1))))] * 1000
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": values[-1] * 1000,
+            "count": len(values)}
+
+
+def parse_request_pipeline(spec):
+    """Operations for a request; spec is pipeline text or a list of {"op": ...}
+    dicts. Unlike the batch CLI, file paths are not read."""
+    if isinstance(spec, list):
+        spec = json.dumps(spec)
+    if not spec or os.path.exists(spec):
+        raise ValueError("Expected a pipeline such as \"blur:ksize=5,rotate:angle=90\".")
+    return parse_pipeline(spec)
+
+
+def _parse_shape(text):
+    shape = tuple(int(n) for n in text.split(","))
+    if len(shape) not in (2, 3) or min(shape) <= 0:
+        raise ValueError(f"Bad shape: {text}")
+    return shape
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, so clients reuse one connection
+
+    def do_GET(self):
+        if self.path == "/operations":
+            self._send_json(200, {"operations": list(OPERATIONS)})
+        elif self.path == "/stats":
+            self._send_json(200, self.server.processing.get_stats())
+        else:
+            self._send_json(404, {"error": "Not found."})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            if self.path == "/process":
+                shape = _parse_shape(self.headers.get("X-Shape", ""))
+                dtype = np.dtype(self.headers.get("X-Dtype", "uint8"))
+                if len(body) != int(np.prod(shape)) * dtype.itemsize:
+                    raise ValueError("Body size does not match X-Shape and X-Dtype.")
+                operations = parse_request_pipeline(self.headers.get("X-Pipeline", ""))
+                job = ("raw", body, shape, dtype.str, operations)
+            elif self.path == "/process-shm":
+                if shared_memory is None:
+                    raise ValueError("Shared memory needs Python 3.8 or newer.")
+                request = json.loads(body.decode("utf-8"))
+                job = ("shm", request["name"], tuple(request["shape"]), np.dtype(request["dtype"]).str,
+                       parse_request_pipeline(request.get("pipeline", "")))
+            else:
+                self._send_json(404, {"error": "Not found."})
+                return
+        except (ValueError, TypeError, KeyError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            payload = self.server.processing.submit(job).result()
+        except ServerBusy as e:
+            self._send_json(503, {"error": str(e)})
+            return
+        except ValueError as e:
+            self._send_json(422, {"error": str(e)})
+            return
+        except Exception as e:      # the pool failed or the server is shutting down
+            self._send_json(500, {"error": str(e)})
+            return
+
+        if job[0] == "raw":
+            data, shape, dtype = payload
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("X-Shape", ",".join(str(n) for n in shape))
+            self.send_header("X-Dtype", dtype)
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            name, shape, dtype = payload
+            self._send_json(200, {"name": name, "shape": list(shape), "dtype": dtype})
+
+    def _send_json(self, status, value):
+        data = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass    # one line per request would swamp the terminal under load
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve ImageProcessor operations on localhost.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to bind (default: localhost only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--batch", type=int, default=8, help="largest number of requests per pool task")
+    parser.add_argument("--batch-wait-ms", type=float, default=2.0,
+                        help="how long a partial batch waits for more requests")
+    parser.add_argument("--max-queue", type=int, default=256, help="queued requests before refusing more")
+    args = parser.parse_args(argv)
+
+    server = ProcessingServer(args.host, args.port, args.workers, args.batch,
+                              args.batch_wait_ms, args.max_queue).start()
+    host, port = server.get_address()
+    print(f"Serving {len(OPERATIONS)} operations on http://{host}:{port} "
+          f"with {server.get_stats()['workers']} workers (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
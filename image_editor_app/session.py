@@ -0,0 +1,442 @@
+# session.py
+#
+# Session files keep the original pixels, the edit history and cached
+# checkpoints, so an editing session can be closed and reopened without
+# decoding the image again or losing undo. Pixels are stored uncompressed at
+# page-aligned offsets and are memory-mapped when the session is opened.
+#
+# Layout: MAGIC, a little-endian u32 header length, the JSON header, then the
+# data area. Offsets in the header are relative to the data area.
+#
+# The journal is a crash-recovery log written on a background thread: the base
+# image once (or a reference to the file it was decoded from), then one small
+# record per edit, undo or redo.
+
+import json
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from history import HistoryEntry
+from image_processor import ImageProcessor
+from image_writer import write_atomic
+from operation_log import EditStep, OperationLog
+
+MAGIC = b"IEDSESS1"
+EXTENSION = ".imgsession"
+JOURNAL_EXTENSION = ".journal"
+_ALIGN = 4096
+_RECORD_HEADER = struct.Struct("<I")
+
+
+# ---------- Edit step serialisation ----------
+
+def step_to_record(step):
+    """(JSON-safe dict, payload bytes) for an EditStep."""
+    record = {"cost": float(step.cost)}
+    if step.pixels is None:
+        record["operations"] = [[name, params] for name, params in step.operations]
+        return record, b""
+    entry = step.pixels
+    record["pixels"] = {
+        "kind": entry.kind,
+        "shape": [int(n) for n in entry.shape],
+        "dtype": entry.dtype.str,
+        "region": [int(n) for n in entry.region] if entry.region is not None else None,
+    }
+    return record, entry.payload
+
+
+def step_from_record(record, payload=b""):
+    if "operations" in record:
+        operations = [(name, {k: _to_tuples(v) for k, v in params.items()})
+                      for name, params in record["operations"]]
+        return EditStep(operations=operations, cost=record.get("cost", 0.0))
+    info = record["pixels"]
+    entry = HistoryEntry(info["kind"], tuple(info["shape"]), info["dtype"], bytes(payload),
+                         tuple(info["region"]) if info["region"] is not None else None)
+    return EditStep(pixels=entry, cost=record.get("cost", 0.0))
+
+
+def _to_tuples(value):
+    # JSON turns tuples (levels, curve points) into lists, which cannot be cache keys
+    if isinstance(value, list):
+        return tuple(_to_tuples(v) for v in value)
+    return value
+
+
+def _array_info(image):
+    return {"shape": [int(n) for n in image.shape], "dtype": image.dtype.str}
+
+
+# ---------- Session files ----------
+
+def write_session(path, base, steps, cursor, checkpoints=None, source_path=None, progress=None):
+    """
+    Atomically write a session. checkpoints maps step index to the cached image
+    after that step; the image at the cursor is worth including, since reopening
+    then shows it without replaying anything. Returns the size and write time.
+    """
+    start = time.perf_counter()
+    blocks = []
+    offset = 0
+
+    def add(data):
+        nonlocal offset
+        position = offset
+        blocks.append(data)
+        offset += len(memoryview(data).cast("B"))
+        padding = -offset % _ALIGN
+        if padding:
+            blocks.append(bytes(padding))
+            offset += padding
+        return position
+
+    base = np.ascontiguousarray(base)
+    header = {"version": 1, "source_path": source_path, "cursor": int(cursor),
+              "base": dict(_array_info(base), offset=add(base)), "steps": [], "checkpoints": []}
+    for step in steps:
+        record, payload = step_to_record(step)
+        if payload:
+            record["payload"] = [add(payload), len(payload)]
+        header["steps"].append(record)
+    for index, image in sorted((checkpoints or {}).items()):
+        if 0 < index <= len(steps):
+            image = np.ascontiguousarray(image)
+            header["checkpoints"].append(dict(_array_info(image), index=int(index), offset=add(image)))
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    prefix = MAGIC + _RECORD_HEADER.pack(len(header_bytes)) + header_bytes
+    prefix += bytes(-len(prefix) % _ALIGN)
+    write_atomic(path, [prefix] + blocks, progress)
+    return {"path": path, "bytes": len(prefix) + offset, "write_ms": (time.perf_counter() - start) * 1000}
+
+
+class Session:
+    """
+    A session file opened for reading. The base image and checkpoints are
+    read-only memory maps, so opening costs almost nothing however large the
+    image is; pages are read from disk as they are used.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("Not an image editor session file.")
+            (length,) = _RECORD_HEADER.unpack(f.read(_RECORD_HEADER.size))
+            header = json.loads(f.read(length).decode("utf-8"))
+            data_start = len(MAGIC) + _RECORD_HEADER.size + length
+            data_start += -data_start % _ALIGN
+            self._steps = []
+            for record in header["steps"]:
+                payload = b""
+                if "payload" in record:
+                    position, size = record["payload"]
+                    f.seek(data_start + position)
+                    payload = f.read(size)
+                self._steps.append(step_from_record(record, payload))
+        self._source_path = header.get("source_path")
+        self._cursor = header["cursor"]
+        self._base = self._map(data_start, header["base"])
+        self._checkpoints = {info["index"]: self._map(data_start, info) for info in header["checkpoints"]}
+
+    # Encapsulated getters
+    def get_path(self):
+        return self._path
+
+    def get_source_path(self):
+        return self._source_path
+
+    def get_base(self):
+        return self._base
+
+    def get_steps(self):
+        return list(self._steps)
+
+    def get_cursor(self):
+        return self._cursor
+
+    def get_checkpoints(self):
+        return dict(self._checkpoints)
+
+    # Internal helpers
+    def _map(self, data_start, info):
+        return np.memmap(self._path, dtype=np.dtype(info["dtype"]), mode="r",
+                         offset=data_start + info["offset"], shape=tuple(info["shape"]))
+
+
+def open_session(path):
+    return Session(path)
+
+
+# ---------- Crash-recovery journal ----------
+
+def recovery_dir():
+    """Folder for journals; IMAGE_EDITOR_RECOVERY_DIR overrides the default."""
+    return os.environ.get("IMAGE_EDITOR_RECOVERY_DIR") or os.path.join(
+        os.path.expanduser("~"), ".image_editor", "recovery")
+
+
+class Journal:
+    """
+    Append-only log of the edit history for crash recovery. Every call queues
+    a record and returns at once; a background thread appends it and fsyncs the
+    file. A record cut short by a crash is ignored when the journal is read.
+    Step indices count from the base image given to start(), so steps the
+    history later folds into its base keep their numbers.
+    """
+
+    def __init__(self, folder=None):
+        self._folder = folder or recovery_dir()
+        self._path = None
+        self._source_base = None    # (path, base) while the base is only referenced
+        self._records = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="session-journal", daemon=True)
+        self._worker.start()
+
+    # Encapsulated getters
+    def get_path(self):
+        return self._path
+
+    # Core methods
+    def start(self, base, source_path=None, steps=(), cursor=0, keep_steps=False, decoded=False):
+        """
+        Log a new base image. Unless keep_steps is set (the base was replaced by
+        a full-resolution decode of the same picture) a new journal file is
+        begun and the old one removed. steps and cursor restore an existing
+        history on top of the base. With decoded, base is source_path as read
+        from disk (or a reduced decode of it), so only the file's path, size and
+        time are logged and recovery decodes it again at full resolution.
+        """
+        if not keep_steps:
+            old, self._path = self._path, os.path.join(
+                self._folder, f"editor-{os.getpid()}-{int(time.time() * 1000)}{JOURNAL_EXTENSION}")
+            self._records.put(("open", self._path, old))
+        header = dict(_array_info(base), type="base", source_path=source_path, keep_steps=keep_steps)
+        payload = b""
+        self._source_base = None
+        source = _file_reference(source_path) if decoded and source_path else None
+        if isinstance(base, np.memmap) and base.filename:
+            # Pixels mapped from a session file are referenced rather than copied
+            header["map"] = {"path": base.filename, "offset": base.offset,
+                             "mtime": os.path.getmtime(base.filename)}
+        elif source is not None:
+            # Writing out a large decode on every open would cost far more than
+            # decoding it again after a crash
+            header["source"] = source
+            self._source_base = (source["path"], base)
+        else:
+            payload = np.ascontiguousarray(base)
+        self._put(header, payload)
+        for index, step in enumerate(steps, 1):
+            self.record(index, step)
+        if steps:
+            self.cursor(cursor)
+
+    def source_replaced(self, path):
+        """path is about to be overwritten, e.g. by saving over the opened file.
+        If the logged base only references it, its pixels are logged instead."""
+        if self._source_base is None or os.path.abspath(path) != self._source_base[0]:
+            return
+        source_path, base = self._source_base
+        self._source_base = None
+        header = dict(_array_info(base), type="base", source_path=source_path, keep_steps=True)
+        self._put(header, np.ascontiguousarray(base))
+
+    def record(self, index, step):
+        """Step `index` was recorded; later steps were dropped."""
+        record, payload = step_to_record(step)
+        self._put({"type": "record", "index": int(index), "step": record}, payload)
+
+    def cursor(self, index):
+        self._put({"type": "cursor", "index": int(index)})
+
+    def edit(self, index, operations):
+        self._put({"type": "edit", "index": int(index), "operations": [[n, p] for n, p in operations]})
+
+    def remove(self, index):
+        self._put({"type": "remove", "index": int(index)})
+
+    def close(self, discard=True):
+        """Finish writing; with discard the journal is deleted, as after a clean exit."""
+        self._records.put(("close", discard, None))
+        self._worker.join()
+
+    # Internal helpers
+    def _put(self, header, payload=b""):
+        if self._path is not None:
+            self._records.put(("write", header, payload))
+
+    def _run(self):
+        f = None
+        path = None
+        while True:
+            kind, first, second = self._records.get()
+            try:
+                if kind == "open":
+                    if f is not None:
+                        f.close()
+                    _remove_quietly(second)
+                    os.makedirs(self._folder, exist_ok=True)
+                    path = first
+                    f = open(path, "wb")
+                elif kind == "write" and f is not None:
+                    payload = memoryview(second).cast("B")
+                    header = json.dumps(dict(first, payload_bytes=len(payload))).encode("utf-8")
+                    f.write(_RECORD_HEADER.pack(len(header)))
+                    f.write(header)
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                elif kind == "close":
+                    if f is not None:
+                        f.close()
+                        if first:
+                            _remove_quietly(path)
+                    return
+            except OSError:
+                # Recovery is best effort; never take the editor down over it
+                pass
+
+
+def _remove_quietly(path):
+    if path is not None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _read_records(path):
+    with open(path, "rb") as f:
+        while True:
+            prefix = f.read(_RECORD_HEADER.size)
+            if len(prefix) < _RECORD_HEADER.size:
+                return
+            (length,) = _RECORD_HEADER.unpack(prefix)
+            try:
+                header = json.loads(f.read(length).decode("utf-8"))
+            except ValueError:
+                return
+            payload = f.read(header["payload_bytes"])
+            if len(payload) < header["payload_bytes"]:
+                return
+            yield header, payload
+
+
+def _file_reference(path):
+    try:
+        return {"path": os.path.abspath(path), "mtime": os.path.getmtime(path), "size": os.path.getsize(path)}
+    except OSError:
+        return None
+
+
+def _journal_base(header, payload, later=()):
+    dtype, shape = np.dtype(header["dtype"]), tuple(header["shape"])
+    source = header.get("source")
+    if source is not None:
+        if _file_reference(source["path"]) != source:
+            # Saving over the file logs the same picture's pixels after this
+            for next_header, next_payload in later:
+                if next_header["type"] != "base" or not next_header.get("keep_steps"):
+                    break
+                if "source" not in next_header and "map" not in next_header:
+                    return _journal_base(next_header, next_payload)
+            raise ValueError(f"The image {source['path']} has changed since the edits were made.")
+        # Only loaded when recovering, as it imports the image decoders
+        from image_loader import read_full
+        return read_full(source["path"])
+    mapped = header.get("map")
+    if mapped is None:
+        return np.frombuffer(payload, dtype=dtype).reshape(shape)
+    if not os.path.exists(mapped["path"]) or os.path.getmtime(mapped["path"]) != mapped["mtime"]:
+        raise ValueError(f"The session file {mapped['path']} has changed since the edits were made.")
+    return np.memmap(mapped["path"], dtype=dtype, mode="r", offset=mapped["offset"], shape=shape)
+
+
+def read_journal(path, processor=None):
+    """
+    Rebuild the history a journal describes. Returns (source_path, base, steps,
+    cursor). Changed or removed steps are replayed through an OperationLog, as
+    the editor did, so later pixel edits stay valid.
+    """
+    source_path, base, steps, cursor = None, None, [], 0
+    records = list(_read_records(path))
+    for i, (header, payload) in enumerate(records):
+        kind = header["type"]
+        if kind == "base":
+            base = _journal_base(header, payload, [r for r in records[i + 1:] if r[0]["type"] == "base"])
+            source_path = header.get("source_path")
+            if not header.get("keep_steps"):
+                steps, cursor = [], 0
+        elif kind == "record":
+            index = header["index"]
+            steps = steps[:index - 1] + [step_from_record(header["step"], payload)]
+            cursor = index
+        elif kind == "cursor":
+            cursor = header["index"]
+        elif kind in ("edit", "remove"):
+            log = OperationLog(processor or ImageProcessor(), budget_bytes=float("inf"))
+            log.load(base, steps, cursor)
+            if kind == "edit":
+                log.edit_step(header["index"], step_from_record({"operations": header["operations"]}).operations)
+            else:
+                log.remove_step(header["index"])
+            steps, cursor = log.get_steps(), log.get_cursor()
+    if base is None:
+        raise ValueError("The journal holds no image.")
+    return source_path, base, steps, cursor
+
+
+def find_journals(folder=None):
+    """
+    Journals left behind by editors that did not exit cleanly, newest first.
+    Journals without any edit have nothing to recover and are deleted.
+    """
+    folder = folder or recovery_dir()
+    if not os.path.isdir(folder):
+        return []
+    found = []
+    for name in os.listdir(folder):
+        if not name.endswith(JOURNAL_EXTENSION):
+            continue
+        path = os.path.join(folder, name)
+        if _is_running(name):
+            continue
+        try:
+            has_steps = any(header["type"] == "record" for header, _ in _read_records(path))
+        except (OSError, KeyError):
+            has_steps = False
+        if has_steps:
+            found.append(path)
+        else:
+            _remove_quietly(path)
+    return sorted(found, key=os.path.getmtime, reverse=True)
+
+
+def discard_journal(path):
+    _remove_quietly(path)
+
+
+def _is_running(name):
+    # editor-<pid>-<ms>.journal; a journal of a live editor is not orphaned
+    try:
+        pid = int(name.split("-")[1])
+    except (IndexError, ValueError):
+        return False
+    if pid == os.getpid():
+        return True
+    if os.name != "posix":
+        return False
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True     # alive, but owned by another user
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,173 @@
+# startup.py
+#
+# Startup profile of the editor: how long each subsystem takes to import, when
+# the window first appears and when the first image is on screen. Only the
+# standard library is imported here, so main.py can start the clock before
+# anything heavy loads.
+#
+#   python main.py photo.jpg --profile-startup --json startup.json
+#   python startup.py                          # cold imports of the headless modules
+#   python startup.py --gui photo.jpg --json startup.json
+#   python startup.py --gui photo.jpg --baseline startup.json --threshold 0.2
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+# Modules scripts use without a display, and the GUI modules they must not load
+HEADLESS_MODULES = ("image_processor", "image_model", "batch", "server", "stream", "client")
+GUI_STACK = ("tkinter", "PIL.ImageTk")
+# Milestones ImageEditorApp records, in the order they happen
+MILESTONES = ("window", "ready", "first_image")
+
+_IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "loaded": [m for m in sys.argv[2:] if m in sys.modules]}))
+"""
+
+
+class StartupProfile:
+    """
+    Import phases and milestones of one start, in seconds since the profile was
+    created (main() creates it first thing). Phases are timed in the order they
+    run, so each one only counts the modules the phases before it had not
+    already loaded.
+    """
+
+    def __init__(self, started=None):
+        self._started = time.perf_counter() if started is None else started
+        self._phases = []       # (name, seconds)
+        self._marks = {}        # milestone -> seconds since start
+
+    # Encapsulated getters
+    def get_phases(self):
+        return list(self._phases)
+
+    def get_marks(self):
+        return dict(self._marks)
+
+    def elapsed(self):
+        return time.perf_counter() - self._started
+
+    # Core methods
+    @contextmanager
+    def phase(self, name):
+        """Time the imports (or other work) in the with-block as one phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases.append((name, time.perf_counter() - start))
+
+    def mark(self, name):
+        """Record a milestone; only its first occurrence counts."""
+        self._marks.setdefault(name, self.elapsed())
+
+    def to_results(self):
+        """Timings keyed like benchmark.py results, so runs compare the same way."""
+        results = {f"gui.import.{name}": {"median_ms": seconds * 1000} for name, seconds in self._phases}
+        for name, seconds in self._marks.items():
+            results[f"gui.{name}"] = {"median_ms": seconds * 1000}
+        return results
+
+    def format(self):
+        lines = [f"{'import phase':24} {'ms':>8}"]
+        for name, seconds in self._phases:
+            lines.append(f"{name:24} {seconds * 1000:8.1f}")
+        lines.append(f"{'total':24} {sum(s for _, s in self._phases) * 1000:8.1f}")
+        lines.append("")
+        lines.append(f"{'milestone':24} {'ms':>8}")
+        for name in MILESTONES:
+            if name in self._marks:
+                lines.append(f"{name:24} {self._marks[name] * 1000:8.1f}")
+        return "\n".join(lines)
+
+
+def profile_imports(modules=HEADLESS_MODULES, repeat=3):
+    """
+    Import each module in a fresh interpreter `repeat` times. Returns {module:
+    {"median_ms", "gui_stack"}}, the median like benchmark.py results, where
+    gui_stack lists any GUI modules an import pulled in.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in modules:
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, "-c", _IMPORT_PROBE, module] + list(GUI_STACK),
+                                 cwd=here, capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        seconds = sorted(run["seconds"] for run in runs)[len(runs) // 2]
+        loaded = sorted({name for run in runs for name in run["loaded"]})
+        results[module] = {"median_ms": seconds * 1000, "gui_stack": loaded}
+    return results
+
+
+def profile_gui(image=None):
+    """Start the editor with --profile-startup in a fresh interpreter and return
+    its timings (see StartupProfile.to_results). Needs a display."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    args = [sys.executable, os.path.join(here, "main.py"), "--profile-startup", "--json", "-"]
+    if image:
+        args.insert(2, image)
+    out = subprocess.run(args, cwd=here, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)["results"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the editor's startup.")
+    parser.add_argument("--gui", action="store_true", help="also time a GUI start (needs a display)")
+    parser.add_argument("image", nargs="?", help="image the GUI start opens, for time to first image")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per headless import")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    parser.add_argument("--baseline", default=None, help="compare against results saved with --json")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown that counts as a regression (default 0.1)")
+    args = parser.parse_args(argv)
+
+    imports = profile_imports(repeat=args.repeat)
+    results = {f"import.{module}": stats for module, stats in imports.items()}
+    print(f"{'headless import':24} {'ms':>8}  GUI modules loaded")
+    for module, stats in imports.items():
+        print(f"{module:24} {stats['median_ms']:8.1f}  {', '.join(stats['gui_stack']) or '-'}")
+    if args.gui:
+        gui = profile_gui(args.image)
+        results.update(gui)
+        print(f"\n{'gui':24} {'ms':>8}")
+        for key, stats in gui.items():
+            print(f"{key[4:]:24} {stats['median_ms']:8.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+    status = 0
+    leaks = [module for module, stats in imports.items() if stats["gui_stack"]]
+    if leaks:
+        print(f"\nImporting {', '.join(leaks)} loads GUI modules.")
+        status = 1
+    if args.baseline:
+        # Only now, as benchmark imports the whole imaging stack
+        from benchmark import compare
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        rows, regressions = compare(results, baseline, args.threshold)
+        print(f"\n{'timing':32} {'baseline':>9} {'now':>9} {'change':>8}")
+        for key, before, now, ratio in rows:
+            flag = "  REGRESSION" if key in regressions else ""
+            print(f"{key:32} {before:9.1f} {now:9.1f} {(ratio - 1) * 100:+7.1f}%{flag}")
+        print(f"\n{len(regressions)} of {len(rows)} timings slower than the baseline by more "
+              f"than {args.threshold:.0%}")
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+# stream.py
+#
+# Streams a video file or a numbered image sequence through an ImageProcessor
+# pipeline. Decoding, processing and encoding each run on their own thread,
+# connected by bounded queues, so only a few frames are ever held in memory and
+# the three stages overlap. Example:
+#
+#   python main.py stream clip.mp4 -o out.mp4 -p "intensity_filters:grayscale=0.5:edge=100,rotate:angle=90"
+#   python main.py stream "frames/*.png" -o "out/%05d.png" -p "brightness_contrast:brightness=20"
+
+import argparse
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from batch import parse_pipeline
+from image_processor import ImageProcessor
+from pipeline_planner import plan_pipeline
+
+STAGES = ("decode", "process", "encode")
+
+# Codec for each video container; anything else is written as an image sequence
+VIDEO_CODECS = {".mp4": "mp4v", ".m4v": "mp4v", ".avi": "MJPG", ".mov": "mp4v", ".mkv": "XVID"}
+
+_DONE = object()
+
+
+class _Failure:
+    """An exception raised on a stage thread, passed downstream to be re-raised."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class StageStats:
+    """Time one stage spent working and blocked on its neighbours."""
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy = 0.0
+        self.wait_in = 0.0
+        self.wait_out = 0.0
+
+    def report(self, wall):
+        return {
+            "frames": self.frames,
+            "busy_seconds": self.busy,
+            "utilisation": self.busy / wall if wall else 0.0,
+            "wait_input_seconds": self.wait_in,
+            "wait_output_seconds": self.wait_out,
+            "ms_per_frame": self.busy / self.frames * 1000 if self.frames else 0.0,
+        }
+
+
+# ---------- Sources and sinks ----------
+
+def is_video(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_CODECS
+
+
+def sequence_paths(source):
+    """Frame files for a directory, a glob pattern or a printf pattern such as
+    frames/%05d.png (counted up from 0 or 1 until a number is missing)."""
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source)
+                      if os.path.isfile(os.path.join(source, name)))
+    if "%" in source:
+        start = 0 if os.path.exists(source % 0) else 1
+        paths = []
+        while os.path.exists(source % (start + len(paths))):
+            paths.append(source % (start + len(paths)))
+        return paths
+    return sorted(p for p in glob.glob(source) if os.path.isfile(p))
+
+
+def read_frames(source):
+    """Yield the frames of a video file or image sequence one at a time."""
+    if os.path.isfile(source) and is_video(source):
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video: {source}")
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                yield frame
+        finally:
+            capture.release()
+    paths = sequence_paths(source)
+    if not paths:
+        raise ValueError(f"No frames found for: {source}")
+    for path in paths:
+        frame = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if frame is None:
+            raise ValueError(f"Could not decode frame: {path}")
+        yield frame
+
+
+def source_fps(source, default=25.0):
+    """Frame rate of a video file, or `default` for image sequences."""
+    if os.path.isfile(source) and is_video(source):
+        capture = cv2.VideoCapture(source)
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        capture.release()
+        if fps and fps > 0:
+            return fps
+    return default
+
+
+class FrameWriter:
+    """
+    Writes frames to a video file (container chosen by extension, see
+    VIDEO_CODECS) or to a printf-style image sequence such as out/%05d.png.
+    The video is opened on the first frame, once its size is known. Video
+    frames are written as 8-bit BGR; sequences keep alpha and bit depth.
+    """
+
+    def __init__(self, path, fps=25.0):
+        self._path = path
+        self._fps = fps
+        self._writer = None
+        self._count = 0
+        if not is_video(path):
+            if "%" not in path:
+                if os.path.splitext(path)[1]:
+                    raise ValueError(f"An image sequence needs a frame number pattern, e.g. out/%05d.png: {path}")
+                # A folder: number the frames inside it
+                self._path = os.path.join(path, "%05d.png")
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+
+    # Encapsulated getters
+    def get_count(self):
+        return self._count
+
+    # Core methods
+    def write(self, frame):
+        if is_video(self._path):
+            self._write_video(frame)
+        elif not cv2.imwrite(self._path % self._count, frame):
+            raise ValueError(f"Could not write frame: {self._path % self._count}")
+        self._count += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    # Internal helpers
+    def _write_video(self, frame):
+        if frame.dtype != np.uint8:
+            frame = cv2.convertScaleAbs(frame, alpha=255.0 / np.iinfo(frame.dtype).max
+                                        if frame.dtype.kind in "ui" else 255.0)
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            fourcc = cv2.VideoWriter_fourcc(*VIDEO_CODECS[os.path.splitext(self._path)[1].lower()])
+            size = (frame.shape[1], frame.shape[0])
+            self._writer = cv2.VideoWriter(self._path, fourcc, self._fps, size, frame.ndim == 3)
+            if not self._writer.isOpened():
+                raise ValueError(f"Could not open video for writing: {self._path}")
+        self._writer.write(frame)
+
+
+# ---------- Pipeline ----------
+
+def process_stream(frames, operations, processor=None, queue_size=4, stats=None, fuse=True):
+    """
+    Generator: yield the processed frames of the iterable `frames` in order.
+    Frames are pulled from `frames` (decoded) on one thread and processed on
+    another, each handing over through a queue of at most queue_size frames.
+    Pass a dict as stats to have it filled with a StageStats per stage; the
+    "encode" entry counts the time this generator's consumer waited for frames.
+    With fuse, neighbouring operations are merged as in batch.py.
+    """
+    processor = processor or ImageProcessor()
+    stats = stats if stats is not None else {}
+    for name in STAGES:
+        stats.setdefault(name, StageStats(name))
+    stop = threading.Event()
+    decoded = queue.Queue(maxsize=queue_size)
+    processed = queue.Queue(maxsize=queue_size)
+    plans = {}
+
+    def process(frame):
+        if not fuse:
+            return processor.apply_all(frame, operations)
+        # Frames of one clip share a shape, so the fused plan is built once
+        key = (frame.shape, frame.dtype)
+        if key not in plans:
+            plans[key] = plan_pipeline(operations, frame.shape, frame.dtype, processor)
+        return plans[key].execute(frame)
+
+    threads = [
+        threading.Thread(target=_run_stage, name="stream-decode", daemon=True,
+                         args=(iter(frames), None, stats["decode"], decoded, stop)),
+        threading.Thread(target=_run_stage, name="stream-process", daemon=True,
+                         args=(_drain(decoded, stats["process"], stop), process, stats["process"], processed, stop)),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for frame in _drain(processed, stats["encode"], stop):
+            yield frame
+    finally:
+        # Unblock the stage threads if the consumer stopped early
+        stop.set()
+        for q in (decoded, processed):
+            _empty(q)
+        for thread in threads:
+            thread.join()
+
+
+def run_stream(source, output, operations, processor=None, queue_size=4, fps=None, limit=None, fuse=True):
+    """
+    Stream source (video file or image sequence) through operations into output.
+    limit stops after that many frames. Returns a report with the frame count,
+    wall time, fps and each stage's utilisation; the stage with the highest
+    utilisation is the bottleneck.
+    """
+    stats = {name: StageStats(name) for name in STAGES}
+    encode = stats["encode"]
+    writer = FrameWriter(output, fps or source_fps(source))
+    frames = read_frames(source)
+    if limit is not None:
+        frames = _take(frames, limit)
+    started = time.perf_counter()
+    try:
+        for frame in process_stream(frames, operations, processor, queue_size, stats, fuse):
+            start = time.perf_counter()
+            writer.write(frame)
+            encode.busy += time.perf_counter() - start
+            encode.frames += 1
+    finally:
+        writer.close()
+    wall = time.perf_counter() - started
+    stages = {name: stats[name].report(wall) for name in STAGES}
+    return {
+        "source": source,
+        "output": output,
+        "frames": writer.get_count(),
+        "wall_seconds": wall,
+        "fps": writer.get_count() / wall if wall else 0.0,
+        "queue_size": queue_size,
+        "stages": stages,
+        "bottleneck": max(STAGES, key=lambda name: stages[name]["utilisation"]),
+    }
+
+
+def print_report(report, out=sys.stdout):
+    print(f"{report['frames']} frames in {report['wall_seconds']:.2f}s: {report['fps']:.1f} fps "
+          f"(queues of {report['queue_size']})", file=out)
+    print(f"{'stage':10} {'busy':>8} {'util':>6} {'ms/frame':>9} {'wait in':>8} {'wait out':>9}", file=out)
+    for name in STAGES:
+        s = report["stages"][name]
+        print(f"{name:10} {s['busy_seconds']:7.2f}s {s['utilisation']:6.0%} {s['ms_per_frame']:9.1f} "
+              f"{s['wait_input_seconds']:7.2f}s {s['wait_output_seconds']:8.2f}s", file=out)
+    print(f"Bottleneck: {report['bottleneck']}", file=out)
+
+
+# ---------- Stage threads ----------
+
+def _run_stage(items, fn, stats, out, stop):
+    """Pull items, apply fn (or just pull, for the decode stage) and put the
+    results on `out`, until items run out or stop is set."""
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            pulled = time.perf_counter()
+            if fn is None:
+                stats.busy += pulled - start
+            else:
+                item = fn(item)
+                stats.busy += time.perf_counter() - pulled
+            stats.frames += 1
+            start = time.perf_counter()
+            if not _put(out, item, stop):
+                return
+            stats.wait_out += time.perf_counter() - start
+    except Exception as e:
+        _put(out, _Failure(e), stop)
+        return
+    _put(out, _DONE, stop)
+
+
+def _drain(q, stats, stop):
+    """Yield items from q until the end marker or stop, re-raising a stage's
+    failure. Time spent waiting counts as stats.wait_in."""
+    while True:
+        start = time.perf_counter()
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            stats.wait_in += time.perf_counter() - start
+            if stop.is_set():
+                return
+            continue
+        stats.wait_in += time.perf_counter() - start
+        if item is _DONE:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _empty(q):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
+
+
+def _take(frames, limit):
+    for i, frame in enumerate(frames):
+        if i >= limit:
+            return
+        yield frame
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="stream", description="Process a video or image sequence frame by frame.")
+    parser.add_argument("source", help="video file, folder of frames, glob pattern or printf pattern (frames/%%05d.png)")
+    parser.add_argument("-o", "--output", required=True,
+                        help="video file (.mp4, .avi, ...), printf pattern such as out/%%05d.png, or a folder")
+    parser.add_argument("-p", "--pipeline", required=True,
+                        help='operations, e.g. "intensity_filters:grayscale=0.5:blur=3,rotate:angle=90"')
+    parser.add_argument("--queue", type=int, default=4, help="frames buffered between stages (default: 4)")
+    parser.add_argument("--fps", type=float, default=None, help="output frame rate (default: the source's, or 25)")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many frames")
+    parser.add_argument("--no-fuse", action="store_true",
+                        help="run every operation as its own pass instead of fusing neighbours")
+    parser.add_argument("--json", default=None, help="also write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    try:
+        operations = parse_pipeline(args.pipeline)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        report = run_stream(args.source, args.output, operations, queue_size=max(1, args.queue),
+                            fps=args.fps, limit=args.limit, fuse=not args.no_fuse)
+    except (ValueError, OSError, cv2.error) as e:
+        print(f"stream: {e}", file=sys.stderr)
+        return 1
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+# tiled_image.py
+#
+# Tiled image backend for images larger than RAM. Pixels live in a .npy file
+# and are only mapped one band of tiles at a time, so resident memory stays
+# around a few tiles however large the image is. Example:
+#
+#   python tiled_image.py scan.npy -o out.npy -p "blur:ksize=9,rotate:angle=90"
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from image_processor import ImageProcessor, operation_halo
+
+# Largest image save() hands to OpenCV's encoders, which need it all in memory
+MAX_ENCODE_BYTES = 1024 * 1024 * 1024
+
+
+class TiledImage:
+    """
+    An image stored in a memory-mapped .npy file and processed tile by tile.
+    Neighbourhood filters read each tile with a halo of surrounding pixels;
+    90/180/270 rotations and flips move whole tiles without any filtering.
+    Operations whose result is not local (see operation_halo: Canny edges,
+    background removal) are refused rather than run with seams.
+    Every operation returns a new TiledImage backed by its own file.
+    """
+
+    def __init__(self, path, tile_size=1024, temporary=False):
+        self._path = path
+        self._tile = tile_size
+        self._temporary = temporary
+        with open(path, "rb") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            self._offset = f.tell()
+        if fortran:
+            raise ValueError("Fortran-ordered arrays are not supported.")
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+
+    # Constructors
+    @classmethod
+    def create(cls, shape, dtype, path=None, tile_size=1024):
+        """Allocate an uninitialised image on disk (a temporary file if no path)."""
+        temporary = path is None
+        if temporary:
+            fd, path = tempfile.mkstemp(suffix=".npy", prefix="tiled-")
+            os.close(fd)
+        array = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=tuple(shape))
+        del array
+        return cls(path, tile_size, temporary)
+
+    @classmethod
+    def from_array(cls, image, path=None, tile_size=1024):
+        tiled = cls.create(image.shape, image.dtype, path, tile_size)
+        for y0, y1 in tiled._bands():
+            tiled.write(y0, 0, image[y0:y1])
+        return tiled
+
+    @classmethod
+    def open(cls, path, tile_size=1024, work_path=None):
+        """
+        Open an image file. A .npy file is used in place and never decoded.
+        Other formats have to be decoded in one piece by OpenCV, which needs the
+        whole image in memory once; the pixels are then moved to a .npy file and
+        released. Convert huge scans to .npy once to avoid that step.
+        """
+        if path.lower().endswith(".npy"):
+            return cls(path, tile_size)
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError("Could not load image.")
+        try:
+            return cls.from_array(image, work_path, tile_size)
+        finally:
+            del image
+
+    # Encapsulated getters
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def get_path(self):
+        return self._path
+
+    def get_dimensions(self):
+        h, w = self._shape[:2]
+        return w, h
+
+    # Pixel access
+    def read(self, y0, y1, x0, x1):
+        """Copy a region out of the file."""
+        band = self._map(y0, y1, "r")
+        try:
+            return np.array(band[:, x0:x1])
+        finally:
+            del band
+
+    def write(self, y0, x0, region):
+        h, w = region.shape[:2]
+        band = self._map(y0, y0 + h, "r+")
+        try:
+            band[:, x0:x0 + w] = region
+            band.flush()
+        finally:
+            del band
+
+    def tiles(self):
+        """(y0, y1, x0, x1) of every tile, row by row."""
+        h, w = self._shape[:2]
+        for y0 in range(0, h, self._tile):
+            for x0 in range(0, w, self._tile):
+                yield y0, min(y0 + self._tile, h), x0, min(x0 + self._tile, w)
+
+    def to_array(self):
+        """Load the whole image. Only for images that fit in memory."""
+        return self.read(0, self._shape[0], 0, self._shape[1])
+
+    # Processing
+    def map_tiles(self, fn, halo=0, path=None):
+        """
+        Return a new image made of fn(region) for every tile, where region is the
+        tile plus `halo` pixels of context on each side (clipped at the image
+        border, so border handling matches a whole-image call). fn must keep
+        the height and width of its input.
+        """
+        h, w = self._shape[:2]
+        out = None
+        for y0, y1, x0, x1 in self.tiles():
+            ry0, ry1 = max(0, y0 - halo), min(h, y1 + halo)
+            rx0, rx1 = max(0, x0 - halo), min(w, x1 + halo)
+            result = fn(self.read(ry0, ry1, rx0, rx1))
+            if out is None:
+                out = TiledImage.create((h, w) + result.shape[2:], result.dtype, path, self._tile)
+            out.write(y0, x0, result[y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0])
+        return out
+
+    def apply(self, name, path=None, processor=None, **params):
+        """Run a registered ImageProcessor operation tile by tile."""
+        processor = processor or ImageProcessor()
+        if name == "rotate":
+            return self.rotate(params.get("angle", 0), path)
+        if name == "flip":
+            return self.flip(params.get("mode", "horizontal"), path)
+        if name == "resize":
+            return self.resize(params.get("scale", 1.0), path, params.get("quality", "linear"))
+        halo = operation_halo(name, params)
+        if halo is None:
+            raise ValueError(f"{name} needs the whole image and cannot run on tiles.")
+        return self.map_tiles(lambda region: processor.apply(name, region, **params), halo, path)
+
+    def apply_all(self, operations, processor=None):
+        image = self
+        for name, params in operations:
+            result = image.apply(name, processor=processor, **params)
+            if image is not self:
+                image.close()
+            image = result
+        return image
+
+    def rotate(self, angle, path=None):
+        """Rotate by 90/180/270 degrees by moving rotated tiles to their new place."""
+        angle = angle % 360
+        if angle not in (90, 180, 270):
+            raise ValueError("Tiled rotation supports 90, 180 and 270 degrees.")
+        h, w = self._shape[:2]
+        code = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180,
+                270: cv2.ROTATE_90_COUNTERCLOCKWISE}[angle]
+        new_shape = ((w, h) if angle != 180 else (h, w)) + self._shape[2:]
+        out = TiledImage.create(new_shape, self._dtype, path, self._tile)
+        for y0, y1, x0, x1 in self.tiles():
+            tile = cv2.rotate(self.read(y0, y1, x0, x1), code)
+            if angle == 90:
+                out.write(x0, h - y1, tile)
+            elif angle == 180:
+                out.write(h - y1, w - x1, tile)
+            else:
+                out.write(w - x1, y0, tile)
+        return out
+
+    def flip(self, mode="horizontal", path=None):
+        if mode not in ("horizontal", "vertical"):
+            raise ValueError("Flip mode must be horizontal or vertical.")
+        h, w = self._shape[:2]
+        out = TiledImage.create(self._shape, self._dtype, path, self._tile)
+        for y0, y1, x0, x1 in self.tiles():
+            if mode == "horizontal":
+                out.write(y0, w - x1, cv2.flip(self.read(y0, y1, x0, x1), 1))
+            else:
+                out.write(h - y1, x0, cv2.flip(self.read(y0, y1, x0, x1), 0))
+        return out
+
+    def resize(self, scale, path=None, quality="linear"):
+        """
+        Bilinear resize, tile by tile, with the same output size and pixel centres
+        as cv2.resize(INTER_LINEAR). Each tile is sampled with cv2.warpAffine,
+        which quantises positions and weights more coarsely, so pixels can differ
+        from cv2.resize by one level. Only quality="linear" is supported.
+        """
+        if scale <= 0:
+            raise ValueError("Scale must be positive.")
+        if quality != "linear":
+            raise ValueError("Tiled resize supports quality=linear only.")
+        h, w = self._shape[:2]
+        new_w, new_h = int(w * scale), int(h * scale)
+        sx, sy = new_w / w, new_h / h
+        out = TiledImage.create((new_h, new_w) + self._shape[2:], self._dtype, path, self._tile)
+        for y0, y1, x0, x1 in out.tiles():
+            # Source pixels under this output tile, plus one for interpolation
+            sy0 = max(0, int(np.floor((y0 + 0.5) / sy - 0.5)) - 1)
+            sy1 = min(h, int(np.ceil((y1 - 0.5) / sy - 0.5)) + 2)
+            sx0 = max(0, int(np.floor((x0 + 0.5) / sx - 0.5)) - 1)
+            sx1 = min(w, int(np.ceil((x1 - 0.5) / sx - 0.5)) + 2)
+            # dst = s * (src + 0.5) - 0.5, shifted into the tile's local coordinates
+            matrix = np.array([[sx, 0, sx * (sx0 + 0.5) - 0.5 - x0],
+                               [0, sy, sy * (sy0 + 0.5) - 0.5 - y0]])
+            tile = cv2.warpAffine(self.read(sy0, sy1, sx0, sx1), matrix, (x1 - x0, y1 - y0),
+                                  flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            out.write(y0, x0, tile)
+        return out
+
+    def preview(self, max_size=1024):
+        """Downscaled copy for display, built one band at a time."""
+        h, w = self._shape[:2]
+        factor = max(1, int(np.ceil(max(h, w) / max_size)))
+        out_h, out_w = -(-h // factor), -(-w // factor)
+        result = np.zeros((out_h, out_w) + self._shape[2:], self._dtype)
+        step = max(factor, self._tile - self._tile % factor)
+        for y0 in range(0, h, step):
+            y1 = min(h, y0 + step)
+            band = self.read(y0, y1, 0, w)
+            small = cv2.resize(band, (-(-w // factor), -(-(y1 - y0) // factor)),
+                               interpolation=cv2.INTER_AREA)
+            result[y0 // factor:y0 // factor + small.shape[0]] = small.reshape(
+                small.shape[:2] + self._shape[2:])
+        return result
+
+    # Output and cleanup
+    def save(self, path, max_encode_bytes=MAX_ENCODE_BYTES):
+        """
+        Write to path. .npy is copied band by band. Other formats are encoded by
+        OpenCV in one call, which reads the whole image into memory, so they are
+        refused for images larger than max_encode_bytes; save those as .npy.
+        """
+        if path.lower().endswith(".npy"):
+            out = np.lib.format.open_memmap(path, mode="w+", dtype=self._dtype, shape=self._shape)
+            del out
+            target = TiledImage(path, self._tile)
+            for y0, y1 in self._bands():
+                target.write(y0, 0, self.read(y0, y1, 0, self._shape[1]))
+            return
+        size = int(np.prod(self._shape, dtype=np.int64)) * self._dtype.itemsize
+        if max_encode_bytes is not None and size > max_encode_bytes:
+            raise ValueError(f"{size / 2 ** 20:.0f} MB is too large to encode in memory "
+                             f"(limit {max_encode_bytes / 2 ** 20:.0f} MB); save as .npy instead.")
+        array = np.load(self._path, mmap_mode="r")
+        try:
+            if not cv2.imwrite(path, array):
+                raise ValueError(f"Could not write {path}.")
+        finally:
+            del array
+
+    def close(self):
+        if self._temporary and os.path.exists(self._path):
+            os.remove(self._path)
+        self._temporary = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Internal helpers
+    def _bands(self):
+        h = self._shape[0]
+        for y0 in range(0, h, self._tile):
+            yield y0, min(h, y0 + self._tile)
+
+    def _map(self, y0, y1, mode):
+        # Map only rows y0:y1; unmapping after each access returns the pages
+        row_bytes = int(np.prod(self._shape[1:], dtype=np.int64)) * self._dtype.itemsize
+        return np.memmap(self._path, dtype=self._dtype, mode=mode,
+                         offset=self._offset + y0 * row_bytes,
+                         shape=(y1 - y0,) + self._shape[1:])
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 if sys.platform != "darwin" else peak / (1024 * 1024)
+
+
+def main(argv=None):
+    from batch import parse_pipeline
+
+    parser = argparse.ArgumentParser(description="Process an image larger than RAM tile by tile.")
+    parser.add_argument("input", help="input image (.npy is opened without decoding)")
+    parser.add_argument("-o", "--output", required=True, help="output file (.npy or an image format)")
+    parser.add_argument("-p", "--pipeline", required=True, help='operations, e.g. "blur:ksize=9,rotate:angle=90"')
+    parser.add_argument("--tile", type=int, default=1024, help="tile size in pixels")
+    parser.add_argument("--max-encode-mb", type=float, default=MAX_ENCODE_BYTES / 2 ** 20,
+                        help="largest output encoded in memory for non-.npy formats")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    source = TiledImage.open(args.input, args.tile)
+    result = source.apply_all(parse_pipeline(args.pipeline))
+    result.save(args.output, int(args.max_encode_mb * 2 ** 20))
+    w, h = result.get_dimensions()
+    if result is not source:
+        result.close()
+    source.close()
+    peak = _peak_rss_mb()
+    print(f"{w}x{h} written to {args.output} in {time.perf_counter() - start:.2f}s"
+          + (f", peak RSS {peak:.0f} MB" if peak is not None else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
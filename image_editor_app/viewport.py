@@ -0,0 +1,236 @@
+# viewport.py
+
+import math
+
+import cv2
+import numpy as np
+
+MIN_LEVEL_SIDE = 256
+MAX_ZOOM = 16.0
+
+
+class ImagePyramid:
+    """
+    Mipmap levels of one image: level 0 is the image itself and each further
+    level is half the size of the one before (area averaged), down to about
+    MIN_LEVEL_SIDE pixels on the longest side. Built once per image, so any zoom
+    can be served from a level at most twice the size of what is shown.
+    """
+
+    def __init__(self, image, min_side=MIN_LEVEL_SIDE):
+        self._levels = [image]
+        h, w = image.shape[:2]
+        level = image
+        while max(level.shape[:2]) > min_side:
+            lh, lw = level.shape[:2]
+            level = cv2.resize(level, ((lw + 1) // 2, (lh + 1) // 2), interpolation=cv2.INTER_AREA)
+            level.setflags(write=False)
+            self._levels.append(level)
+        self._scales = [lvl.shape[1] / w for lvl in self._levels]
+
+    # Encapsulated getters
+    def get_source(self):
+        return self._levels[0]
+
+    def get_level_count(self):
+        return len(self._levels)
+
+    def get_level(self, index):
+        """(level image, scale relative to the source)."""
+        return self._levels[index], self._scales[index]
+
+    def get_nbytes(self):
+        return sum(level.nbytes for level in self._levels[1:])
+
+    def level_for(self, zoom):
+        """Index of the smallest level with at least `zoom` pixels per source
+        pixel, so the view is only ever shrunk from it by less than 2x."""
+        index = 0
+        for i, scale in enumerate(self._scales):
+            if scale >= zoom:
+                index = i
+        return index
+
+
+class Viewport:
+    """
+    Zoom and pan state of the canvas. zoom is display pixels per image pixel and
+    center is the image point shown at the middle of the canvas. In fit mode
+    (the default) the whole image is fitted to the canvas as before.
+    """
+
+    def __init__(self):
+        self._zoom = None
+        self._center = None
+
+    # Encapsulated getters
+    def is_fit(self):
+        return self._zoom is None
+
+    def get_zoom(self, image_size, canvas_size):
+        """Effective zoom, including the fitted zoom in fit mode."""
+        return fit_zoom(image_size, canvas_size) if self._zoom is None else self._zoom
+
+    def get_center(self, image_size):
+        w, h = image_size
+        return self._center if self._center is not None else (w / 2, h / 2)
+
+    # Core methods
+    def reset(self):
+        """Back to fit mode."""
+        self._zoom = None
+        self._center = None
+
+    def set_zoom(self, zoom, image_size, canvas_size, anchor=None):
+        """
+        Zoom to `zoom`, keeping the image point under canvas position `anchor`
+        (default: the canvas centre) where it is. Zooming out to the fitted
+        size or below returns to fit mode.
+        """
+        fitted = fit_zoom(image_size, canvas_size)
+        zoom = min(MAX_ZOOM, zoom)
+        if zoom <= fitted:
+            self.reset()
+            return
+        old_zoom = self.get_zoom(image_size, canvas_size)
+        cx, cy = self.get_center(image_size)
+        if anchor is not None:
+            # Image point under the anchor before and after must be the same
+            dx = anchor[0] - canvas_size[0] / 2
+            dy = anchor[1] - canvas_size[1] / 2
+            px, py = cx + dx / old_zoom, cy + dy / old_zoom
+            cx, cy = px - dx / zoom, py - dy / zoom
+        self._zoom = zoom
+        self._center = (cx, cy)
+        self.clamp(image_size, canvas_size)
+
+    def zoom_by(self, factor, image_size, canvas_size, anchor=None):
+        self.set_zoom(self.get_zoom(image_size, canvas_size) * factor, image_size, canvas_size, anchor)
+
+    def pan(self, dx, dy, image_size, canvas_size):
+        """Move the view by (dx, dy) canvas pixels, as when dragging the image."""
+        if self._zoom is None:
+            return
+        cx, cy = self.get_center(image_size)
+        self._center = (cx - dx / self._zoom, cy - dy / self._zoom)
+        self.clamp(image_size, canvas_size)
+
+    def to_image(self, point, image_size, canvas_size):
+        """Image coordinates (x, y) of canvas position point."""
+        zoom = self.get_zoom(image_size, canvas_size)
+        cx, cy = self.get_center(image_size)
+        return (cx + (point[0] - canvas_size[0] / 2) / zoom,
+                cy + (point[1] - canvas_size[1] / 2) / zoom)
+
+    def visible_region(self, image_size, canvas_size):
+        """
+        ((x0, y0, x1, y1), (left, top), (width, height)): the visible part of the
+        image in whole image pixels, where its top-left corner goes on the canvas
+        and its size there.
+        """
+        w, h = image_size
+        zoom = self.get_zoom(image_size, canvas_size)
+        cx, cy = self.get_center(image_size)
+        half_w = canvas_size[0] / 2 / zoom
+        half_h = canvas_size[1] / 2 / zoom
+        x0 = max(0, int(math.floor(cx - half_w)))
+        y0 = max(0, int(math.floor(cy - half_h)))
+        x1 = min(w, int(math.ceil(cx + half_w)))
+        y1 = min(h, int(math.ceil(cy + half_h)))
+        left = int(round((x0 - cx) * zoom + canvas_size[0] / 2))
+        top = int(round((y0 - cy) * zoom + canvas_size[1] / 2))
+        size = (max(1, int(round((x1 - x0) * zoom))), max(1, int(round((y1 - y0) * zoom))))
+        return (x0, y0, x1, y1), (left, top), size
+
+    def clamp(self, image_size, canvas_size):
+        """Keep the view on the image after the image or canvas changed size:
+        the image covers the canvas where it can and is centred where it cannot."""
+        if self._zoom is None:
+            return
+        if self._zoom <= fit_zoom(image_size, canvas_size):
+            self.reset()
+            return
+        w, h = image_size
+        cx, cy = self._center
+        half_w = canvas_size[0] / 2 / self._zoom
+        half_h = canvas_size[1] / 2 / self._zoom
+        cx = w / 2 if half_w * 2 >= w else min(max(cx, half_w), w - half_w)
+        cy = h / 2 if half_h * 2 >= h else min(max(cy, half_h), h - half_h)
+        self._center = (cx, cy)
+
+
+class RegionProxy:
+    """
+    Counterpart of PreviewProxy for a zoomed-in view. It keeps the pyramid of the
+    committed image and cuts out the visible region at the matching level, with a
+    halo of extra pixels so blur and edge kernels see the same neighbourhood as on
+    the whole image. The last cut-out is kept, so an unchanged view returns the
+    same array and results cached for it stay valid.
+    """
+
+    def __init__(self, min_side=MIN_LEVEL_SIDE):
+        self._min_side = min_side
+        self._pyramid = None
+        self._key = None
+        self._region = None
+
+    def get_pyramid(self, image):
+        if self._pyramid is None or self._pyramid.get_source() is not image:
+            self._pyramid = ImagePyramid(image, self._min_side)
+            self._key = None
+            self._region = None
+        return self._pyramid
+
+    def get(self, image, region, zoom, halo=None):
+        """
+        Cut region (x0, y0, x1, y1) of image out at the pyramid level for zoom.
+        halo(scale) gives the margin in level pixels the processing needs.
+        Returns (crop, scale, inner): the read-only crop, the level's scale and the
+        (rows, cols) slices of the crop that hold the region itself.
+        """
+        pyramid = self.get_pyramid(image)
+        index = pyramid.level_for(zoom)
+        level, scale = pyramid.get_level(index)
+        margin = halo(scale) if halo is not None else 0
+        key = (index, region, margin)
+        if key != self._key:
+            lh, lw = level.shape[:2]
+            x0, y0, x1, y1 = region
+            lx0, ly0 = int(math.floor(x0 * scale)), int(math.floor(y0 * scale))
+            lx1 = min(lw, max(lx0 + 1, int(math.ceil(x1 * scale))))
+            ly1 = min(lh, max(ly0 + 1, int(math.ceil(y1 * scale))))
+            hx0, hy0 = max(0, lx0 - margin), max(0, ly0 - margin)
+            hx1, hy1 = min(lw, lx1 + margin), min(lh, ly1 + margin)
+            crop = level[hy0:hy1, hx0:hx1].copy()
+            crop.setflags(write=False)
+            inner = (slice(ly0 - hy0, ly1 - hy0), slice(lx0 - hx0, lx1 - hx0))
+            self._key = key
+            self._region = (crop, scale, inner)
+        return self._region
+
+    def invalidate(self):
+        self._pyramid = None
+        self._key = None
+        self._region = None
+
+
+def fit_zoom(image_size, canvas_size):
+    """Zoom at which the whole image fits the canvas; never above 1, like fit_for_display."""
+    w, h = image_size
+    return min(1.0, canvas_size[0] / w, canvas_size[1] / h)
+
+
+def fit_region(processed, inner, size, dst=None):
+    """Trim the halo off a processed crop and scale it to the display size,
+    writing into dst (size[1], size[0], channels) if given."""
+    view = processed[inner]
+    if dst is not None and (dst.shape[1], dst.shape[0]) != size:
+        raise ValueError(f"dst is {dst.shape[1]}x{dst.shape[0]}, the display size is {size[0]}x{size[1]}.")
+    if (view.shape[1], view.shape[0]) == size:
+        if dst is None:
+            return view
+        np.copyto(dst, view)
+        return dst
+    shrinking = size[0] < view.shape[1]
+    # Nearest neighbour keeps pixels crisp when zoomed past 100%
+    return cv2.resize(view, size, dst=dst, interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_NEAREST)
@@ -0,0 +1,9 @@
+# conftest.py
+#
+# The app's modules import each other by bare name (they run from inside
+# image_editor_app), so the tests do the same.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "image_editor_app"))
@@ -0,0 +1,40 @@
+# test_batch.py
+
+import os
+
+import pytest
+
+from batch import output_paths
+
+
+def test_default_root_keeps_subfolders(tmp_path):
+    paths = [str(tmp_path / "a" / "photo.jpg"), str(tmp_path / "b" / "photo.jpg")]
+    targets = output_paths(paths, None, "out", None)
+
+    assert targets[paths[0]] == os.path.join("out", "a", "photo.jpg")
+    assert targets[paths[1]] == os.path.join("out", "b", "photo.jpg")
+
+
+def test_output_format_replaces_extension(tmp_path):
+    path = str(tmp_path / "photo.jpg")
+    assert output_paths([path], None, "out", ".png") == {path: os.path.join("out", "photo.png")}
+
+
+def test_same_name_in_one_folder_collides_with_new_format(tmp_path):
+    paths = [str(tmp_path / "photo.jpg"), str(tmp_path / "photo.png")]
+    # Kept formats stay apart
+    assert len(set(output_paths(paths, None, "out", None).values())) == 2
+    with pytest.raises(ValueError, match="both be written"):
+        output_paths(paths, None, "out", ".png")
+
+
+def test_explicit_root(tmp_path):
+    path = str(tmp_path / "a" / "b" / "photo.jpg")
+    targets = output_paths([path], str(tmp_path / "a"), "out", None)
+    assert targets[path] == os.path.join("out", "b", "photo.jpg")
+
+
+def test_input_outside_root_is_refused(tmp_path):
+    inside, outside = str(tmp_path / "in" / "x.png"), str(tmp_path / "other" / "y.png")
+    with pytest.raises(ValueError, match="outside the root"):
+        output_paths([inside, outside], str(tmp_path / "in"), "out", None)
@@ -0,0 +1,71 @@
+# test_image_writer.py
+
+import os
+import stat
+
+import cv2
+import numpy as np
+import pytest
+
+from image_writer import _UMASK, save_image, write_atomic
+
+
+def mode_of(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permission bits")
+def test_write_atomic_keeps_existing_permissions(tmp_path):
+    path = str(tmp_path / "image.png")
+    with open(path, "wb") as f:
+        f.write(b"old")
+    os.chmod(path, 0o640)
+
+    write_atomic(path, b"new contents")
+
+    assert mode_of(path) == 0o640
+    with open(path, "rb") as f:
+        assert f.read() == b"new contents"
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permission bits")
+def test_write_atomic_new_file_gets_umask_permissions(tmp_path):
+    path = str(tmp_path / "new.png")
+    write_atomic(path, [b"one", b"two"])
+
+    assert mode_of(path) == 0o666 & ~_UMASK
+    with open(path, "rb") as f:
+        assert f.read() == b"onetwo"
+
+
+def test_write_atomic_leaves_no_temporary_files(tmp_path):
+    path = str(tmp_path / "image.png")
+    fractions = []
+    write_atomic(path, b"x" * 1000, progress=fractions.append)
+
+    assert os.listdir(str(tmp_path)) == ["image.png"]
+    assert fractions[-1] == 1.0
+
+
+def test_failed_write_keeps_the_old_file(tmp_path):
+    path = str(tmp_path / "image.png")
+    with open(path, "wb") as f:
+        f.write(b"old")
+
+    def fail(fraction):
+        raise RuntimeError("disk full")
+
+    with pytest.raises(RuntimeError):
+        write_atomic(path, b"new", progress=fail)
+    assert os.listdir(str(tmp_path)) == ["image.png"]
+    with open(path, "rb") as f:
+        assert f.read() == b"old"
+
+
+def test_save_image_round_trip(tmp_path):
+    image = np.random.default_rng(3).integers(0, 256, (20, 30, 3), dtype=np.uint8)
+    path = str(tmp_path / "out.png")
+    report = save_image(image, path)
+
+    assert report["bytes"] == os.path.getsize(path)
+    assert np.array_equal(cv2.imread(path, cv2.IMREAD_UNCHANGED), image)
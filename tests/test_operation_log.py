@@ -0,0 +1,115 @@
+# test_operation_log.py
+
+import numpy as np
+import pytest
+
+from image_processor import ImageProcessor
+from operation_log import OperationLog
+
+BLUR = [("blur", {"ksize": 5})]
+FLIP = [("flip", {"mode": "horizontal"})]
+BRIGHTER = [("brightness_contrast", {"brightness": 30, "contrast": 1.0})]
+
+
+@pytest.fixture
+def processor():
+    return ImageProcessor()
+
+
+@pytest.fixture
+def image():
+    return np.random.default_rng(0).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+
+
+def record_all(log, processor, image, edits):
+    """Record each edit on top of the last and return every image, base first."""
+    images = [image]
+    for operations in edits:
+        after = processor.apply_all(images[-1], operations)
+        log.record(images[-1], after, operations)
+        images.append(after)
+    return images
+
+
+def test_undo_redo_goto(processor, image):
+    log = OperationLog(processor, checkpoint_interval=2)
+    log.reset(image)
+    images = record_all(log, processor, image, [BLUR, FLIP, BRIGHTER, BLUR])
+
+    assert np.array_equal(log.undo(), images[3])
+    assert np.array_equal(log.undo(), images[2])
+    assert np.array_equal(log.redo(), images[3])
+    for index in (0, 4, 1, 2):
+        assert np.array_equal(log.goto(index), images[index])
+        assert log.get_cursor() == index
+    assert log.can_undo() and log.can_redo()
+    with pytest.raises(IndexError):
+        log.goto(5)
+
+
+def test_record_after_undo_drops_redo_steps(processor, image):
+    log = OperationLog(processor)
+    log.reset(image)
+    record_all(log, processor, image, [BLUR, FLIP])
+    previous = log.undo()
+    after = processor.apply_all(previous, BRIGHTER)
+    log.record(previous, after, BRIGHTER)
+
+    assert len(log.get_steps()) == 2
+    assert not log.can_redo()
+    assert np.array_equal(log.goto(2), after)
+
+
+def test_pixel_edits_replay(processor, image):
+    log = OperationLog(processor)
+    log.reset(image)
+    painted = image.copy()
+    painted[10:20, 10:20] = 255
+    log.record(image, painted)
+
+    assert log.get_steps()[0].pixels is not None
+    assert np.array_equal(log.goto(0), image)
+    assert np.array_equal(log.goto(1), painted)
+
+
+def test_edit_and_remove_step(processor, image):
+    log = OperationLog(processor)
+    log.reset(image)
+    record_all(log, processor, image, [BLUR, FLIP])
+
+    edited = log.edit_step(1, BRIGHTER)
+    assert np.array_equal(edited, processor.apply_all(image, BRIGHTER + FLIP))
+    removed = log.remove_step(1)
+    assert np.array_equal(removed, processor.apply_all(image, FLIP))
+    assert log.get_cursor() == 1
+
+
+def test_budget_folds_oldest_steps_into_base(processor, image):
+    log = OperationLog(processor, budget_bytes=3 * image.nbytes)
+    log.reset(image)
+    # Noise does not compress, so every pixel step costs about an image
+    rng = np.random.default_rng(1)
+    edits = [rng.integers(0, 256, image.shape, dtype=np.uint8) for _ in range(6)]
+    before = image
+    for after in edits:
+        log.record(before, after)
+        before = after
+
+    usage = log.get_usage()
+    assert usage["bytes"] <= usage["budget"]
+    assert log.get_folded() > 0
+    assert len(log.get_steps()) + log.get_folded() == len(edits)
+    # The folded steps are part of the base now; the rest still undo
+    assert np.array_equal(log.get_base(), edits[log.get_folded() - 1])
+    assert np.array_equal(log.goto(log.get_cursor() - 1), edits[-2])
+
+
+def test_operation_steps_are_not_folded_while_within_budget(processor, image):
+    log = OperationLog(processor, budget_bytes=2 * image.nbytes)
+    log.reset(image)
+    images = record_all(log, processor, image, [BLUR] * 8)
+
+    # Operation steps cost no bytes, so only checkpoints are evicted
+    assert log.get_folded() == 0
+    assert np.array_equal(log.goto(1), images[1])
+    assert log.get_usage()["bytes"] <= 2 * image.nbytes
@@ -0,0 +1,75 @@
+# test_parallel.py
+
+import numpy as np
+import pytest
+
+from image_processor import ImageProcessor
+from parallel import ParallelExecutor
+
+OPERATIONS = [
+    ("grayscale", {}),
+    ("blur", {"ksize": 5}),
+    ("blur", {"ksize": 15}),
+    ("brightness_contrast", {"brightness": 20, "contrast": 1.3}),
+    ("point_ops", {"gamma": 1.5}),
+    ("intensity_filters", {"grayscale": 0.5, "blur": 3}),
+    ("intensity_filters", {"grayscale": 0.3, "blur": 2, "edge": 0.6}),
+    ("edges", {}),
+    ("rotate", {"angle": 90}),
+]
+
+
+@pytest.fixture(scope="module")
+def executor():
+    executor = ParallelExecutor(threads=4, min_pixels=1)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.fixture(scope="module")
+def image():
+    rng = np.random.default_rng(6)
+    return rng.integers(0, 256, (517, 203, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("name, params", OPERATIONS)
+def test_matches_image_processor(executor, image, name, params):
+    expected = ImageProcessor().apply(name, image, **params)
+    result = executor.apply(name, image, **params)
+
+    assert result.shape == expected.shape and result.dtype == expected.dtype
+    assert np.array_equal(result, expected)
+
+
+def test_blur_is_split_into_strips(executor, image):
+    executor.apply("blur", image, ksize=9)
+    assert executor.get_stats()["last_strips"] > 1
+
+
+def test_edges_run_whole(executor, image):
+    before = executor.get_stats()
+    executor.apply("edges", image)
+    after = executor.get_stats()
+    assert after["whole_runs"] == before["whole_runs"] + 1
+    assert after["parallel_runs"] == before["parallel_runs"]
+
+
+def test_writes_into_dst(executor, image):
+    dst = np.empty_like(image)
+    result = executor.apply("blur", image, dst=dst, ksize=7)
+    assert result is dst
+    assert np.array_equal(dst, ImageProcessor().blur(image, ksize=7))
+
+
+def test_apply_all_matches(executor, image):
+    operations = [("blur", {"ksize": 5}), ("brightness_contrast", {"brightness": -10, "contrast": 1.1})]
+    assert np.array_equal(executor.apply_all(image, operations), ImageProcessor().apply_all(image, operations))
+
+
+def test_small_images_run_whole(image):
+    executor = ParallelExecutor(threads=4)
+    try:
+        executor.apply("blur", image, ksize=5)
+        assert executor.get_stats()["parallel_runs"] == 0
+    finally:
+        executor.shutdown()
@@ -0,0 +1,66 @@
+# test_pipeline_planner.py
+
+import numpy as np
+import pytest
+
+from image_processor import ImageProcessor
+from pipeline_planner import benchmark, plan_pipeline, run_fused
+
+EXACT_PIPELINES = [
+    [("rotate", {"angle": 90}), ("flip", {"mode": "horizontal"}), ("rotate", {"angle": 270}),
+     ("flip", {"mode": "vertical"})],
+    [("flip", {"mode": "horizontal"}), ("resize", {"scale": 0.5}), ("resize", {"scale": 1.7}),
+     ("rotate", {"angle": 90})],
+    [("brightness_contrast", {"brightness": 20, "contrast": 1.3}),
+     ("brightness_contrast", {"brightness": -15, "contrast": 0.8}),
+     ("point_ops", {"gamma": 1.4, "levels": (10, 240, 0, 255)})],
+    [("rotate", {"angle": 0}), ("blur", {"ksize": 5}), ("brightness_contrast", {}),
+     ("rotate", {"angle": 30})],
+]
+
+
+def make_image(dtype, channels):
+    rng = np.random.default_rng(2)
+    top = 256 if dtype == np.uint8 else 65536
+    return rng.integers(0, top, (37, 53, channels)).astype(dtype)
+
+
+@pytest.mark.parametrize("operations", EXACT_PIPELINES)
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+@pytest.mark.parametrize("channels", [3, 4])
+def test_fused_matches_unfused(operations, dtype, channels):
+    processor = ImageProcessor()
+    image = make_image(dtype, channels)
+    fused = run_fused(image, operations, processor)
+    plain = processor.apply_all(image, operations)
+
+    assert fused.shape == plain.shape and fused.dtype == plain.dtype
+    assert np.array_equal(fused, plain)
+
+
+def test_runs_are_fused_into_fewer_passes():
+    plan = plan_pipeline(EXACT_PIPELINES[0] + EXACT_PIPELINES[2], (37, 53, 3))
+    assert len(plan.get_passes()) == 2
+
+
+def test_resizes_are_not_merged():
+    plan = plan_pipeline(EXACT_PIPELINES[1], (37, 53, 3))
+    assert len(plan.get_passes()) == 4
+
+
+def test_color_matrix_within_one_level():
+    processor = ImageProcessor()
+    image = make_image(np.uint8, 3)
+    operations = [("grayscale", {}), ("brightness_contrast", {"brightness": 10, "contrast": 1.1})]
+    fused = run_fused(image, operations, processor)
+    plain = processor.apply_all(image, operations)
+
+    assert np.abs(fused.astype(np.int32) - plain.astype(np.int32)).max() <= 1
+
+
+def test_benchmark_reports_both_plans():
+    report = benchmark(EXACT_PIPELINES[2], shape=(64, 64, 3), repeat=1)
+
+    assert report["max_abs_difference"] == 0
+    assert report["unfused"]["passes"] == 3 and report["fused"]["passes"] == 1
+    assert report["fused"]["output_bytes"] < report["unfused"]["output_bytes"]
@@ -0,0 +1,60 @@
+# test_server.py
+
+import numpy as np
+import pytest
+
+from client import ProcessingClient, ServerError, shared_memory
+from image_processor import ImageProcessor
+from server import ProcessingServer
+
+PIPELINE = [("blur", {"ksize": 5}), ("rotate", {"angle": 90}),
+            ("brightness_contrast", {"brightness": 10, "contrast": 1.2})]
+
+TRANSPORTS = [
+    pytest.param(False, id="raw"),
+    pytest.param(True, id="shared_memory",
+                 marks=pytest.mark.skipif(shared_memory is None, reason="needs Python 3.8")),
+]
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = ProcessingServer(port=0, workers=2).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def client(server):
+    host, port = server.get_address()[:2]
+    with ProcessingClient(host, port, timeout=30.0) as client:
+        yield client
+
+
+@pytest.mark.parametrize("shared", TRANSPORTS)
+@pytest.mark.parametrize("shape, dtype", [((30, 50, 3), np.uint8), ((30, 50, 4), np.uint8),
+                                          ((30, 50, 3), np.uint16)])
+def test_round_trip_matches_local_processing(client, shared, shape, dtype):
+    top = 256 if dtype == np.uint8 else 65536
+    image = np.random.default_rng(5).integers(0, top, shape).astype(dtype)
+
+    result = client.apply(image, PIPELINE, shared_memory=shared)
+
+    expected = ImageProcessor().apply_all(image, PIPELINE)
+    assert result.shape == expected.shape and result.dtype == expected.dtype
+    assert np.array_equal(result, expected)
+
+
+@pytest.mark.parametrize("shared", TRANSPORTS)
+def test_unknown_operation_is_rejected(client, shared):
+    image = np.zeros((8, 8, 3), np.uint8)
+    with pytest.raises(ServerError) as info:
+        client.apply(image, [("no_such_operation", {})], shared_memory=shared)
+    assert 400 <= info.value.status < 500
+
+
+def test_operations_and_stats(client):
+    assert "blur" in client.operations()
+    client.apply(np.zeros((8, 8, 3), np.uint8), [("flip", {})])
+    stats = client.stats()
+    assert stats["completed"] >= 1 and stats["workers"] == 2
@@ -0,0 +1,197 @@
+# test_session.py
+
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from image_model import ImageModel
+from image_processor import ImageProcessor
+from operation_log import EditStep, OperationLog
+from session import JOURNAL_EXTENSION, Journal, open_session, read_journal, write_session
+
+BLUR = [("blur", {"ksize": 5})]
+FLIP = [("flip", {"mode": "vertical"})]
+
+
+@pytest.fixture
+def image():
+    return np.random.default_rng(4).integers(0, 256, (40, 60, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def photo(tmp_path, image):
+    path = str(tmp_path / "photo.png")
+    cv2.imwrite(path, image)
+    return path
+
+
+def edit(model, operations):
+    model.apply_change(ImageProcessor().apply_all(model.get_image(), operations), operations)
+
+
+def paint(model):
+    painted = model.get_image().copy()
+    painted[5:15, 5:25] = (0, 0, 255)
+    model.apply_change(painted)
+
+
+def journal_file(folder):
+    names = [name for name in os.listdir(folder) if name.endswith(JOURNAL_EXTENSION)]
+    assert len(names) == 1
+    return os.path.join(folder, names[0])
+
+
+def recovered_image(path):
+    source_path, base, steps, cursor = read_journal(path)
+    log = OperationLog(ImageProcessor())
+    return source_path, log.load(base, steps, cursor)
+
+
+# ---------- Session files ----------
+
+def test_session_round_trip(tmp_path, image):
+    processor = ImageProcessor()
+    log = OperationLog(processor)
+    log.reset(image)
+    blurred = processor.apply_all(image, BLUR)
+    log.record(image, blurred, BLUR, cost=0.5)
+    painted = blurred.copy()
+    painted[0:10] = 7
+    log.record(blurred, painted)
+    log.undo()
+    path = str(tmp_path / "edit.imgsession")
+
+    write_session(path, image, log.get_steps(), log.get_cursor(), {1: blurred}, source_path="photo.png")
+    session = open_session(path)
+
+    assert session.get_source_path() == "photo.png"
+    assert session.get_cursor() == 1
+    assert isinstance(session.get_base(), np.memmap)
+    assert np.array_equal(session.get_base(), image)
+    assert np.array_equal(session.get_checkpoints()[1], blurred)
+    steps = session.get_steps()
+    assert steps[0].operations == BLUR and steps[0].cost == 0.5
+    restored = OperationLog(processor)
+    assert np.array_equal(restored.load(session.get_base(), steps, 1, session.get_checkpoints()), blurred)
+    assert np.array_equal(restored.redo(), painted)
+
+
+def test_model_session_round_trip(tmp_path, photo):
+    model = ImageModel()
+    model.load_image(photo)
+    edit(model, BLUR)
+    paint(model)
+    edit(model, FLIP)
+    model.undo()
+    path = str(tmp_path / "edit.imgsession")
+    model.save_session(path)
+
+    reopened = ImageModel()
+    reopened.load_session(path)
+    assert reopened.get_filename() == photo
+    assert np.array_equal(reopened.get_image(), model.get_image())
+    assert reopened.get_history() == model.get_history()
+    reopened.redo()
+    model.redo()
+    assert np.array_equal(reopened.get_image(), model.get_image())
+
+
+def test_not_a_session_file(tmp_path):
+    path = str(tmp_path / "bad.imgsession")
+    with open(path, "wb") as f:
+        f.write(b"something else")
+    with pytest.raises(ValueError):
+        open_session(path)
+
+
+# ---------- Crash-recovery journal ----------
+
+def test_journal_recovers_history(tmp_path, photo):
+    folder = str(tmp_path / "recovery")
+    journal = Journal(folder)
+    model = ImageModel(journal=journal)
+    model.load_image(photo)
+    edit(model, BLUR)
+    paint(model)
+    edit(model, FLIP)
+    model.undo()
+    model.edit_step(1, [("blur", {"ksize": 9})])
+    journal.close(discard=False)
+
+    path = journal_file(folder)
+    source_path, image = recovered_image(path)
+    assert source_path == photo
+    assert np.array_equal(image, model.get_image())
+
+    recovered = ImageModel()
+    recovered.recover(path)
+    assert recovered.get_history() == model.get_history()
+    assert np.array_equal(recovered.get_image(), model.get_image())
+
+
+def test_journal_references_decoded_file(tmp_path, photo, image):
+    folder = str(tmp_path / "recovery")
+    journal = Journal(folder)
+    model = ImageModel(journal=journal)
+    model.load_image(photo)
+    edit(model, BLUR)
+    journal.close(discard=False)
+
+    # Only a reference to the opened file is logged, not its pixels
+    assert os.path.getsize(journal_file(folder)) < image.nbytes
+    assert np.array_equal(recovered_image(journal_file(folder))[1], model.get_image())
+
+
+def test_journal_survives_saving_over_the_source(tmp_path, photo):
+    folder = str(tmp_path / "recovery")
+    journal = Journal(folder)
+    model = ImageModel(journal=journal)
+    model.load_image(photo)
+    edit(model, BLUR)
+    model.save_image()
+    edit(model, FLIP)
+    journal.close(discard=False)
+
+    assert np.array_equal(recovered_image(journal_file(folder))[1], model.get_image())
+
+
+def test_journal_refuses_changed_source(tmp_path, photo):
+    folder = str(tmp_path / "recovery")
+    journal = Journal(folder)
+    model = ImageModel(journal=journal)
+    model.load_image(photo)
+    edit(model, BLUR)
+    journal.close(discard=False)
+    cv2.imwrite(photo, np.zeros((10, 10, 3), np.uint8))
+
+    with pytest.raises(ValueError, match="has changed"):
+        read_journal(journal_file(folder))
+
+
+def test_journal_ignores_cut_short_record(tmp_path, image):
+    folder = str(tmp_path / "recovery")
+    journal = Journal(folder)
+    journal.start(image)
+    journal.record(1, EditStep(BLUR))
+    journal.record(2, EditStep(FLIP))
+    journal.cursor(2)
+    journal.close(discard=False)
+    path = journal_file(folder)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+
+    _, base, steps, cursor = read_journal(path)
+    assert np.array_equal(base, image)
+    assert [step.operations for step in steps] == [BLUR, FLIP]
+    assert cursor == 2
+
+
+def test_clean_close_deletes_journal(tmp_path, image):
+    folder = str(tmp_path / "recovery")
+    journal = Journal(folder)
+    journal.start(image)
+    journal.record(1, EditStep(BLUR))
+    journal.close()
+    assert os.listdir(folder) == []